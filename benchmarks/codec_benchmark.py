@@ -0,0 +1,91 @@
+"""
+Compares the JSON codec backends on typical OLAF messages.
+
+Usage: python benchmarks/codec_benchmark.py [iterations]
+"""
+import base64
+import json
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from protocol.codec import Codec, OrjsonCodec, orjson
+
+PEM = "-----BEGIN PUBLIC KEY-----\n" + "\n".join(["MIIBIjANBgkqhkiG9w0BAQEFAAOCAQ8AMIIBCgKCAQEAuvqFsOh/ek6bLlAKzhm0"] * 6) + "\n-----END PUBLIC KEY-----\n"
+SIGNATURE = base64.b64encode(os.urandom(256)).decode()
+
+MESSAGES = {
+    "public_chat": {
+        "type": "signed_data",
+        "data": {"type": "public_chat", "sender": base64.b64encode(os.urandom(32)).decode(), "message": "Hello everyone!" * 4},
+        "counter": 12,
+        "signature": SIGNATURE,
+    },
+    "chat": {
+        "type": "signed_data",
+        "data": {
+            "type": "chat",
+            "destination_servers": ["server1:9000", "server2:8000"],
+            "iv": base64.b64encode(os.urandom(16)).decode(),
+            "symm_keys": [base64.b64encode(os.urandom(256)).decode() for _ in range(3)],
+            "chat": base64.b64encode(os.urandom(512)).decode(),
+        },
+        "counter": 13,
+        "signature": SIGNATURE,
+    },
+    "client_list (200 keys)": {
+        "type": "client_list",
+        "servers": [{"address": f"server{i}:9000", "clients": [PEM] * 50} for i in range(4)],
+    },
+}
+
+
+def legacy_signed_frame(data: dict, counter: int) -> str:
+    """
+    Signed frame as built before the codec layer: canonical dump for signing, then a second full dump.
+    """
+    message = {"data": data, "counter": counter}
+    json.dumps(message, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    return json.dumps({"type": "signed_data", "data": data, "counter": counter, "signature": SIGNATURE})
+
+
+def codec_signed_frame(codec: Codec, data: dict, counter: int):
+    data_json = codec.canonical(data)
+    codec.signing_payload(data_json, counter)
+    return codec.signed_frame(data_json, counter, SIGNATURE)
+
+
+def run(label: str, function, iterations: int) -> float:
+    seconds = timeit.timeit(function, number=iterations)
+    per_call = seconds / iterations * 1e6
+    print(f"  {label:<38} {per_call:10.2f} us")
+    return per_call
+
+
+def main(iterations: int) -> None:
+    codecs = [Codec()]
+    if orjson is not None:
+        codecs.append(OrjsonCodec())
+    else:
+        print("orjson is not installed, only the stdlib backend is measured.\n")
+
+    for name, message in MESSAGES.items():
+        encoded = json.dumps(message)
+        print(f"{name} ({len(encoded)} bytes)")
+        run("legacy json.dumps", lambda: json.dumps(message), iterations)
+        run("legacy json.loads", lambda: json.loads(encoded), iterations)
+        for codec in codecs:
+            run(f"{codec.name} encode", lambda: codec.encode(message), iterations)
+            run(f"{codec.name} decode", lambda: codec.decode(encoded), iterations)
+
+        if message["type"] == "signed_data":
+            data, counter = message["data"], message["counter"]
+            run("legacy signed frame", lambda: legacy_signed_frame(data, counter), iterations)
+            for codec in codecs:
+                run(f"{codec.name} signed frame", lambda: codec_signed_frame(codec, data, counter), iterations)
+        print()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,80 @@
+"""
+Bandwidth versus CPU for websocket and HTTP compression settings.
+
+For each permessage-deflate setting, a stream of typical OLAF messages is sent
+through the extension (with context takeover, as on a live connection) and the
+bytes on the wire and time spent compressing are reported. HTTP content
+encodings are compared on a text file.
+
+Usage: python benchmarks/compression_benchmark.py [messages]
+"""
+import base64
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from websockets.frames import Frame, OP_TEXT
+from protocol.compression import ThresholdPerMessageDeflate, compress_body, http_encodings
+
+from codec_benchmark import MESSAGES, PEM
+
+SETTINGS = [
+    # (label, window_bits, mem_level, level, min_size)
+    ("default (12 bits, mem 5, level 6)", 12, 5, 6, 0),
+    ("threshold 128", 12, 5, 6, 128),
+    ("fast (level 1)", 12, 5, 1, 128),
+    ("small window (9 bits, mem 1)", 9, 1, 6, 128),
+    ("large window (15 bits, mem 8)", 15, 8, 6, 128),
+    ("max (15 bits, mem 9, level 9)", 15, 9, 9, 128),
+]
+
+
+def sample_stream(count: int) -> list:
+    """
+    A mix of small public chats, private chats and the occasional client_list.
+    """
+    frames = []
+    for i in range(count):
+        if i % 20 == 0:
+            message = MESSAGES["client_list (200 keys)"]
+        elif i % 3 == 0:
+            message = MESSAGES["chat"]
+        else:
+            message = {"type": "signed_data", "data": {"type": "public_chat", "sender": "abc=", "message": f"hi {i}"},
+                       "counter": i, "signature": base64.b64encode(os.urandom(64)).decode()}
+        frames.append(json.dumps(message).encode())
+    return frames
+
+
+def run_websocket(frames: list) -> None:
+    raw = sum(len(frame) for frame in frames)
+    print(f"permessage-deflate over {len(frames)} messages, {raw} bytes uncompressed")
+    print(f"  {'setting':<36} {'wire bytes':>12} {'ratio':>7} {'us/msg':>8}")
+    print(f"  {'off':<36} {raw:>12} {1.0:>7.3f} {0.0:>8.2f}")
+
+    for label, window_bits, mem_level, level, min_size in SETTINGS:
+        extension = ThresholdPerMessageDeflate(False, False, window_bits, window_bits,
+                                               {"memLevel": mem_level, "level": level}, min_size=min_size)
+        started = time.perf_counter()
+        wire = sum(len(extension.encode(Frame(OP_TEXT, frame)).data) for frame in frames)
+        per_message = (time.perf_counter() - started) / len(frames) * 1e6
+        print(f"  {label:<36} {wire:>12} {wire / raw:>7.3f} {per_message:>8.2f}")
+    print()
+
+
+def run_http() -> None:
+    text = ("\n".join(f"line {i}: {PEM}" for i in range(200))).encode()
+    print(f"HTTP content encoding of a {len(text)} byte text file")
+    for encoding in http_encodings():
+        started = time.perf_counter()
+        compressed = compress_body(text, encoding)
+        elapsed = (time.perf_counter() - started) * 1e3
+        print(f"  {encoding:<36} {len(compressed):>12} {len(compressed) / len(text):>7.3f} {elapsed:>7.2f}ms")
+    print()
+
+
+if __name__ == "__main__":
+    run_websocket(sample_stream(int(sys.argv[1]) if len(sys.argv) > 1 else 500))
+    run_http()
@@ -0,0 +1,50 @@
+"""
+Compares the per-message cost of the key algorithm suites.
+
+A chat costs the sender one signature and one key wrap per recipient, and the
+recipient one key unwrap. Key generation is paid once per identity.
+
+Usage: python benchmarks/crypto_benchmark.py [iterations]
+"""
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from security.security_module import Encryption, SUITES
+
+MESSAGE = os.urandom(1024)
+
+
+def run(label: str, function, iterations: int) -> float:
+    seconds = timeit.timeit(function, number=iterations)
+    per_call = seconds / iterations * 1e6
+    print(f"  {label:<38} {per_call:10.2f} us")
+    return per_call
+
+
+def main(iterations: int) -> None:
+    for name in SUITES:
+        encryption = Encryption(name)
+        private_key = encryption.generate_private_key()
+        public_key = private_key.public_key()
+        public_pem = encryption.export_public_key(public_key)
+        aes_key = encryption.generate_aes_key()
+        signature = encryption.sign_message_with_key(MESSAGE, private_key)
+        wrapped = encryption.wrap_key(aes_key, public_key)
+
+        print(f"{name} (public key {len(public_pem)} bytes PEM, signature {len(signature)} bytes, "
+              f"wrapped key {len(wrapped)} bytes)")
+        run("generate key", encryption.generate_private_key, max(1, iterations // 50))
+        run("sign", lambda: encryption.sign_message_with_key(MESSAGE, private_key), iterations)
+        run("verify", lambda: encryption.verify_signature(MESSAGE, signature, public_key), iterations)
+        run("wrap key", lambda: encryption.wrap_key(aes_key, public_key), iterations)
+        run("unwrap key", lambda: encryption.unwrap_key(wrapped, private_key), iterations)
+        run("chat to 1 recipient (sign + wrap)",
+                   lambda: (encryption.sign_message_with_key(MESSAGE, private_key),
+                            encryption.wrap_key(aes_key, public_key)), iterations)
+        print()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
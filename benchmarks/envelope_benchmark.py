@@ -0,0 +1,95 @@
+"""
+Compares chats sent as JSON signed_data with binary chat envelopes: frame
+size, encoding and decoding on clients, and the work a server does to route
+and relay a chat.
+
+Usage: python benchmarks/envelope_benchmark.py [iterations]
+"""
+import base64
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from protocol.codec import codec
+from protocol.envelope import ChatEnvelope, encode_chat_envelope
+
+SIGNATURE = os.urandom(256)
+
+# (label, recipients, plaintext size)
+CHATS = [
+    ("1 recipient, short message", 1, 128),
+    ("5 recipients, short message", 5, 128),
+    ("1 recipient, 64 KiB message", 1, 64 * 1024),
+]
+
+
+def chat_data(recipients: int, size: int) -> dict:
+    return {
+        "type": "chat",
+        "destination_servers": ["server1:9000", "server2:8000"],
+        "iv": base64.b64encode(os.urandom(12)).decode(),
+        "symm_keys": [base64.b64encode(os.urandom(256)).decode() for _ in range(recipients)],
+        "chat": base64.b64encode(os.urandom(size + 16)).decode(),
+    }
+
+
+def json_frame(data: dict, counter: int) -> bytes:
+    return codec.encode_bytes({"type": "signed_data", "data": data, "counter": counter,
+                               "signature": base64.b64encode(SIGNATURE).decode()})
+
+
+def json_open(frame: bytes) -> tuple:
+    """
+    What a client does with a received JSON chat before decrypting it.
+    """
+    data = codec.decode(frame)["data"]
+    return (base64.b64decode(data["iv"]), [base64.b64decode(symm_key) for symm_key in data["symm_keys"]],
+            base64.b64decode(data["chat"]))
+
+
+def json_relay(frame: bytes) -> bytes:
+    """
+    What a server does to relay a JSON chat to a neighbour: decode it, then encode it with relay fields.
+    """
+    message = codec.decode(frame)
+    message["data"]["destination_servers"]
+    message.update(msg_id="abc", hops=1)
+    return codec.encode_bytes(message)
+
+
+def envelope_relay(frame: bytes) -> bytes:
+    envelope = ChatEnvelope.parse(frame)
+    envelope.data["destination_servers"]
+    return envelope.relayed("abc", 1, None)
+
+
+def run(label: str, function, iterations: int) -> float:
+    seconds = timeit.timeit(function, number=iterations)
+    per_call = seconds / iterations * 1e6
+    print(f"  {label:<38} {per_call:10.2f} us")
+    return per_call
+
+
+def main(iterations: int) -> None:
+    print(f"JSON backend: {codec.name}\n")
+    for label, recipients, size in CHATS:
+        data = chat_data(recipients, size)
+        json_bytes = json_frame(data, 7)
+        envelope = encode_chat_envelope(data, 7, SIGNATURE)
+        print(f"{label}: JSON {len(json_bytes)} bytes, envelope {len(envelope)} bytes "
+              f"({100 * (1 - len(envelope) / len(json_bytes)):.0f}% smaller)")
+
+        run("JSON frame from signed data", lambda: json_frame(data, 7), iterations)
+        run("envelope from signed data", lambda: encode_chat_envelope(data, 7, SIGNATURE), iterations)
+        run("JSON client decode", lambda: json_open(json_bytes), iterations)
+        run("envelope client decode", lambda: ChatEnvelope.parse(envelope).body(), iterations)
+        run("JSON server relay", lambda: json_relay(json_bytes), iterations)
+        run("envelope server relay", lambda: envelope_relay(envelope), iterations)
+        run("envelope to JSON for stock peers", lambda: codec.encode(ChatEnvelope.parse(envelope).signed_data()),
+            iterations)
+        print()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -1,4 +1,3 @@
-import json
 import base64
 import asyncio
 import aioconsole
@@ -8,25 +7,130 @@ import aiohttp
 import sys
 import os
 import html
+import time
+from collections import deque
+from typing import NamedTuple
 from urllib.parse import urlparse
-from nickname_generator import generate_nickname
 
 # Modify sys.path in the script to recognise packages in root dir.
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from security.security_module import Encryption
+try:
+    from nickname_generator import generate_nickname
+    from identity_store import IdentityStore
+    from reconnect import ReconnectPolicy, ReconnectStats
+except ImportError:
+    # Imported as the client package rather than run from the client directory
+    from client.nickname_generator import generate_nickname
+    from client.identity_store import IdentityStore
+    from client.reconnect import ReconnectPolicy, ReconnectStats
+from security.security_module import Encryption, SUITE_RSA
+from security.async_encryption import AsyncEncryption
+from security.stream_encryption import (ChunkDecryptor, DEFAULT_CHUNK_SIZE, encrypt_file, file_key_fragment,
+                                        split_file_url)
+from protocol.codec import codec, DecodeError
+from protocol.compression import CompressionSettings, is_compressible
+from protocol.membership import membership_digest
+from protocol.batching import BATCH_TYPE, unpack_batch
+from protocol.envelope import ChatEnvelope, encode_chat_envelope, is_envelope
+from protocol.capabilities import (CAP_BATCH, CAP_LIST_DIGEST, CAP_KEY_REQUEST, CAP_BINARY_CHAT, CAP_GROUPS,
+                                   CAP_REDIRECT, parse_capabilities, capabilities_field)
 
 GREEN = "\033[92m"
 RESET = "\033[0m"
 
-# Configure the logger
-logging.basicConfig(level=logging.INFO)
+# Inbound events kept for a client nobody is reading events from
+DEFAULT_EVENT_QUEUE_SIZE = 1024
+
+# Protocol extensions this client understands, advertised in its hello
+CLIENT_CAPABILITIES = frozenset({CAP_BATCH, CAP_LIST_DIGEST, CAP_KEY_REQUEST, CAP_BINARY_CHAT, CAP_GROUPS, CAP_REDIRECT})
+
+# Chats to a group reuse one wrapped key for at most this many messages
+GROUP_KEY_MAX_MESSAGES = 10000
+
+PROMPT = "Enter message type (public, chat, clients, /transfer, /download, /join, /leave, /group, files) (exit to exit): "
+
+
 logger = logging.getLogger(__name__)
 
+class ChatResult(NamedTuple):
+    """
+    Outcome of one chat of a batch. sent means the message was written to the
+    connection, or buffered while reconnecting; error says why it was not.
+    """
+    recipients: list
+    chat: str
+    sent: bool
+    error: str | None = None
+
+
+class GroupKey(NamedTuple):
+    """
+    The AES key chats to a group are encrypted with, wrapped for recipients.
+    """
+    recipients: tuple
+    aes_key: bytes
+    symm_keys: list
+    uses: int
+
+
+class ClientEvent(NamedTuple):
+    """
+    Something received from the server.
+
+    type is "public_chat" or "chat" (sender is the sender's fingerprint, and
+    group the group for chats to a group), "client_list" after the list of
+    clients changed, "group_members" after the members of group changed or
+    this client joined or left it, "redirected" after the server sent this
+    client to a less loaded server, "reconnecting" when the
+    connection was lost and "reconnected" once it is back, or "disconnected"
+    once the client is closed or gives up reconnecting, which is always the
+    last event.
+    """
+    type: str
+    sender: str | None = None
+    nickname: str | None = None
+    message: str | None = None
+    group: str | None = None
+
+
 class Client:
-    def __init__(self):
-        self.server_address = None
-        self.http_port = None  
-        self.encryption = Encryption()
+    """
+    An OLAF client.
+
+    Run interactively with start(), or use it as a library:
+
+        async with Client("localhost:9000", 9001) as client:
+            await client.request_client_list()
+            async for event in client.events():
+                ...
+
+    Inbound events go to on_event if given (a function or coroutine function
+    taking a ClientEvent), otherwise to a queue of at most event_queue_size
+    events read with events(); the oldest events are dropped when it is full.
+    Clients do not create event loops or threads of their own, so any number
+    of them can run on one loop.
+
+    The key pair is read from identity (an IdentityStore) if given, taken
+    from key_pool (a KeyPool shared by many clients) if given, or generated.
+
+    A lost connection is re-established following reconnect (a
+    ReconnectPolicy, read from the environment by default) with the same key
+    and counter. Messages sent in the meantime are buffered and sent once it
+    is back, and the client list is only sent again if it changed.
+    """
+    def __init__(self, server_address: str | None = None, http_port: int | str | None = None,
+                 on_event=None, event_queue_size: int = DEFAULT_EVENT_QUEUE_SIZE,
+                 identity: IdentityStore | None = None, key_pool=None, reconnect: ReconnectPolicy | None = None):
+        if server_address is not None and "://" not in server_address:
+            server_address = f"ws://{server_address}"
+        self.server_address = server_address
+        self.http_port = http_port
+        self.identity = identity
+        self.key_pool = key_pool
+        # Algorithm suite of a newly generated identity, RSA unless OLAF_KEY_SUITE says otherwise
+        self.encryption = Encryption(os.getenv('OLAF_KEY_SUITE', SUITE_RSA))
+        # Signs and wraps keys off the event loop
+        self.crypto = AsyncEncryption.from_env()
         self.connection = None
         self.counter = 0
         self.public_key = None
@@ -34,30 +138,142 @@ class Client:
         self.private_key_pem = None
         self.public_key_pem = None
         self.received_messages = []
-        self.clients = {} # {fingerprint: public_key}
+        self.clients = {} # {fingerprint: public_key}, None until fetched with key_request
         self.server_fingerprints = {} # {fingerprint: server_address}
         self.nicknames = {} # {fingerprint: nickname}    
-        self.loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(self.loop)
-        
+        self.known_keys = {} # {fingerprint: public_key_pem}, every key seen on this connection
+        self.loaded_keys = {} # {fingerprint: public_key}
+        self.key_fingerprints = {} # {public_key_pem_str: fingerprint}
+        # "der" asks the server for compact client lists, "pem" for the standard ones,
+        # "fingerprint" for lists without keys, which are then fetched when needed
+        self.key_format = os.getenv('OLAF_KEY_FORMAT', 'der')
+        self.key_requests = {} # {fingerprint: future}, key_request answers awaited
+        self.groups = {} # {group: [fingerprint, ...]} of the groups this client is in
+        self.group_keys = {} # {group: GroupKey}, reused until the recipients change
+        # Files shared with private recipients only are encrypted end to end
+        self.encrypt_files = os.getenv('OLAF_ENCRYPT_FILES', 'on').lower() not in ('off', '0', 'false')
+        self.file_chunk_size = int(os.getenv('OLAF_FILE_CHUNK_SIZE', DEFAULT_CHUNK_SIZE))
+        # Chunks of a file encrypted at the same time
+        self.file_encrypt_workers = int(os.getenv('OLAF_FILE_ENCRYPT_WORKERS', 1))
+        self.compression = CompressionSettings.from_env()
+        # Chats go as binary envelopes if the server accepts them, unless OLAF_BINARY_CHAT is off
+        self.capabilities = CLIENT_CAPABILITIES
+        if os.getenv('OLAF_BINARY_CHAT', 'on').lower() in ('off', '0', 'false'):
+            self.capabilities = CLIENT_CAPABILITIES - {CAP_BINARY_CHAT}
+        # Capabilities the server sent with its client list, none for stock servers
+        self.server_capabilities = frozenset()
+        self.on_event = on_event
+        self.event_queue = asyncio.Queue(maxsize=event_queue_size)
+        self.dropped_events = 0
+        self.receive_task = None
+        self.reconnect_policy = reconnect or ReconnectPolicy.from_env()
+        self.reconnect_stats = ReconnectStats()
+        self.reconnecting = False
+        self.closing = asyncio.Event()
+        self.outbound = deque() # frames sent while reconnecting
+        self.redirect = None # (address, http_port) the server sent this client to
+        self.redirected = False # set until the server redirected to accepts the client
+        self.send_turn = None # done once the last send_signed message has been sent
+
+    async def __aenter__(self) -> "Client":
+        if self.private_key is None:
+            await self.load_keys()
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.close()
+
+    async def load_keys(self):
+        """
+        Loads this client's key pair from its identity store or key pool, or
+        generates a new one, off the event loop.
+
+        Raises:
+            ValueError if the identity file cannot be read, e.g. a wrong passphrase.
+        """
+        if self.identity is not None:
+            private_key, created = await asyncio.to_thread(self.identity.load_or_create)
+            if created:
+                logger.info(f"Created identity {self.identity.path}")
+        elif self.key_pool is not None:
+            private_key = await self.key_pool.get()
+        else:
+            private_key = await asyncio.to_thread(self.encryption.generate_private_key)
+        self.set_private_key(private_key)
+
+    def set_private_key(self, private_key):
+        """
+        Uses a loaded private key as this client's identity.
+        """
+        self.private_key = private_key
+        self.public_key = private_key.public_key()
+        self.public_key_pem = self.encryption.export_public_key(self.public_key)
+        self.private_key_pem = self.encryption.export_private_key(private_key)
+
+    def set_keys(self, public_key_pem, private_key_pem):
+        """
+        Uses an existing PEM key pair as this client's identity.
+        """
+        self.public_key_pem, self.private_key_pem = public_key_pem, private_key_pem
+        self.public_key = self.encryption.load_public_key(public_key_pem)
+        self.private_key = self.encryption.load_private_key(private_key_pem)
+
+    @property
+    def fingerprint(self):
+        return self.encryption.generate_fingerprint(self.public_key_pem)
+
+    async def emit(self, event: ClientEvent):
+        """
+        Hands an inbound event to on_event, or queues it for events().
+        """
+        if self.on_event is not None:
+            result = self.on_event(event)
+            if asyncio.iscoroutine(result):
+                await result
+            return
+
+        if self.event_queue.full():
+            self.event_queue.get_nowait()
+            self.dropped_events += 1
+        self.event_queue.put_nowait(event)
+
+    async def events(self):
+        """
+        Iterates over inbound events until the connection is lost.
+        """
+        while True:
+            event = await self.event_queue.get()
+            yield event
+            if event.type == "disconnected":
+                return
+
     async def start(self):
         """
         Initializes the client by generating RSA key pairs, prompting for server 
         address and HTTP port, connecting to the WebSocket server, and starting the event loop.
 
         Tasks:
-        - Generates and loads RSA key pair.
+        - Loads the key pair from OLAF_IDENTITY_FILE if set, or generates one of the OLAF_KEY_SUITE suite.
         - Prompts user for WebSocket server address and HTTP port.
+        - Connects to the least loaded server of that server's neighbourhood
+          instead, unless OLAF_SERVER_SELECTION is off.
         - Establishes WebSocket connection and runs the input prompt.
 
         Args:
             self: Instance containing encryption methods and connection details.
         """
         
-        # Generate RSA key pair
-        self.public_key_pem, self.private_key_pem = self.encryption.generate_rsa_key_pair()
-        self.public_key = self.encryption.load_public_key(self.public_key_pem)
-        self.private_key = self.encryption.load_private_key(self.private_key_pem)
+        self.on_event = self.print_event
+
+        # Load or generate RSA key pair
+        if self.identity is None:
+            self.identity = IdentityStore.from_env(self.encryption)
+        try:
+            await self.load_keys()
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
         
         # Prompt for server address
         chosen_server = await aioconsole.ainput("Enter WebSocket server address (e.g., localhost:9000): ")
@@ -67,16 +283,63 @@ class Client:
         http_port = await aioconsole.ainput("Enter server HTTP port (e.g., 9001): ")
         self.http_port = http_port
 
-        try:
-            await self.connect()
-        except Exception as e:
-            print(f"Failed to connect: wrong server address or port")
-            sys.exit(1)
+        # Connect to the least loaded server of the neighbourhood instead, if it is reachable
+        connected = False
+        recommended = None
+        if os.getenv('OLAF_SERVER_SELECTION', 'on').lower() not in ('off', '0', 'false'):
+            recommended = await self.recommended_server()
+        if recommended is not None and f"ws://{recommended[0]}" != self.server_address:
+            chosen = (self.server_address, self.http_port)
+            self.server_address, self.http_port = f"ws://{recommended[0]}", recommended[1]
+            try:
+                await self.connect()
+                connected = True
+                print(f"Connected to {recommended[0]}, the least loaded server")
+            except Exception:
+                self.server_address, self.http_port = chosen
+
+        if not connected:
+            try:
+                await self.connect()
+            except Exception as e:
+                print(f"Failed to connect: wrong server address or port")
+                sys.exit(1)
         
-        my_nickname = generate_nickname(self.encryption.generate_fingerprint(self.public_key_pem))
+        my_nickname = generate_nickname(self.fingerprint)
         print(f"\nYour nickname is: {my_nickname}\n")
-        await self.input_prompt()
-        self.loop.run_forever()
+
+        prompt_task = asyncio.ensure_future(self.input_prompt())
+        await asyncio.wait([prompt_task, self.receive_task], return_when=asyncio.FIRST_COMPLETED)
+        if not prompt_task.done():
+            # Lost the connection
+            prompt_task.cancel()
+            sys.exit(1)
+
+    def print_event(self, event: ClientEvent):
+        """
+        Prints inbound chats for the interactive client.
+        """
+        if event.type == "public_chat":
+            sender_nickname = "me" if event.sender == self.fingerprint else event.nickname
+            print(f"{GREEN}\n  - Public chat from {sender_nickname}: {event.message}\n{RESET}")
+            print(PROMPT)
+        elif event.type == "chat" and event.group is not None:
+            print(f"{GREEN}\n  - New chat from {event.nickname} in {event.group}: {event.message}\n{RESET}")
+            print(PROMPT)
+        elif event.type == "chat":
+            print(f"{GREEN}\n  - New chat from {event.nickname}: {event.message}\n{RESET}")
+            print(PROMPT)
+        elif event.type == "group_members":
+            members = self.groups.get(event.group)
+            if members is None:
+                print(f"\n  - Not in group {event.group}\n")
+            else:
+                nicknames = [self.nicknames.get(fingerprint, fingerprint[:12]) for fingerprint in members]
+                print(f"\n  - Members of {event.group}: {', '.join(nicknames)}\n")
+        elif event.type == "redirected":
+            print(f"\n  - Moved to the less loaded server {urlparse(self.server_address).netloc}\n")
+        elif event.type == "disconnected":
+            print("Connection closed")
 
     def parse_message(self, message):
         """
@@ -90,36 +353,69 @@ class Client:
         or None and an error message if parsing fails.
         """
         try:
-            message_dict = json.loads(message)
+            message_dict = codec.decode(message)
             return message_dict, None
-        except json.JSONDecodeError as e:
+        except DecodeError as e:
             return None, f"Error parsing JSON: {str(e)}"
 
-    def build_signed_data(self, data):
+    @property
+    def binary_chat(self):
         """
-        Build a signed message with the given data
+        Whether chats are sent as binary envelopes.
         """
-        message = {
-            "data": data,
-            "counter": self.counter
-        }
+        return CAP_BINARY_CHAT in self.capabilities and CAP_BINARY_CHAT in self.server_capabilities
 
-        message_json = json.dumps(message, separators=(',', ':'), sort_keys=True)
-        message_bytes = message_json.encode('utf-8')
+    async def build_signed_data(self, data, envelope=False):
+        """
+        Build a signed message with the given data, encoded as a frame.
+
+        data is encoded once. The same bytes are signed and embedded in the
+        frame. The counter is read when called, and the signature computed
+        off the event loop. With envelope set, a chat is encoded as a binary
+        envelope instead, under the same signature.
+        """
+        data_json = codec.canonical(data)
+        counter = self.counter
+        message_bytes = codec.signing_payload(data_json, counter)
 
         # Sign the message
-        signature = self.encryption.sign_message(message_bytes, self.private_key_pem)
+        signature = await self.crypto.sign(message_bytes, self.private_key)
+        if envelope:
+            return encode_chat_envelope(data, counter, signature)
         signature_base64 = base64.b64encode(signature).decode('utf-8')
 
         # Prepare the signed message
-        signed_data = {
-            "type": "signed_data",
-            "data": data,
-            "counter": self.counter,
-            "signature": signature_base64
-        }
+        return codec.signed_frame(data_json, counter, signature_base64)
+
+    async def send_signed(self, data, envelope=False):
+        """
+        Signs data with the current counter and sends it, as a binary envelope if envelope is set.
+
+        Messages are sent in the order send_signed was called, even if a later
+        signature is ready first.
+
+        Returns:
+            True if the message was sent or buffered, as for send().
+        """
+        previous, turn = self.send_turn, asyncio.get_running_loop().create_future()
+        self.send_turn = turn
+        try:
+            # Reads the counter and queues the signature before suspending
+            frame = await self.build_signed_data(data, envelope)
+            if previous is not None:
+                await previous
+            return await self.send(frame)
+        finally:
+            self.release_send_turn(previous, turn)
 
-        return signed_data
+    def release_send_turn(self, previous, turn):
+        """
+        Lets the next signed send go once the previous one is done as well.
+        """
+        if previous is None or previous.done():
+            turn.set_result(None)
+        else:
+            previous.add_done_callback(lambda _: turn.set_result(None))
     
     def print_clients(self):
         """
@@ -138,19 +434,24 @@ class Client:
             else:
                 nickname = self.nicknames[fingerprint]
             
-            if fingerprint == self.encryption.generate_fingerprint(self.public_key_pem):
+            if fingerprint == self.fingerprint:
                 print (f"   - {nickname} (me)")
             else:
                 print (f"   - {nickname}")
         
         print("\n")
 
-    async def upload_file(self, file_path):
+    async def upload_file(self, file_path, encrypt=False):
         """
         Uploads a file to the server.
 
+        With encrypt, the file is encrypted with a new key while it is read
+        and uploaded, and the key is added to the URL's fragment, which is
+        never sent to the server.
+
         Args:
             file_path: The path to the file to be uploaded.
+            encrypt: Whether to encrypt the file.
 
         Returns:
             The URL of the uploaded file if successful, or None if the upload fails.
@@ -163,33 +464,94 @@ class Client:
         # Construct the URL using the hostname and the HTTP port
         url = f'http://{server_hostname}:{self.http_port}/api/upload'
         
+        # Text-like files are sent gzip encoded, the server decodes them on arrival.
+        # Encrypted files do not compress.
+        compress = 'gzip' if is_compressible(file_path) and not encrypt else None
+        key = self.encryption.generate_aes_key() if encrypt else None
+
         async with aiohttp.ClientSession() as session:
             with open(file_path, 'rb') as f:
                 form = aiohttp.FormData()
-                form.add_field('file', f, filename=os.path.basename(file_path))
-                async with session.post(url, data=form) as resp:
+                if encrypt:
+                    body = encrypt_file(file_path, key, self.file_chunk_size, self.file_encrypt_workers)
+                    form.add_field('file', body, filename=os.path.basename(file_path),
+                                   content_type='application/octet-stream')
+                else:
+                    form.add_field('file', f, filename=os.path.basename(file_path))
+                async with session.post(url, data=form, compress=compress) as resp:
                     if resp.status == 200:
                         json_response = await resp.json()
                         file_url = json_response.get('file_url')
+                        if file_url and encrypt:
+                            file_url = f"{file_url}#{file_key_fragment(key)}"
                         return file_url
                     else:
                         error_message = await resp.text()
                         logger.error(f"File upload failed with status {resp.status}: {error_message}")
                         return None
+
+    async def download_file(self, file_url, destination):
+        """
+        Downloads a shared file to destination.
+
+        Files shared encrypted, with the key in the URL's fragment, are
+        decrypted while they download. Nothing is left at destination if the
+        download fails or the file was tampered with.
+
+        Args:
+            file_url: The URL of the file, as shared in a chat.
+            destination: The path to save the file to.
+
+        Returns:
+            True if the file was downloaded.
+        """
+        try:
+            url, key = split_file_url(file_url)
+            decryptor = ChunkDecryptor(key) if key is not None else None
+        except ValueError:
+            logger.error("The file key in the URL is not valid")
+            return False
+
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(url) as resp:
+                    if resp.status != 200:
+                        logger.error(f"File download failed with status {resp.status}")
+                        return False
+                    with open(destination, 'wb') as f:
+                        async for data in resp.content.iter_chunked(self.file_chunk_size):
+                            if decryptor is not None:
+                                for plaintext in await asyncio.to_thread(decryptor.feed, data):
+                                    await asyncio.to_thread(f.write, plaintext)
+                            else:
+                                await asyncio.to_thread(f.write, data)
+                        if decryptor is not None:
+                            await asyncio.to_thread(f.write, decryptor.finish())
+            return True
+        except (aiohttp.ClientError, OSError, ValueError) as e:
+            logger.error(f"File download failed: {e}")
+            if os.path.exists(destination):
+                os.remove(destination)
+            return False
                     
     async def upload_and_share_file(self, file_path, recipients):
         """
         Uploads a file and shares its URL with specified recipients.
 
+        Files shared with private recipients only are encrypted, unless
+        OLAF_ENCRYPT_FILES is off, and the key goes with the URL inside the
+        encrypted chat.
+
         Args:
             file_path: The path to the file to be uploaded.
             recipients: A list of recipients to share the file with, 
                     including 'global' for public sharing.
 
         Returns:
-            None
+            The URL of the uploaded file, or None if the upload failed.
         """
-        file_url = await self.upload_file(file_path)
+        encrypt = self.encrypt_files and 'global' not in recipients
+        file_url = await self.upload_file(file_path, encrypt)
         if file_url:
             message_text = f"[File] {file_url}"
             # Send to global chat if 'global' is in recipients
@@ -199,9 +561,36 @@ class Client:
             private_recipients = [r for r in recipients if r != 'global']
             if private_recipients:
                 await self.send_chat(private_recipients, message_text)
-        else:
-            print("Failed to upload and share file.")
+        return file_url
     
+    async def recommended_server(self):
+        """
+        Asks the server for the least loaded server of its neighbourhood.
+
+        Returns:
+            (address, http_port) of the recommended server, or None if the
+            server does not recommend one.
+        """
+        parsed_url = urlparse(self.server_address)
+        url = f'http://{parsed_url.hostname}:{self.http_port}/api/servers'
+
+        try:
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as session:
+                async with session.get(url) as resp:
+                    if resp.status != 200:
+                        return None
+                    recommended = (await resp.json()).get("recommended")
+        except (aiohttp.ClientError, OSError, ValueError, asyncio.TimeoutError) as e:
+            logger.info(f"No server recommendation from {url}: {e}")
+            return None
+
+        if not isinstance(recommended, dict):
+            return None
+        address, http_port = recommended.get("address"), recommended.get("http_port")
+        if not isinstance(address, str) or type(http_port) is not int:
+            return None
+        return address, http_port
+
     async def get_uploaded_files(self):
         """
         Retrieve the list of uploaded files from the server
@@ -209,7 +598,7 @@ class Client:
         Constructs a request to the server to retrieve the list of uploaded files.
         
         Returns:
-            None
+            The file list as returned by the server, or None if it could not be retrieved.
         """
         
         
@@ -224,13 +613,11 @@ class Client:
             try:
                 async with session.get(url) as resp:
                     if resp.status == 200:
-                        html_content = await resp.text()
-                        print("Uploaded files:")
-                        print(html_content)  # Display the HTML content for now
-                    else:
-                        print(f"Failed to retrieve file list: {resp.status}")
+                        return await resp.text()
+                    logger.error(f"Failed to retrieve file list: {resp.status}")
             except aiohttp.ClientConnectorError as e:
-                print(f"Failed to connect to server: {e}")
+                logger.error(f"Failed to connect to server: {e}")
+        return None
 
             
     async def input_prompt(self):
@@ -239,7 +626,9 @@ class Client:
         
         Continuously listens for user commands to perform actions such as:
         - Uploading and sharing files
+        - Downloading shared files
         - Sending public and private chat messages
+        - Joining, leaving and chatting in groups
         - Requesting a list of clients
         - Retrieving uploaded files
         - Exiting the application
@@ -248,7 +637,7 @@ class Client:
             None
         """
         while True:
-            message = await aioconsole.ainput("Enter message type (public, chat, clients, /transfer , files) (exit to exit): ")
+            message = await aioconsole.ainput(PROMPT)
             if message.lower().startswith("/transfer"):
                 parts = message.split()
                 if len(parts) < 2:
@@ -258,9 +647,46 @@ class Client:
                 file_path = parts[1]
                 recipients = parts[2:] if len(parts) > 2 else ['global']
                 if os.path.exists(file_path):
-                    await self.upload_and_share_file(file_path, recipients)
+                    if not await self.upload_and_share_file(file_path, recipients):
+                        print("Failed to upload and share file.")
                 else:
                     print("File does not exist.")
+            elif message.lower().startswith("/download"):
+                parts = message.split()
+                if len(parts) < 2:
+                    print("Usage: /download <url> [<file>]")
+                    continue
+
+                file_url = parts[1]
+                destination = parts[2] if len(parts) > 2 else os.path.basename(urlparse(file_url).path)
+                if await self.download_file(file_url, destination):
+                    print(f"Saved {destination}")
+                else:
+                    print("Failed to download file.")
+            elif message.lower().startswith("/join") or message.lower().startswith("/leave"):
+                parts = message.split(maxsplit=1)
+                if len(parts) < 2:
+                    print(f"Usage: {parts[0]} <group>")
+                    continue
+
+                if parts[0].lower() == "/join":
+                    sent = await self.join_group(parts[1].strip())
+                else:
+                    sent = await self.leave_group(parts[1].strip())
+                if not sent:
+                    print("Not connected")
+            elif message.lower().startswith("/group"):
+                parts = message.split(maxsplit=2)
+                if len(parts) < 3:
+                    print("Usage: /group <group> <message>")
+                    continue
+
+                chat = html.escape(parts[2].strip())
+                result = await self.send_group_chat(parts[1], chat)
+                if result.sent:
+                    print(f"{GREEN}\nSent chat message to {parts[1]}: {chat}\n{RESET}")
+                else:
+                    print(result.error)
             elif message.lower() == "public":
                 chat = await aioconsole.ainput("Enter public chat message: ")
                 chat = chat.strip()
@@ -268,7 +694,8 @@ class Client:
                 if not chat:
                     print("Message cannot be empty")
                     continue
-                await self.send_public_chat(chat)
+                if await self.send_public_chat(chat):
+                    print(f"{GREEN}\nSent public chat message: {chat}\n{RESET}")
             elif message.lower() == "chat":
                 recipients = await aioconsole.ainput("Enter recipient names, separated by commas: ")
                 if not recipients:
@@ -280,12 +707,19 @@ class Client:
                 if not chat:
                     print("Message cannot be empty")
                     continue
-                await self.send_chat(recipients.split(","), chat)
+                result = await self.send_chat(recipients.split(","), chat)
+                if result.sent:
+                    print(f"{GREEN}\nSent chat message to {', '.join(result.recipients)}: {chat}\n{RESET}")
+                else:
+                    print(result.error)
             elif message.lower() == "clients":
                 await self.request_client_list()
                 self.print_clients()
             elif message.lower() == "files":
-                await self.get_uploaded_files()
+                files = await self.get_uploaded_files()
+                if files is not None:
+                    print("Uploaded files:")
+                    print(files)  # Display the HTML content for now
             elif message.lower() == "exit":
                 await self.close()
                 break
@@ -299,44 +733,156 @@ class Client:
         
         Establishes a connection to the server, sends greeting message,
         and starts listening for incoming messages.
+
+        Raises:
+            OSError or websockets.InvalidHandshake if the server cannot be reached.
         """
         
+        await self.open_connection()
+
+        # Listen for incoming messages
+        self.receive_task = asyncio.ensure_future(self.receive())
+
+    async def open_connection(self):
+        """
+        Connects and says hello, then sends the messages buffered while reconnecting.
+        """
+        connection = await websockets.connect(self.server_address, compression=None,
+                                              extensions=self.compression.client_extensions())
         try:
-            self.connection = await websockets.connect(self.server_address)
-            print(f"Connected to {self.server_address}")
+            await connection.send(await self.build_hello())
+            while self.outbound:
+                await connection.send(self.outbound[0])
+                self.outbound.popleft()
+        except BaseException:
+            await connection.close()
+            raise
 
-            await self.send_hello()
+        self.connection = connection
+        logger.info(f"Connected to {self.server_address}")
 
-            # Listen for incoming messages
-            asyncio.ensure_future(self.receive())
-            
+    async def reconnect(self):
+        """
+        Re-establishes a lost connection with jittered exponential backoff.
 
+        Returns:
+            True once connected again, False if the client was closed or the
+            policy gave up.
+        """
+        self.connection = None
+        self.reconnecting = True
+        self.reconnect_stats.disconnects += 1
+        lost = time.monotonic()
+        await self.emit(ClientEvent("reconnecting"))
+
+        attempt = 0
+        try:
+            while self.reconnect_policy.should_retry(attempt) and not self.closing.is_set():
+                try:
+                    await asyncio.wait_for(self.closing.wait(), self.reconnect_policy.backoff(attempt))
+                    return False
+                except asyncio.TimeoutError:
+                    pass
+
+                attempt += 1
+                self.reconnect_stats.attempts += 1
+                try:
+                    await self.open_connection()
+                except Exception as e:
+                    logger.info(f"Reconnect attempt {attempt} to {self.server_address} failed: {e}")
+                    continue
+
+                downtime = time.monotonic() - lost
+                self.reconnect_stats.reconnects += 1
+                self.reconnect_stats.last_downtime = downtime
+                self.reconnect_stats.total_downtime += downtime
+                logger.info(f"Reconnected to {self.server_address} after {downtime:.2f}s")
+                await self.emit(ClientEvent("reconnected"))
+                return True
+            return False
+        finally:
+            self.reconnecting = False
+
+    def handle_redirect(self, message):
+        """
+        Records the server this client is sent to instead. The server closes
+        the connection next, and messages sent meanwhile are kept for the new one.
+        """
+        address = message.get("address")
+        http_port = message.get("http_port")
+        if not isinstance(address, str) or not address or type(http_port) is not int:
+            logger.warning("Invalid redirect message")
+            return
+        self.redirect = (address, http_port)
+        self.connection = None
+        self.reconnecting = True
+
+    async def follow_redirect(self):
+        """
+        Connects to the server the last server redirected this client to.
+
+        Returns:
+            True once connected there. Otherwise the client goes back to the
+            address it had, and reconnects to it without accepting a redirect.
+        """
+        address, http_port = self.redirect
+        self.redirect = None
+        self.redirected = True
+        previous = (self.server_address, self.http_port)
+        self.server_address, self.http_port = f"ws://{address}", http_port
+        try:
+            await self.open_connection()
         except Exception as e:
-            print(f"Failed to connect: {e}")
-            sys.exit(1)
+            logger.info(f"Unable to follow redirect to {address}: {e}")
+            self.server_address, self.http_port = previous
+            return False
+        finally:
+            self.reconnecting = False
+
+        logger.info(f"Redirected to {self.server_address}")
+        await self.emit(ClientEvent("redirected"))
+        return True
 
     async def close(self):
         """
         Closes the connection to the WebSocket server
         
-        Attempts to close connection gracefully and exits the application.
+        Attempts to close connection gracefully and waits for the last events
+        to be handled. Stops reconnecting and drops buffered messages.
         """
         
+        self.closing.set()
+        self.outbound.clear()
         if self.connection:
             try:
                 await self.connection.close()
-                print("Connection closed")
-                sys.exit(0)
             except Exception as e:
-                print(f"Failed to close connection: {e}")
+                logger.error(f"Failed to close connection: {e}")
             finally:
                 self.connection = None
 
+        if self.receive_task is not None:
+            await asyncio.wait([self.receive_task])
+
     async def send_hello(self):
         """
         Send a hello message to the server.
+        """
+        await self.send_signed(self.hello_data())
+
+    async def build_hello(self):
+        """
+        Builds a signed hello message.
+        """
+        return await self.build_signed_data(self.hello_data())
+
+    def hello_data(self):
+        """
+        Builds the data of a hello message.
         
-        Increments message counter and sends public key as part of the hello message.
+        Increments message counter and sends public key as part of the hello
+        message. When reconnecting, the digest of the client list held is sent
+        so the server can skip sending it again if nothing changed.
         """
         
         self.counter += 1
@@ -346,15 +892,18 @@ class Client:
 
         message_data = {
             "type": "hello",
-            "public_key": public_pem  
+            "public_key": public_pem,
+            # Extensions servers may use with this client. Stock servers ignore the field.
+            # Only one redirect is followed, so clients never bounce between busy servers
+            "capabilities": capabilities_field(self.capabilities - {CAP_REDIRECT} if self.redirected else self.capabilities)
         }
+        if self.key_format != "pem":
+            # Servers that do not support it ignore the field
+            message_data["key_format"] = self.key_format
+        if self.clients:
+            message_data["client_list_digest"] = membership_digest(self.server_fingerprints)
 
-        message = self.build_signed_data(message_data)
-
-        
-        json_message = json.dumps(message)
-        
-        await self.send(json_message)
+        return message_data
         
 
     async def send_public_chat(self, chat):
@@ -367,10 +916,12 @@ class Client:
         Args:
             chat: The chat message to be sent.
 
+        Returns:
+            True if the message was sent.
         """
         self.counter += 1
         
-        fingerprint = self.encryption.generate_fingerprint(self.public_key_pem)
+        fingerprint = self.fingerprint
 
         message_data = {
             "type": "public_chat",
@@ -378,12 +929,7 @@ class Client:
             "message": chat
         }
 
-        message = self.build_signed_data(message_data)
-
-        message_json = json.dumps(message)
-        
-        await self.send(message_json)
-        print(f"{GREEN}\nSent public chat message: {chat}\n{RESET}")
+        return await self.send_signed(message_data)
         
         
     async def send_chat(self, recipients_nicknames, chat):
@@ -396,16 +942,19 @@ class Client:
         Args:
             recipients_nicknames: A list of recipient nicknames.
             chat: The chat message to be sent.
-        
+
+        Returns:
+            A ChatResult saying whether the message was sent.
         """
         
         recipients = [fingerprint for fingerprint, nickname in self.nicknames.items() if nickname in recipients_nicknames]
                     
         valid_recipients = [fingerprint for fingerprint in recipients if fingerprint in self.clients]
+        await self.fetch_keys([fingerprint for fingerprint in valid_recipients if self.clients.get(fingerprint) is None])
+        valid_recipients = [fingerprint for fingerprint in valid_recipients if self.clients.get(fingerprint) is not None]
         
         if not valid_recipients:
-            print("No valid recipients")
-            return
+            return ChatResult(recipients_nicknames, chat, False, "No valid recipients")
             
         recipient_public_keys = []
         destination_servers_set = set()
@@ -414,56 +963,232 @@ class Client:
             server_address = self.server_fingerprints.get(fingerprint)
             if server_address:
                 destination_servers_set.add(server_address)
-                recipient_public_keys.append(self.clients[fingerprint])
+                recipient_public_keys.append(self.load_client_key(fingerprint))
             else:
-                print(f"No server address for fingerprint: {fingerprint}")
-                return
+                return ChatResult(recipients_nicknames, chat, False, f"No server address for fingerprint: {fingerprint}")
             
         destination_servers = list(destination_servers_set)
         if not destination_servers:
-            print("No destination servers")
-            return
-        
-        self.counter += 1
+            return ChatResult(recipients_nicknames, chat, False, "No destination servers")
         
         aes_key = self.encryption.generate_aes_key()
+        symm_keys = await self.wrap_symm_key(aes_key, recipient_public_keys)
+        signed_data = self.build_chat_data(valid_recipients, destination_servers, aes_key, symm_keys, chat)
+        
+        # After waiting for the keys, so messages sent meanwhile keep their counters
+        self.counter += 1
+        if not await self.send_signed(signed_data, self.binary_chat):
+            return ChatResult(recipients_nicknames, chat, False, "Not connected")
+        return ChatResult(recipients_nicknames, chat, True)
+
+    async def join_group(self, group):
+        """
+        Asks the server to add this client to a group, creating it if needed.
+        The server answers with the members of the group.
+
+        Returns:
+            True if the request was sent.
+        """
+        return await self.send(codec.encode({"type": "group_join", "group": group}))
+
+    async def leave_group(self, group):
+        """
+        Asks the server to remove this client from a group.
+
+        Returns:
+            True if the request was sent.
+        """
+        self.groups.pop(group, None)
+        self.group_keys.pop(group, None)
+        return await self.send(codec.encode({"type": "group_leave", "group": group}))
+
+    async def send_group_chat(self, group, chat):
+        """
+        Send a chat message to the members of a group.
+
+        The chat names the group instead of destination servers and the
+        server delivers it to every member. It is still end-to-end encrypted:
+        the AES key is wrapped for every member, but the wrapped keys are
+        reused for the following chats to the group until its members change.
+
+        Args:
+            group: the name of a group this client is in.
+            chat: The chat message to be sent.
+
+        Returns:
+            A ChatResult saying whether the message was sent.
+        """
+        members = self.groups.get(group)
+        if members is None or CAP_GROUPS not in self.server_capabilities:
+            return ChatResult([group], chat, False, "Not a member of this group")
+
+        await self.fetch_keys([fingerprint for fingerprint in members
+                               if fingerprint in self.clients and self.clients[fingerprint] is None])
+        recipients = [fingerprint for fingerprint in members
+                      if fingerprint != self.fingerprint and self.clients.get(fingerprint) is not None]
+        if not recipients:
+            return ChatResult([group], chat, False, "No group members online")
+
+        group_key = await self.group_key(group, recipients)
+        signed_data = self.build_chat_data(recipients, [], group_key.aes_key, group_key.symm_keys, chat)
+        signed_data["group"] = group
+
+        self.counter += 1
+        if not await self.send_signed(signed_data):
+            return ChatResult([group], chat, False, "Not connected")
+        return ChatResult([group], chat, True)
+
+    async def group_key(self, group, recipients):
+        """
+        Returns the GroupKey to encrypt the next chat to a group with, making a
+        new one when the recipients changed or the current one is used up.
+        """
+        recipients = tuple(recipients)
+        group_key = self.group_keys.get(group)
+        if group_key is None or group_key.recipients != recipients or group_key.uses >= GROUP_KEY_MAX_MESSAGES:
+            aes_key = self.encryption.generate_aes_key()
+            symm_keys = await self.wrap_symm_key(aes_key, [self.load_client_key(fingerprint) for fingerprint in recipients])
+            group_key = GroupKey(recipients, aes_key, symm_keys, 0)
+        group_key = group_key._replace(uses=group_key.uses + 1)
+        self.group_keys[group] = group_key
+        return group_key
+
+    async def wrap_symm_key(self, aes_key, public_keys):
+        """
+        Encrypts the AES key of a chat for each recipient off the event loop,
+        returning the base64 symm_keys. Each key is wrapped with the suite of
+        the recipient's public key.
+        """
+        encrypted_symm_keys = await self.crypto.wrap_keys(aes_key, public_keys)
+        return [base64.b64encode(encrypted_symm_key).decode('utf-8') for encrypted_symm_key in encrypted_symm_keys]
+
+    def build_chat_data(self, recipients, destination_servers, aes_key, symm_keys, chat):
+        """
+        Encrypts a chat under aes_key with a fresh IV and returns the chat data to be signed.
+
+        Args:
+            recipients: fingerprints of the recipients, in the order of symm_keys.
+        """
         iv = self.encryption.generate_iv()
         iv_base64 = base64.b64encode(iv).decode('utf-8')
-        
-        sender_fingerprint = self.encryption.generate_fingerprint(self.public_key_pem)
-        participants = [sender_fingerprint] + [self.encryption.generate_fingerprint(public_key) for public_key in recipient_public_keys]
-        
+
+        participants = [self.fingerprint] + recipients
+
         chat_data = {
             "chat": {
                 "participants": participants,
                 "message": chat
             },
         }
-        chat_data_json = json.dumps(chat_data)
-        
-        ciphertext, tag = self.encryption.encrypt_aes_gcm(chat_data_json.encode('utf-8'), aes_key, iv)
+        chat_data_json = codec.encode_bytes(chat_data)
+
+        ciphertext, tag = self.encryption.encrypt_aes_gcm(chat_data_json, aes_key, iv)
         chat_base64 = base64.b64encode(ciphertext + tag).decode('utf-8')
-        
-        symm_keys = []
-        for public_key in recipient_public_keys:
-            public_key_pem = self.encryption.load_public_key(public_key)
-            encrypted_symm_key = self.encryption.encrypt_rsa(aes_key, public_key_pem)
-            encrypted_symm_key_base64 = base64.b64encode(encrypted_symm_key).decode('utf-8')
-            symm_keys.append(encrypted_symm_key_base64)
-            
-        signed_data = {
+
+        return {
             "type": "chat",
             "destination_servers": destination_servers,
             "iv": iv_base64,
             "symm_keys": symm_keys,
             "chat": chat_base64
         }
-        
-        signed_data = self.build_signed_data(signed_data)
-        
-        message_json = json.dumps(signed_data)
-        await self.send(message_json)
-        print(f"{GREEN}\nSent chat message to {', '.join(recipients_nicknames)}: {chat}\n{RESET}")
+
+    async def send_chat_batch(self, chats):
+        """
+        Send many private chats at once, e.g. from a bot.
+
+        Chats to the same recipients share one AES key per batch, so each
+        recipient's key is loaded and wrapped once; every chat still gets its
+        own IV. Signatures are computed off the event loop, and each frame is
+        sent as soon as it is signed, in counter order, without waiting for
+        the previous write. Like send_signed, the batch goes after messages
+        already being sent, and frames are buffered while reconnecting.
+
+        Args:
+            chats: iterable of (recipient nicknames, chat) pairs.
+
+        Returns:
+            A ChatResult per chat, in order. A chat is sent if it was written
+            or buffered, as for send().
+        """
+        chats = [(list(recipients_nicknames), chat) for recipients_nicknames, chat in chats]
+        by_nickname = {nickname: fingerprint for fingerprint, nickname in self.nicknames.items()}
+        wanted = {fingerprint for recipients_nicknames, _ in chats for nickname in recipients_nicknames
+                  if (fingerprint := by_nickname.get(nickname)) is not None}
+        await self.fetch_keys([fingerprint for fingerprint in wanted
+                               if fingerprint in self.clients and self.clients[fingerprint] is None])
+
+        results = [None] * len(chats)
+        # { recipients : (aes_key, symm_keys, destination_servers) }
+        groups = {}
+        # (index, recipients)
+        prepared = []
+        for index, (recipients_nicknames, chat) in enumerate(chats):
+            recipients = [by_nickname[nickname] for nickname in recipients_nicknames if nickname in by_nickname]
+            recipients = list(dict.fromkeys(fingerprint for fingerprint in recipients
+                                            if self.clients.get(fingerprint) is not None))
+            if not recipients:
+                results[index] = ChatResult(recipients_nicknames, chat, False, "No valid recipients")
+                continue
+
+            group = tuple(recipients)
+            if group not in groups:
+                try:
+                    aes_key = self.encryption.generate_aes_key()
+                    symm_keys = await self.wrap_symm_key(aes_key, [self.load_client_key(fingerprint) for fingerprint in group])
+                    destination_servers = list(dict.fromkeys(self.server_fingerprints[fingerprint] for fingerprint in group))
+                except Exception as e:
+                    logger.warning(f"Unable to encrypt for {recipients_nicknames}: {e}")
+                    results[index] = ChatResult(recipients_nicknames, chat, False, f"Unable to encrypt: {e}")
+                    continue
+                groups[group] = (aes_key, symm_keys, destination_servers)
+            prepared.append((index, recipients))
+
+        # Counters are read and the send turn taken without suspending, as in
+        # send_signed, so messages sent meanwhile stay in counter order
+        previous, turn = self.send_turn, asyncio.get_running_loop().create_future()
+        self.send_turn = turn
+        try:
+            # (index, data, data_json, counter, signature future)
+            signing = []
+            for index, recipients in prepared:
+                aes_key, symm_keys, destination_servers = groups[tuple(recipients)]
+                self.counter += 1
+                data = self.build_chat_data(recipients, destination_servers, aes_key, symm_keys, chats[index][1])
+                data_json = codec.canonical(data)
+                message_bytes = codec.signing_payload(data_json, self.counter)
+                signature = self.crypto.sign(message_bytes, self.private_key)
+                signing.append((index, data, data_json, self.counter, signature))
+
+            if previous is not None:
+                await previous
+
+            # Sends are started in counter order. Each frame is written or
+            # buffered before the next send starts, only waiting for the
+            # buffer to drain overlaps.
+            sends = []
+            binary_chat = self.binary_chat
+            for index, data, data_json, counter, signature in signing:
+                try:
+                    signature = await signature
+                except Exception as e:
+                    sends.append((index, None, str(e)))
+                    continue
+                if binary_chat:
+                    frame = encode_chat_envelope(data, counter, signature)
+                else:
+                    frame = codec.signed_frame(data_json, counter, base64.b64encode(signature).decode('utf-8'))
+                sends.append((index, asyncio.ensure_future(self.send(frame)), None))
+
+            for index, send, error in sends:
+                if send is not None and not await send:
+                    error = "Not connected"
+                recipients_nicknames, chat = chats[index]
+                results[index] = ChatResult(recipients_nicknames, chat, error is None, error)
+        finally:
+            self.release_send_turn(previous, turn)
+
+        return results
 
 
     async def request_client_list(self):
@@ -474,21 +1199,41 @@ class Client:
             "type": "client_list_request"
         }
 
-        message_json = json.dumps(message)
-        await self.send(message_json)
+        await self.send(codec.encode(message))
 
     async def receive(self):
+        """
+        Handles messages from the server until the client is closed,
+        reconnecting whenever the connection is lost.
+        """
         try:
-            async for message in self.connection:
-                message_dict, error = self.parse_message(message)
-                if error:
-                    print(f"Error parsing message: {error}")
-                    continue
+            while True:
+                try:
+                    async for message in self.connection:
+                        if is_envelope(message):
+                            await self.handle_chat_envelope(message)
+                            continue
 
-                await self.handle_message(message_dict)
-        except websockets.ConnectionClosed:
-            print("Connection closed")
-            sys.exit(1)
+                        message_dict, error = self.parse_message(message)
+                        if error:
+                            logger.warning(f"Error parsing message: {error}")
+                            continue
+
+                        if type(message_dict) is dict and message_dict.get("type") == BATCH_TYPE:
+                            for inner in unpack_batch(message_dict) or []:
+                                await self.handle_message(inner)
+                        else:
+                            await self.handle_message(message_dict)
+                except websockets.ConnectionClosed:
+                    pass
+
+                if self.redirect is not None and not self.closing.is_set() and await self.follow_redirect():
+                    continue
+                if self.closing.is_set() or not await self.reconnect():
+                    break
+        finally:
+            self.connection = None
+            await self.emit(ClientEvent("disconnected"))
 
     async def handle_message(self, message):
         """
@@ -512,15 +1257,21 @@ class Client:
             await self.handle_client_list(message)
         elif message_type == "chat":
             await self.handle_chat(message)
+        elif message_type == "key_response":
+            self.handle_key_response(message)
+        elif message_type == "group_members":
+            await self.handle_group_members(message)
+        elif message_type == "redirect":
+            self.handle_redirect(message)
         else:
-            print(f"Unknown message type: {message_type}")
+            logger.info(f"Unknown message type: {message_type}")
 
     async def handle_public_chat(self, message):
         """
         Processes a public chat message.
         
         Extracts the sender fingerprint and chat message from the data,
-        and prints the message to the console.
+        and emits it as a public_chat event.
         
         Args:
             message: The incoming message containing the chat data.
@@ -536,16 +1287,10 @@ class Client:
         })
         
         sender_nickname = self.nicknames.get(sender_fingerprint)
-        sender_public_key = self.clients.get(sender_fingerprint)
-        if not sender_public_key:
+        if sender_fingerprint not in self.clients:
             return
         
-        # check if sender is me
-        if sender_fingerprint == self.encryption.generate_fingerprint(self.public_key_pem):
-            sender_nickname = "me"
-        
-        print(f"{GREEN}\n  - Public chat from {sender_nickname}: {chat}\n{RESET}")
-        print(f"Enter message type (public, chat, clients, /transfer, files) (exit to exit): ")
+        await self.emit(ClientEvent("public_chat", sender_fingerprint, sender_nickname, chat))
 
 
     async def handle_client_list(self, message):
@@ -561,21 +1306,31 @@ class Client:
         """
         
         
+        self.server_capabilities = parse_capabilities(message)
+        self.redirected = False
         servers = message.get("servers", [])
+        key_format = message.get("key_format")
+        compact = key_format in ("der", "fingerprint")
         new_fingerprints = set()
         
         for server in servers:
             server_address = server.get("address")
             clients_pem = server.get("clients", [])
             
-            for public_key_pem_str in clients_pem:
-                public_key_pem = public_key_pem_str.encode('utf-8')
-                fingerprint = self.encryption.generate_fingerprint(public_key_pem)
+            for entry in clients_pem:
+                if key_format == "fingerprint" and isinstance(entry, str):
+                    # Keys are fetched with key_request when they are needed
+                    fingerprint, public_key_pem = entry, self.known_keys.get(entry)
+                else:
+                    fingerprint, public_key_pem = self.read_client_entry(entry, compact)
+                if fingerprint is None:
+                    continue
                 new_fingerprints.add(fingerprint)
                 
-                if fingerprint not in self.clients:
+                if self.clients.get(fingerprint) is None:
                     self.clients[fingerprint] = public_key_pem
-                    self.server_fingerprints[fingerprint] = server_address
+                # Clients that reconnected elsewhere are now on another server
+                self.server_fingerprints[fingerprint] = server_address
                     
                 if fingerprint not in self.nicknames:
                     nickname = generate_nickname(fingerprint)
@@ -588,6 +1343,136 @@ class Client:
             del self.clients[fingerprint]
             del self.server_fingerprints[fingerprint]
             del self.nicknames[fingerprint]
+
+        await self.emit(ClientEvent("client_list"))
+
+    def read_client_entry(self, entry, compact):
+        """
+        Reads one client of a client_list.
+
+        Standard lists carry PEM strings. Compact lists carry the fingerprint of
+        a key already sent on this connection, or a {"fingerprint", "key"} object
+        with the base64 DER key ({"fingerprint", "pem"} for keys the server could
+        not convert). Keys are only parsed and fingerprinted the first time they are seen.
+
+        Returns:
+            A tuple of the fingerprint and PEM public key, or (None, None) if the entry is unusable.
+        """
+        if isinstance(entry, str) and not compact:
+            fingerprint = self.key_fingerprints.get(entry)
+            if fingerprint is None:
+                public_key_pem = entry.encode('utf-8')
+                fingerprint = self.encryption.generate_fingerprint(public_key_pem)
+                self.key_fingerprints[entry] = fingerprint
+                self.known_keys[fingerprint] = public_key_pem
+            return fingerprint, self.known_keys[fingerprint]
+
+        if isinstance(entry, str):
+            public_key_pem = self.known_keys.get(entry)
+            if public_key_pem is None:
+                logger.warning(f"Client list refers to unknown key {entry}")
+                return None, None
+            return entry, public_key_pem
+
+        if not isinstance(entry, dict):
+            return None, None
+
+        fingerprint = entry.get("fingerprint")
+        try:
+            if "key" in entry:
+                public_key = self.encryption.load_der_public_key(base64.b64decode(entry["key"]))
+                public_key_pem = self.encryption.export_public_key(public_key)
+            else:
+                public_key_pem = entry["pem"].encode('utf-8')
+                public_key = self.encryption.load_public_key(public_key_pem)
+        except Exception as e:
+            logger.warning(f"Unable to read key of {fingerprint}: {e}")
+            return None, None
+
+        # The server cannot vouch for a key under someone else's fingerprint.
+        if self.encryption.generate_fingerprint(public_key_pem) != fingerprint:
+            logger.warning(f"Key does not match its fingerprint {fingerprint}")
+            return None, None
+
+        self.known_keys[fingerprint] = public_key_pem
+        self.loaded_keys[fingerprint] = public_key
+        return fingerprint, public_key_pem
+
+    async def fetch_keys(self, fingerprints, timeout=5):
+        """
+        Asks the server for the keys of clients listed without one.
+
+        Fingerprints already requested are not asked for again, every caller
+        waits on the same answer.
+        """
+        loop = asyncio.get_running_loop()
+        futures = []
+        new = []
+        for fingerprint in dict.fromkeys(fingerprints):
+            future = self.key_requests.get(fingerprint)
+            if future is None:
+                future = self.key_requests[fingerprint] = loop.create_future()
+                new.append(fingerprint)
+            futures.append(future)
+
+        if not futures:
+            return
+        if new:
+            await self.send(codec.encode({"type": "key_request", "fingerprints": new}))
+
+        await asyncio.wait(futures, timeout=timeout)
+        for fingerprint in new:
+            future = self.key_requests.pop(fingerprint, None)
+            if future is not None and not future.done():
+                future.cancel()
+
+    def handle_key_response(self, message):
+        """
+        Stores the keys of a key_response and wakes up the senders waiting on them.
+        """
+        for entry in message.get("keys", []):
+            fingerprint, public_key_pem = self.read_client_entry(entry, True)
+            if fingerprint is None:
+                continue
+            if fingerprint in self.clients:
+                self.clients[fingerprint] = public_key_pem
+            future = self.key_requests.pop(fingerprint, None)
+            if future is not None and not future.done():
+                future.set_result(public_key_pem)
+
+        for fingerprint in message.get("missing", []):
+            logger.warning(f"Server does not know the key of {fingerprint}")
+            future = self.key_requests.pop(fingerprint, None)
+            if future is not None and not future.done():
+                future.set_result(None)
+
+    async def handle_group_members(self, message):
+        """
+        Records the members of a group after they changed, or forgets the
+        group if this client is no longer in it.
+        """
+        group = message.get("group")
+        members = message.get("members")
+        if not isinstance(group, str) or not isinstance(members, list):
+            logger.warning("Invalid group_members message")
+            return
+
+        if self.fingerprint in members:
+            self.groups[group] = [member for member in members if isinstance(member, str)]
+        else:
+            self.groups.pop(group, None)
+        self.group_keys.pop(group, None)
+        await self.emit(ClientEvent("group_members", group=group))
+
+    def load_client_key(self, fingerprint):
+        """
+        Returns the loaded public key of a client, parsing its PEM only once.
+        """
+        public_key = self.loaded_keys.get(fingerprint)
+        if public_key is None:
+            public_key = self.encryption.load_public_key(self.clients[fingerprint])
+            self.loaded_keys[fingerprint] = public_key
+        return public_key
                 
     async def handle_chat(self, message):
         """
@@ -609,53 +1494,68 @@ class Client:
         chat_base64 = data.get("chat")
         
         if not symm_keys_base64 or not iv_base64 or not chat_base64:
-            print("Invalid chat message")
+            logger.warning("Invalid chat message")
             return
-        
-        my_fingerprint = self.encryption.generate_fingerprint(self.public_key_pem)
-        decrypted = False
 
         iv = base64.b64decode(iv_base64.encode('utf-8'))
         cipher_and_tag = base64.b64decode(chat_base64.encode('utf-8'))
-        ciphertext = cipher_and_tag[:-16]
-        tag = cipher_and_tag[-16:]
+        try:
+            symm_keys = [base64.b64decode(symm_key_base64.encode('utf-8')) for symm_key_base64 in symm_keys_base64]
+        except Exception:
+            return
+        group = data.get("group")
+        await self.open_chat(symm_keys, iv, cipher_and_tag, group if isinstance(group, str) else None)
 
-        
-        for idx, symm_keys_base64 in enumerate(symm_keys_base64):
-            symm_key_encrypted = base64.b64decode(symm_keys_base64.encode('utf-8'))
-            try: 
-                symm_key = self.encryption.decrypt_rsa(symm_key_encrypted, self.private_key)
-                plaintext_bytes = self.encryption.decrypt_aes_gcm(ciphertext, symm_key, iv, tag)
-                chat_data = json.loads(plaintext_bytes.decode('utf-8'))
-                
-                chat_content = chat_data.get("chat", {})
-                participants = chat_content.get("participants", [])
-                message = chat_content.get("message", "")
-                
-                                
-                if my_fingerprint in participants:
-                    sender_fingerprint = participants[0]
-                    
-                    sender_nickname = self.nicknames.get(sender_fingerprint)
-                    
-                    message_entry = {
-                        "sender": sender_fingerprint,
-                        "message": message
-                    }
-                    self.received_messages.append(message_entry)
-                    
+    async def handle_chat_envelope(self, frame):
+        """
+        Handle a chat received as a binary envelope, reading its fields without base64.
+        """
+        try:
+            iv, symm_keys, cipher_and_tag = ChatEnvelope.parse(frame).body()
+        except ValueError as e:
+            logger.warning(f"Invalid chat envelope: {e}")
+            return
 
-                    print(f"{GREEN}\n  - New chat from {sender_nickname}: {message}\n{RESET}")
-                    print(f"Enter message type (public, chat, clients, /transfer, files) (exit to exit): ")
+        if not symm_keys or not iv or not cipher_and_tag:
+            logger.warning("Invalid chat message")
+            return
+        await self.open_chat([bytes(symm_key) for symm_key in symm_keys], bytes(iv), cipher_and_tag)
 
+    async def open_chat(self, symm_keys, iv, cipher_and_tag, group=None):
+        """
+        Decrypts a chat with the symm_key wrapped for this client and emits it
+        as a chat event, with the group it was sent to if any.
+        """
+        my_fingerprint = self.fingerprint
+        ciphertext = cipher_and_tag[:-16]
+        tag = bytes(cipher_and_tag[-16:])
 
-                    decrypted = True
-                    break
-            except Exception as e:
-                continue
-            
-        if not decrypted:
+        # Every symm_key is tried in one background task. Chats for other
+        # clients of this server end up here too and fail all of them.
+        try:
+            _, symm_key = await self.crypto.unwrap_any(symm_keys, self.private_key)
+            plaintext_bytes = self.encryption.decrypt_aes_gcm(ciphertext, symm_key, iv, tag)
+            chat_data = codec.decode(plaintext_bytes)
+
+            chat_content = chat_data.get("chat", {})
+            participants = chat_content.get("participants", [])
+            message = chat_content.get("message", "")
+        except Exception:
+            return
+
+        if my_fingerprint not in participants:
             return
+
+        sender_fingerprint = participants[0]
+        sender_nickname = self.nicknames.get(sender_fingerprint)
+
+        message_entry = {
+            "sender": sender_fingerprint,
+            "message": message
+        }
+        self.received_messages.append(message_entry)
+
+        await self.emit(ClientEvent("chat", sender_fingerprint, sender_nickname, message, group))
             
 
     async def send(self, message_json):
@@ -666,20 +1566,44 @@ class Client:
         any exceptions that occur during the send operation.
         
         Args:
-            message_json: The message to be sent in JSON format
+            message_json: The message to be sent, encoded as a frame
+
+        Returns:
+            True if the message was written to the connection, or buffered
+            to be sent once a lost connection is back.
         """
-        try:
-            await self.connection.send(message_json)
-        except Exception as e:
-            print(f"Error sending message: {e}")
-            
-client = Client()
+        if self.connection is not None:
+            try:
+                await self.connection.send(message_json)
+                return True
+            except websockets.ConnectionClosed as e:
+                if not self.reconnect_policy.enabled or self.closing.is_set():
+                    logger.error(f"Error sending message: {e}")
+                    return False
+                # The receive loop is about to reconnect
+            except Exception as e:
+                logger.error(f"Error sending message: {e}")
+                return False
+        elif not self.reconnecting:
+            logger.error("Error sending message: not connected")
+            return False
+
+        if len(self.outbound) >= self.reconnect_policy.buffer_size:
+            self.reconnect_stats.dropped += 1
+            logger.warning("Outbound buffer full, message dropped")
+            return False
+        self.outbound.append(message_json)
+        self.reconnect_stats.buffered += 1
+        return True
+
 
 if __name__ == "__main__":
+    # Configure the logger
+    logging.basicConfig(level=logging.INFO)
+    client = Client()
     try:
         asyncio.run(client.start())
     except KeyboardInterrupt:
         print("Exiting...")
-        asyncio.run(client.close())
     
     
\ No newline at end of file
@@ -0,0 +1,155 @@
+import asyncio
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_POOL_WORKERS = 1
+
+
+class IdentityStore():
+    """
+    A client's private key on disk, so the client keeps its fingerprint and
+    nickname across runs instead of generating a key on every start.
+
+    The key is written as PKCS8 PEM, readable only by the user and encrypted
+    if a passphrase is given. Loading skips the RSA consistency check, which
+    costs about as much as generating a key, since the file was written here.
+    """
+    def __init__(self, path: str, encryption, passphrase: str | bytes | None = None):
+        self.path = path
+        self.encryption = encryption
+        if isinstance(passphrase, str):
+            passphrase = passphrase.encode('utf-8')
+        self.passphrase = passphrase or None
+
+    @classmethod
+    def from_env(cls, encryption) -> "IdentityStore | None":
+        """
+        Builds a store from OLAF_IDENTITY_FILE and OLAF_IDENTITY_PASSPHRASE.
+
+        Returns:
+            The store, or None if OLAF_IDENTITY_FILE is not set.
+        """
+        path = os.getenv('OLAF_IDENTITY_FILE')
+        if not path:
+            return None
+        return cls(path, encryption, os.getenv('OLAF_IDENTITY_PASSPHRASE'))
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def load(self):
+        """
+        Reads the private key.
+
+        Returns:
+            The private key, or None if there is no key file yet.
+
+        Raises:
+            ValueError if the file is not a key, or the passphrase is wrong or missing.
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                pem_private_key = f.read()
+        except FileNotFoundError:
+            return None
+
+        try:
+            return self.encryption.load_trusted_private_key(pem_private_key, self.passphrase)
+        except TypeError as e:
+            # Passphrase given for an unencrypted key or missing for an encrypted one
+            raise ValueError(f"Unable to read identity {self.path}: {e}") from e
+
+    def save(self, private_key) -> None:
+        """
+        Writes the private key, replacing the file atomically.
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+
+        tmp_path = f"{self.path}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self.encryption.export_private_key(private_key, self.passphrase))
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def load_or_create(self):
+        """
+        Reads the private key, generating and saving one on first use.
+
+        Returns:
+            A tuple of the private key and whether it was just created.
+        """
+        private_key = self.load()
+        if private_key is not None:
+            return private_key, False
+
+        private_key = self.encryption.generate_private_key()
+        self.save(private_key)
+        return private_key, True
+
+
+class KeyPool():
+    """
+    Generates private keys ahead of time on background threads, for tests and
+    load tools that need many fresh identities.
+
+    Up to size keys are generated or being generated at any time. get() takes
+    the oldest one and queues the generation of a replacement.
+    """
+    def __init__(self, encryption, size: int = DEFAULT_POOL_SIZE, workers: int = DEFAULT_POOL_WORKERS):
+        if size < 1:
+            raise ValueError("size must be at least 1")
+        self.encryption = encryption
+        self.size = size
+        self.workers = workers
+        self.executor = None
+
+        # concurrent.futures.Future of each key, oldest first
+        self.ready = deque()
+
+        self.taken = 0
+        self.waited = 0
+
+    def start(self) -> None:
+        """
+        Starts generating keys. Called by the first get() if not called before.
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="olaf-keygen")
+        self.fill()
+
+    def fill(self) -> None:
+        while len(self.ready) < self.size:
+            self.ready.append(self.executor.submit(self.encryption.generate_private_key))
+
+    async def get(self):
+        """
+        Returns a newly generated private key, waiting only if none is ready yet.
+        """
+        if self.executor is None:
+            self.start()
+        future = self.ready.popleft()
+        self.fill()
+
+        self.taken += 1
+        if not future.done():
+            self.waited += 1
+        return await asyncio.wrap_future(future)
+
+    def stop(self) -> None:
+        """
+        Stops generating keys, dropping the ones not taken.
+        """
+        for future in self.ready:
+            future.cancel()
+        self.ready.clear()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
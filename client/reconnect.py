@@ -0,0 +1,73 @@
+import os
+import random
+
+DEFAULT_RECONNECT_DELAY = 0.5
+DEFAULT_MAX_RECONNECT_DELAY = 30.0
+DEFAULT_MAX_RECONNECT_ATTEMPTS = 0
+DEFAULT_OUTBOUND_BUFFER = 1000
+
+
+class ReconnectPolicy():
+    """
+    When and how often a client tries to get its connection back.
+
+    Attempt n waits a random time between 0 and min(max_delay, delay * 2**n)
+    seconds, so clients dropped together by a server restart come back spread
+    out instead of all at once. max_attempts of 0 retries until closed.
+    While reconnecting, up to buffer_size outbound messages are kept and sent
+    once the connection is back.
+    """
+    def __init__(self, enabled: bool = True, delay: float = DEFAULT_RECONNECT_DELAY,
+                 max_delay: float = DEFAULT_MAX_RECONNECT_DELAY, max_attempts: int = DEFAULT_MAX_RECONNECT_ATTEMPTS,
+                 buffer_size: int = DEFAULT_OUTBOUND_BUFFER):
+        self.enabled = enabled
+        self.delay = delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.buffer_size = buffer_size
+
+    @classmethod
+    def from_env(cls) -> "ReconnectPolicy":
+        """
+        Reads OLAF_RECONNECT (on or off), OLAF_RECONNECT_DELAY, OLAF_RECONNECT_MAX_DELAY,
+        OLAF_RECONNECT_MAX_ATTEMPTS and OLAF_OUTBOUND_BUFFER.
+        """
+        return cls(
+            enabled=os.getenv('OLAF_RECONNECT', 'on').lower() not in ('off', 'none', '0', 'false'),
+            delay=float(os.getenv('OLAF_RECONNECT_DELAY', DEFAULT_RECONNECT_DELAY)),
+            max_delay=float(os.getenv('OLAF_RECONNECT_MAX_DELAY', DEFAULT_MAX_RECONNECT_DELAY)),
+            max_attempts=int(os.getenv('OLAF_RECONNECT_MAX_ATTEMPTS', DEFAULT_MAX_RECONNECT_ATTEMPTS)),
+            buffer_size=int(os.getenv('OLAF_OUTBOUND_BUFFER', DEFAULT_OUTBOUND_BUFFER)),
+        )
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Seconds to wait before attempt number attempt, counting from 0.
+        """
+        return random.uniform(0, min(self.max_delay, self.delay * 2 ** min(attempt, 32)))
+
+    def should_retry(self, attempt: int) -> bool:
+        return self.enabled and (self.max_attempts == 0 or attempt < self.max_attempts)
+
+
+class ReconnectStats():
+    """
+    Reconnect timings of a client, for monitoring.
+
+    downtime is in seconds, from losing the connection to having it back.
+    buffered counts messages sent while reconnecting, dropped those that did
+    not fit in the buffer.
+    """
+    __slots__ = ('disconnects', 'attempts', 'reconnects', 'last_downtime', 'total_downtime', 'buffered', 'dropped')
+
+    def __init__(self):
+        self.disconnects = 0
+        self.attempts = 0
+        self.reconnects = 0
+        self.last_downtime = 0.0
+        self.total_downtime = 0.0
+        self.buffered = 0
+        self.dropped = 0
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
@@ -0,0 +1,116 @@
+import asyncio
+import json
+import os
+import sys
+import unittest
+
+import websockets
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from client.client import Client, ChatResult
+from client.reconnect import ReconnectPolicy
+
+
+class TestChatBatch(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.received = []
+        self.server = await websockets.serve(self.handler, "localhost", 0)
+        port = self.server.sockets[0].getsockname()[1]
+
+        self.client = Client(f"localhost:{port}", 9001, reconnect=ReconnectPolicy(enabled=False))
+        await self.client.load_keys()
+
+        self.events = []
+        self.bob = Client(on_event=self.on_event)
+        await self.bob.load_keys()
+        self.add_client(self.bob, "bob")
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handler(self, websocket):
+        async for message in websocket:
+            self.received.append(json.loads(message))
+
+    async def on_event(self, event):
+        self.events.append(event)
+
+    def add_client(self, other, nickname):
+        fingerprint = other.fingerprint
+        self.client.clients[fingerprint] = other.public_key_pem
+        self.client.server_fingerprints[fingerprint] = "localhost:9000"
+        self.client.nicknames[fingerprint] = nickname
+
+    async def chats(self, count):
+        while len(self.received) < count + 1:
+            await asyncio.sleep(0.01)
+        return [message for message in self.received if message["data"]["type"] != "hello"]
+
+    async def test_one_result_per_chat(self):
+        await self.client.connect()
+        results = await self.client.send_chat_batch([(["bob"], "one"), (["nobody"], "lost"), (["bob"], "two")])
+
+        self.assertEqual(results, [
+            ChatResult(["bob"], "one", True),
+            ChatResult(["nobody"], "lost", False, "No valid recipients"),
+            ChatResult(["bob"], "two", True),
+        ])
+
+        chats = await asyncio.wait_for(self.chats(2), 5)
+        for chat in chats:
+            await self.bob.handle_chat(chat)
+        self.assertEqual([event.message for event in self.events], ["one", "two"])
+        self.assertNotEqual(chats[0]["data"]["iv"], chats[1]["data"]["iv"])
+
+    async def test_frames_are_written_in_counter_order(self):
+        await self.client.connect()
+        batch = [(["bob"], str(i)) for i in range(20)]
+        # The public chat is sent while the batch wraps its keys
+        results, sent = await asyncio.gather(self.client.send_chat_batch(batch), self.client.send_public_chat("hi"))
+
+        self.assertTrue(sent)
+        self.assertTrue(all(result.sent for result in results))
+        messages = await asyncio.wait_for(self.chats(21), 5)
+        counters = [message["counter"] for message in messages]
+        self.assertEqual(counters, sorted(counters))
+        self.assertEqual(len(set(counters)), 21)
+        self.assertEqual(messages[0]["data"]["type"], "public_chat")
+
+    async def test_encrypt_failure(self):
+        self.client.clients["bad"] = b"not a key"
+        self.client.server_fingerprints["bad"] = "localhost:9000"
+        self.client.nicknames["bad"] = "mallory"
+        await self.client.connect()
+
+        results = await self.client.send_chat_batch([(["mallory"], "x"), (["bob"], "y")])
+        self.assertFalse(results[0].sent)
+        self.assertTrue(results[0].error.startswith("Unable to encrypt"))
+        self.assertEqual(results[1], ChatResult(["bob"], "y", True))
+        self.assertEqual(len(await asyncio.wait_for(self.chats(1), 5)), 1)
+
+    async def test_not_connected(self):
+        results = await self.client.send_chat_batch([(["bob"], "one"), (["bob"], "two")])
+        self.assertEqual(results, [
+            ChatResult(["bob"], "one", False, "Not connected"),
+            ChatResult(["bob"], "two", False, "Not connected"),
+        ])
+
+    async def test_buffered_while_reconnecting(self):
+        self.client.reconnect_policy = ReconnectPolicy(buffer_size=10)
+        self.client.reconnecting = True
+        results = await self.client.send_chat_batch([(["bob"], "one"), (["bob"], "two")])
+
+        self.assertTrue(all(result.sent for result in results))
+        counters = [json.loads(frame)["counter"] for frame in self.client.outbound]
+        self.assertEqual(counters, [1, 2])
+
+        await self.client.open_connection()
+        chats = await asyncio.wait_for(self.chats(2), 5)
+        self.assertEqual([chat["counter"] for chat in chats], [1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from client.client import Client, ClientEvent
+
+
+class TestClientEvents(unittest.IsolatedAsyncioTestCase):
+
+    def test_constructor_does_not_touch_the_loop(self):
+        client = Client("localhost:9000", 9001)
+        self.assertEqual(client.server_address, "ws://localhost:9000")
+        self.assertIsNone(client.connection)
+
+    async def test_events_end_with_disconnect(self):
+        client = Client("localhost:9000", 9001)
+        await client.emit(ClientEvent("public_chat", "abc", "Alice", "hi"))
+        await client.emit(ClientEvent("disconnected"))
+        await client.emit(ClientEvent("public_chat", "abc", "Alice", "never read"))
+
+        events = [event async for event in client.events()]
+        self.assertEqual([event.type for event in events], ["public_chat", "disconnected"])
+
+    async def test_full_queue_drops_oldest(self):
+        client = Client(event_queue_size=2)
+        for i in range(3):
+            await client.emit(ClientEvent("chat", message=str(i)))
+        self.assertEqual(client.dropped_events, 1)
+        self.assertEqual(client.event_queue.get_nowait().message, "1")
+
+    async def test_callback(self):
+        received = []
+
+        async def on_event(event):
+            received.append(event)
+
+        client = Client(on_event=on_event)
+        await client.emit(ClientEvent("client_list"))
+        self.assertEqual(received, [ClientEvent("client_list")])
+        self.assertTrue(client.event_queue.empty())
+
+    async def test_client_list_tracks_servers(self):
+        client = Client()
+        peer = Client()
+        await peer.load_keys()
+        pem = peer.public_key_pem.decode('utf-8')
+
+        for address in ("localhost:9000", "localhost:9002"):
+            await client.handle_client_list({"type": "client_list", "servers": [{"address": address, "clients": [pem]}]})
+            self.assertEqual(client.server_fingerprints, {peer.fingerprint: address})
+
+    async def test_send_without_connection(self):
+        client = Client()
+        self.assertFalse(await client.send("{}"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import stat
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from security.security_module import Encryption
+from client.identity_store import IdentityStore, KeyPool
+
+
+class TestIdentityStore(unittest.TestCase):
+
+    def setUp(self):
+        self.encryption = Encryption()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "keys", "identity.pem")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def public_pem(self, private_key):
+        return self.encryption.export_public_key(private_key.public_key())
+
+    def test_load_or_create_keeps_the_key(self):
+        store = IdentityStore(self.path, self.encryption)
+        self.assertIsNone(store.load())
+
+        private_key, created = store.load_or_create()
+        self.assertTrue(created)
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+
+        loaded, created = IdentityStore(self.path, self.encryption).load_or_create()
+        self.assertFalse(created)
+        self.assertEqual(self.public_pem(loaded), self.public_pem(private_key))
+
+    def test_passphrase(self):
+        private_key, _ = IdentityStore(self.path, self.encryption, "secret").load_or_create()
+        with open(self.path, 'rb') as f:
+            self.assertIn(b"ENCRYPTED", f.read())
+
+        loaded = IdentityStore(self.path, self.encryption, "secret").load()
+        self.assertEqual(self.public_pem(loaded), self.public_pem(private_key))
+
+        with self.assertRaises(ValueError):
+            IdentityStore(self.path, self.encryption, "wrong").load()
+        with self.assertRaises(ValueError):
+            IdentityStore(self.path, self.encryption).load()
+
+
+class TestKeyPool(unittest.IsolatedAsyncioTestCase):
+
+    async def test_keys_are_distinct_and_replenished(self):
+        encryption = Encryption()
+        pool = KeyPool(encryption, size=2)
+        try:
+            keys = [await pool.get() for _ in range(3)]
+            self.assertEqual(len({encryption.export_public_key(key.public_key()) for key in keys}), 3)
+            self.assertEqual(len(pool.ready), 2)
+            self.assertEqual(pool.taken, 3)
+        finally:
+            pool.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
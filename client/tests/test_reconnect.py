@@ -0,0 +1,128 @@
+import asyncio
+import json
+import os
+import sys
+import unittest
+
+import websockets
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from client.client import Client
+from client.reconnect import ReconnectPolicy
+from protocol.membership import membership_digest
+
+
+class TestReconnectPolicy(unittest.TestCase):
+
+    def test_backoff_is_bounded(self):
+        policy = ReconnectPolicy(delay=0.5, max_delay=4)
+        for attempt in range(100):
+            self.assertLessEqual(policy.backoff(attempt), min(4, 0.5 * 2 ** attempt))
+
+    def test_max_attempts(self):
+        policy = ReconnectPolicy(max_attempts=2)
+        self.assertTrue(policy.should_retry(1))
+        self.assertFalse(policy.should_retry(2))
+        self.assertFalse(ReconnectPolicy(enabled=False).should_retry(0))
+
+
+class TestReconnect(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.received = []
+        self.connections = 0
+        self.server = await websockets.serve(self.handler, "localhost", 0)
+        port = self.server.sockets[0].getsockname()[1]
+
+        self.client = Client(f"localhost:{port}", 9001, reconnect=ReconnectPolicy(delay=0.01, buffer_size=2))
+        await self.client.load_keys()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handler(self, websocket):
+        self.connections += 1
+        first = self.connections == 1
+        async for message in websocket:
+            self.received.append(json.loads(message))
+            if first:
+                # Drop the first connection right after the hello
+                await websocket.close()
+
+    async def wait_for(self, count):
+        while len(self.received) < count:
+            await asyncio.sleep(0.01)
+
+    async def test_reconnects_and_flushes_buffer(self):
+        self.client.clients = {"abc": None}
+        self.client.server_fingerprints = {"abc": "localhost:9000"}
+        await self.client.connect()
+        await asyncio.wait_for(self.wait_for(2), 5)
+
+        hellos = [message for message in self.received if message["data"]["type"] == "hello"]
+        self.assertEqual(len(hellos), 2)
+        self.assertEqual(hellos[1]["data"]["client_list_digest"], membership_digest({"abc": "localhost:9000"}))
+        self.assertLess(hellos[0]["counter"], hellos[1]["counter"])
+        self.assertEqual(hellos[0]["data"]["public_key"], hellos[1]["data"]["public_key"])
+        self.assertEqual(self.client.reconnect_stats.reconnects, 1)
+
+    async def test_buffers_while_reconnecting(self):
+        self.client.reconnecting = True
+        self.assertTrue(await self.client.send('{"n":1}'))
+        self.assertTrue(await self.client.send('{"n":2}'))
+        self.assertFalse(await self.client.send('{"n":3}'))
+        self.assertEqual(self.client.reconnect_stats.dropped, 1)
+
+        self.connections = 1 # keep this connection open
+        await self.client.open_connection()
+        await asyncio.wait_for(self.wait_for(3), 5)
+        self.assertEqual(self.received[1:], [{"n": 1}, {"n": 2}])
+        self.assertEqual(len(self.client.outbound), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+class TestRedirect(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.events = []
+        self.hellos = {"busy": [], "idle": []}
+        self.idle = await websockets.serve(self.idle_handler, "localhost", 0)
+        self.idle_port = self.idle.sockets[0].getsockname()[1]
+        self.busy = await websockets.serve(self.busy_handler, "localhost", 0)
+        port = self.busy.sockets[0].getsockname()[1]
+
+        self.client = Client(f"localhost:{port}", 9001, on_event=self.events.append,
+                             reconnect=ReconnectPolicy(delay=0.01))
+        await self.client.load_keys()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        for server in (self.busy, self.idle):
+            server.close()
+            await server.wait_closed()
+
+    async def busy_handler(self, websocket):
+        self.hellos["busy"].append(json.loads(await websocket.recv()))
+        await websocket.send(json.dumps({"type": "redirect", "address": f"localhost:{self.idle_port}", "http_port": 8001}))
+        await websocket.close()
+
+    async def idle_handler(self, websocket):
+        async for message in websocket:
+            self.hellos["idle"].append(json.loads(message))
+
+    async def test_follows_redirect_once(self):
+        await self.client.connect()
+        while not self.hellos["idle"]:
+            await asyncio.sleep(0.01)
+
+        self.assertIn("redirect", self.hellos["busy"][0]["data"]["capabilities"])
+        self.assertNotIn("redirect", self.hellos["idle"][0]["data"]["capabilities"])
+        self.assertEqual(self.client.server_address, f"ws://localhost:{self.idle_port}")
+        self.assertEqual(self.client.http_port, 8001)
+        self.assertEqual([event.type for event in self.events], ["redirected"])
+        self.assertEqual(self.client.reconnect_stats.disconnects, 0)
@@ -0,0 +1,129 @@
+import asyncio
+import os
+
+import websockets
+
+from protocol.envelope import is_envelope
+
+# Type of the envelope carrying several messages in one frame
+BATCH_TYPE = "batch"
+
+DEFAULT_BATCH_WINDOW = 0.002
+DEFAULT_BATCH_MAX_BYTES = 64 * 1024
+DEFAULT_BATCH_MAX_MESSAGES = 64
+
+# Most messages a received batch may carry
+MAX_BATCH_MESSAGES = 1024
+
+
+class BatchSettings():
+    """
+    When messages queued for one connection are sent together.
+
+    Messages are held for up to window seconds after the first one and go out
+    as one {"type": "batch", "messages": [...]} frame, earlier once max_bytes
+    or max_messages are queued. Messages of max_bytes or more, and binary chat
+    envelopes, which a JSON batch cannot hold, are sent alone.
+    Batches only go to peers that said in their hello that they accept them.
+    """
+    def __init__(self, enabled: bool = False, window: float = DEFAULT_BATCH_WINDOW,
+                 max_bytes: int = DEFAULT_BATCH_MAX_BYTES, max_messages: int = DEFAULT_BATCH_MAX_MESSAGES):
+        self.enabled = enabled
+        self.window = window
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+
+    @classmethod
+    def from_env(cls) -> "BatchSettings":
+        """
+        Reads BATCH_FRAMES (on or off), BATCH_WINDOW_MS, BATCH_MAX_BYTES and BATCH_MAX_MESSAGES.
+        """
+        return cls(
+            enabled=os.getenv('BATCH_FRAMES', 'off').lower() in ('on', '1', 'true'),
+            window=float(os.getenv('BATCH_WINDOW_MS', DEFAULT_BATCH_WINDOW * 1000)) / 1000,
+            max_bytes=int(os.getenv('BATCH_MAX_BYTES', DEFAULT_BATCH_MAX_BYTES)),
+            max_messages=int(os.getenv('BATCH_MAX_MESSAGES', DEFAULT_BATCH_MAX_MESSAGES)),
+        )
+
+
+def batch_frame(frames: list) -> str | bytes:
+    """
+    Wraps encoded messages, all str or all bytes, in a batch frame without decoding them.
+    """
+    if isinstance(frames[0], str):
+        return '{"type":"batch","messages":[%s]}' % ",".join(frames)
+    return b'{"type":"batch","messages":[%s]}' % b",".join(frames)
+
+
+def unpack_batch(message: dict) -> list | None:
+    """
+    Returns the messages of a batch, or None if message is not a well formed batch.
+    """
+    messages = message.get("messages")
+    if type(messages) is not list or len(messages) > MAX_BATCH_MESSAGES:
+        return None
+    if not all(type(inner) is dict for inner in messages):
+        return None
+    return messages
+
+
+class FrameBatcher():
+    """
+    Collects the frames sent on one websocket and sends them in batches.
+
+    on_flush, if given, is called with the number of messages in every batch sent.
+    """
+    def __init__(self, websocket, settings: BatchSettings, on_flush=None):
+        self.websocket = websocket
+        self.settings = settings
+        self.on_flush = on_flush
+
+        self.frames = []
+        self.size = 0
+        self.timer = None
+
+    async def send(self, frame: str | bytes) -> None:
+        """
+        Queues frame, sending the batch if it is full.
+
+        Raises:
+            websockets.ConnectionClosed if the connection has closed.
+        """
+        if len(frame) >= self.settings.max_bytes or is_envelope(frame):
+            # Sent alone, after what was queued before it
+            await self.flush()
+            await self.websocket.send(frame)
+            return
+
+        self.frames.append(frame)
+        self.size += len(frame)
+        if self.size >= self.settings.max_bytes or len(self.frames) >= self.settings.max_messages:
+            await self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.settings.window, self.flush_later)
+
+    def flush_later(self) -> None:
+        self.timer = None
+        asyncio.ensure_future(self.flush_quietly())
+
+    async def flush_quietly(self) -> None:
+        try:
+            await self.flush()
+        except websockets.ConnectionClosed:
+            # The receive loop cleans up closed connections
+            pass
+
+    async def flush(self) -> None:
+        """
+        Sends the queued frames now.
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.frames:
+            return
+
+        frames, self.frames, self.size = self.frames, [], 0
+        await self.websocket.send(frames[0] if len(frames) == 1 else batch_frame(frames))
+        if self.on_flush is not None:
+            self.on_flush(len(frames))
@@ -0,0 +1,49 @@
+# Optional protocol extensions a peer can advertise in the "capabilities" list
+# of its hello or server_hello. A peer that sends no list is a stock OLAF peer
+# and only ever gets the standard message formats.
+
+# Accepts {"type": "batch", "messages": [...]} frames
+CAP_BATCH = "batch"
+# Understands the "digest" of client lists and sends client_list_digest when reconnecting
+CAP_LIST_DIGEST = "list_digest"
+# Answers key_request with key_response
+CAP_KEY_REQUEST = "key_request"
+# Relayed chats may carry msg_id, hops and origin
+CAP_RELAY_IDS = "relay_ids"
+# Takes part in overlay routing with link_state messages
+CAP_LINK_STATE = "link_state"
+# Sends and accepts chats as binary envelopes (protocol/envelope.py). Servers
+# tell clients that advertised capabilities theirs in the client_list.
+CAP_BINARY_CHAT = "binary_chat"
+# Keeps named groups: group_join, group_leave and group_members for clients,
+# group_update between servers, and chats to a group instead of to servers
+CAP_GROUPS = "groups"
+# Sends neighbours load_report messages with its clients, send buffers and loop lag
+CAP_LOAD_REPORT = "load_report"
+# Follows a redirect to another server sent in answer to its hello
+CAP_REDIRECT = "redirect"
+
+MAX_CAPABILITIES = 32
+MAX_CAPABILITY_LENGTH = 32
+
+
+def parse_capabilities(data: dict) -> frozenset:
+    """
+    Reads the capabilities a peer advertised in a hello or server_hello.
+
+    Returns:
+        The capability names, empty for stock peers. Malformed lists are
+        treated as empty and names that are not strings are ignored.
+    """
+    capabilities = data.get("capabilities")
+    if type(capabilities) is not list or len(capabilities) > MAX_CAPABILITIES:
+        return frozenset()
+    return frozenset(capability for capability in capabilities
+                     if type(capability) is str and len(capability) <= MAX_CAPABILITY_LENGTH)
+
+
+def capabilities_field(capabilities) -> list:
+    """
+    Returns capabilities as the list sent in a handshake.
+    """
+    return sorted(capabilities)
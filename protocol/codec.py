@@ -0,0 +1,158 @@
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Raised by Codec.decode for malformed input. orjson's error subclasses it.
+DecodeError = json.JSONDecodeError
+
+
+class Codec():
+    """
+    JSON encodings used by OLAF, backed by the standard library.
+
+    Two encodings are used:
+    - The canonical encoding is what gets signed. It is the compact, sorted-key,
+      ASCII-escaped form every OLAF implementation signs, so it must stay byte
+      identical to json.dumps(obj, separators=(',', ':'), sort_keys=True).
+    - The wire encoding is what gets sent. It only needs to be valid JSON.
+
+    When binary_frames is set, wire frames are bytes and go out as binary
+    websocket frames instead of text frames.
+    """
+    name = "json"
+
+    def __init__(self, binary_frames: bool = False):
+        self.binary_frames = binary_frames
+
+    def canonical(self, obj) -> bytes:
+        """
+        Encodes obj in the canonical signing encoding.
+        """
+        return json.dumps(obj, separators=(',', ':'), sort_keys=True).encode('utf-8')
+
+    def encode_bytes(self, obj) -> bytes:
+        """
+        Encodes obj as UTF-8 JSON bytes.
+        """
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+    def decode(self, data: str | bytes):
+        """
+        Decodes a JSON document from str or bytes.
+        """
+        return json.loads(data)
+
+    def frame(self, data: bytes) -> str | bytes:
+        """
+        Turns encoded JSON bytes into a websocket frame.
+        """
+        return data if self.binary_frames else data.decode('utf-8')
+
+    def as_frame(self, frame: str | bytes) -> str | bytes:
+        """
+        Converts a received frame to the frame kind this codec sends, for forwarding.
+        """
+        if isinstance(frame, str):
+            return frame.encode('utf-8') if self.binary_frames else frame
+        return frame if self.binary_frames else frame.decode('utf-8')
+
+    def encode(self, obj) -> str | bytes:
+        """
+        Encodes obj as a websocket frame.
+        """
+        if self.binary_frames:
+            return self.encode_bytes(obj)
+        return json.dumps(obj, separators=(',', ':'))
+
+    @staticmethod
+    def signing_payload(data_json: bytes, counter: int) -> bytes:
+        """
+        Canonical encoding of {"data": data, "counter": counter}, given the canonical encoding of data.
+        """
+        return b'{"counter":%d,"data":%s}' % (counter, data_json)
+
+    def signed_frame(self, data_json: bytes, counter: int, signature: str) -> str | bytes:
+        """
+        Builds a signed_data frame around already encoded data, without encoding data again.
+        """
+        frame = b'{"type":"signed_data","data":%s,"counter":%d,"signature":"%s"}' % (
+            data_json, counter, signature.encode('ascii'))
+        return self.frame(frame)
+
+
+def contains_float(obj) -> bool:
+    """
+    Returns whether a JSON value holds a float anywhere inside it.
+    """
+    if type(obj) is float:
+        return True
+    if type(obj) is dict:
+        return any(contains_float(value) for value in obj.values())
+    if type(obj) in (list, tuple):
+        return any(contains_float(value) for value in obj)
+    return False
+
+
+class OrjsonCodec(Codec):
+    """
+    Codec backed by orjson, falling back to the standard library where orjson's
+    output would differ from the canonical encoding.
+    """
+    name = "orjson"
+
+    def canonical(self, obj) -> bytes:
+        # orjson writes floats its own way (1e16 for 1e+16, null for NaN), so
+        # anything holding one is left to the standard library
+        if contains_float(obj):
+            return super().canonical(obj)
+
+        try:
+            data = orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+        except TypeError:
+            # e.g. integers over 64 bits or non-string keys
+            return super().canonical(obj)
+
+        # The standard library escapes everything outside printable ASCII,
+        # orjson writes it out as UTF-8. Only ASCII-only output matches.
+        if data.isascii() and b'\x7f' not in data:
+            return data
+        return super().canonical(obj)
+
+    def encode_bytes(self, obj) -> bytes:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            return super().encode_bytes(obj)
+
+    def decode(self, data: str | bytes):
+        return orjson.loads(data)
+
+    def encode(self, obj) -> str | bytes:
+        return self.frame(self.encode_bytes(obj))
+
+
+def create_codec(backend: str | None = None, binary_frames: bool | None = None) -> Codec:
+    """
+    Creates a codec.
+
+    Args:
+        backend: "orjson" or "json". Defaults to the OLAF_JSON_BACKEND environment
+            variable, then to orjson if it is installed.
+        binary_frames: send binary instead of text frames. Defaults to the
+            OLAF_BINARY_FRAMES environment variable.
+    """
+    if backend is None:
+        backend = os.getenv('OLAF_JSON_BACKEND', 'orjson' if orjson is not None else 'json')
+    if binary_frames is None:
+        binary_frames = os.getenv('OLAF_BINARY_FRAMES', '0') == '1'
+
+    if backend == 'orjson' and orjson is not None:
+        return OrjsonCodec(binary_frames)
+    return Codec(binary_frames)
+
+
+codec = create_codec()
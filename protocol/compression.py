@@ -0,0 +1,204 @@
+import gzip
+import mimetypes
+import os
+import zlib
+
+from websockets.extensions.permessage_deflate import (
+    PerMessageDeflate,
+    ClientPerMessageDeflateFactory,
+    ServerPerMessageDeflateFactory,
+)
+from websockets.frames import CTRL_OPCODES, OP_CONT
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DEFAULT_WINDOW_BITS = 12
+DEFAULT_MEM_LEVEL = 5
+DEFAULT_LEVEL = 6
+DEFAULT_MIN_SIZE = 128
+
+# Content types worth compressing over HTTP, besides text/*.
+COMPRESSIBLE_TYPES = {
+    'application/json',
+    'application/javascript',
+    'application/xml',
+    'application/x-sh',
+    'application/x-python-code',
+    'image/svg+xml',
+}
+
+
+class ThresholdPerMessageDeflate(PerMessageDeflate):
+    """
+    permessage-deflate that sends messages under min_size uncompressed.
+
+    Small chat frames barely shrink and still cost a compressor call on both
+    ends. The extension allows any message to go out uncompressed, the peer
+    only looks at the RSV1 bit, so this needs nothing from the other side.
+    """
+    def __init__(self, *args, min_size: int = DEFAULT_MIN_SIZE, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.min_size = min_size
+        self.skip_message = False
+
+    @classmethod
+    def wrap(cls, extension: PerMessageDeflate, min_size: int) -> "ThresholdPerMessageDeflate":
+        return cls(
+            extension.remote_no_context_takeover,
+            extension.local_no_context_takeover,
+            extension.remote_max_window_bits,
+            extension.local_max_window_bits,
+            extension.compress_settings,
+            min_size=min_size,
+        )
+
+    def encode(self, frame):
+        if frame.opcode in CTRL_OPCODES:
+            return frame
+        if frame.opcode is not OP_CONT:
+            self.skip_message = len(frame.data) < self.min_size
+        if self.skip_message:
+            return frame
+        return super().encode(frame)
+
+
+class ThresholdServerFactory(ServerPerMessageDeflateFactory):
+
+    def __init__(self, *args, min_size: int = DEFAULT_MIN_SIZE, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.min_size = min_size
+
+    def process_request_params(self, params, accepted_extensions):
+        response_params, extension = super().process_request_params(params, accepted_extensions)
+        return response_params, ThresholdPerMessageDeflate.wrap(extension, self.min_size)
+
+
+class ThresholdClientFactory(ClientPerMessageDeflateFactory):
+
+    def __init__(self, *args, min_size: int = DEFAULT_MIN_SIZE, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.min_size = min_size
+
+    def process_response_params(self, params, accepted_extensions):
+        extension = super().process_response_params(params, accepted_extensions)
+        return ThresholdPerMessageDeflate.wrap(extension, self.min_size)
+
+
+class CompressionSettings():
+    """
+    permessage-deflate settings for client and neighbour websocket links.
+
+    window_bits bounds the compression window both ends use (8 to 15, memory
+    grows with it), mem_level and level are passed to zlib, and messages under
+    min_size bytes are sent uncompressed.
+    """
+    def __init__(self, enabled: bool = True, window_bits: int = DEFAULT_WINDOW_BITS, mem_level: int = DEFAULT_MEM_LEVEL,
+                 level: int = DEFAULT_LEVEL, min_size: int = DEFAULT_MIN_SIZE):
+        if not 8 <= window_bits <= 15:
+            raise ValueError("window_bits must be between 8 and 15")
+        if not 1 <= mem_level <= 9:
+            raise ValueError("mem_level must be between 1 and 9")
+        self.enabled = enabled
+        self.window_bits = window_bits
+        self.mem_level = mem_level
+        self.level = level
+        self.min_size = min_size
+
+    @classmethod
+    def from_env(cls) -> "CompressionSettings":
+        """
+        Reads WS_COMPRESSION (deflate or off), WS_COMPRESSION_WINDOW_BITS,
+        WS_COMPRESSION_MEM_LEVEL, WS_COMPRESSION_LEVEL and WS_COMPRESSION_MIN_SIZE.
+        """
+        return cls(
+            enabled=os.getenv('WS_COMPRESSION', 'deflate').lower() not in ('off', 'none', '0', 'false'),
+            window_bits=int(os.getenv('WS_COMPRESSION_WINDOW_BITS', DEFAULT_WINDOW_BITS)),
+            mem_level=int(os.getenv('WS_COMPRESSION_MEM_LEVEL', DEFAULT_MEM_LEVEL)),
+            level=int(os.getenv('WS_COMPRESSION_LEVEL', DEFAULT_LEVEL)),
+            min_size=int(os.getenv('WS_COMPRESSION_MIN_SIZE', DEFAULT_MIN_SIZE)),
+        )
+
+    @property
+    def compress_settings(self) -> dict:
+        return {"memLevel": self.mem_level, "level": self.level}
+
+    def server_extensions(self) -> list:
+        """
+        Extensions for serve(), used with compression=None.
+        """
+        if not self.enabled:
+            return []
+        return [ThresholdServerFactory(
+            server_max_window_bits=self.window_bits,
+            client_max_window_bits=self.window_bits,
+            compress_settings=self.compress_settings,
+            min_size=self.min_size,
+        )]
+
+    def client_extensions(self) -> list:
+        """
+        Extensions for websockets.connect(), used with compression=None.
+        """
+        if not self.enabled:
+            return []
+        return [ThresholdClientFactory(
+            server_max_window_bits=self.window_bits,
+            client_max_window_bits=self.window_bits,
+            compress_settings=self.compress_settings,
+            min_size=self.min_size,
+        )]
+
+
+def is_compressible(filename: str) -> bool:
+    """
+    Returns True if a file of this name is likely to shrink under gzip or zstd.
+    """
+    content_type, encoding = mimetypes.guess_type(filename)
+    if encoding is not None or content_type is None:
+        return False
+    return content_type.startswith('text/') or content_type in COMPRESSIBLE_TYPES
+
+
+def http_encodings() -> tuple:
+    """
+    Content encodings this side can produce, preferred first.
+    """
+    return ('zstd', 'gzip') if zstandard is not None else ('gzip',)
+
+
+def choose_encoding(accept_encoding: str) -> str | None:
+    """
+    Picks the content encoding to answer a request with from its Accept-Encoding header.
+    """
+    accepted = set()
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        if params.strip().replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(name.strip().lower())
+    for encoding in http_encodings():
+        if encoding in accepted:
+            return encoding
+    return None
+
+
+def compress_body(data: bytes, encoding: str) -> bytes:
+    """
+    Compresses data with a content encoding returned by choose_encoding.
+    """
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=6, mtime=0)
+    raise ValueError(f"unsupported content encoding '{encoding}'")
+
+
+def decompress_body(data: bytes, encoding: str) -> bytes:
+    if encoding == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(data)
+    if encoding == 'gzip':
+        return zlib.decompress(data, wbits=31)
+    raise ValueError(f"unsupported content encoding '{encoding}'")
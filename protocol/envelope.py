@@ -0,0 +1,220 @@
+import base64
+import struct
+
+# Binary form of a signed chat, sent as a binary websocket frame to peers that
+# advertise the binary_chat capability. All integers are big-endian.
+#
+#   magic                     4 bytes, never the start of a JSON document
+#   counter                   uint64
+#   hops                      uint8
+#   msg_id, origin            uint16 length, UTF-8, empty if not set
+#   destination_servers       uint16 count, then uint16 length and UTF-8 each
+#   signature                 uint16 length, raw bytes
+#   --- body, not needed for routing ---
+#   iv                        uint16 length, raw bytes
+#   symm_keys                 uint16 count, then uint16 length and raw bytes each
+#   chat                      uint32 length, raw ciphertext and tag
+#
+# The header carries everything a server needs to route the chat, so the body
+# is forwarded without being looked at. The signature is the one of the JSON
+# form, so every envelope converts back to the exact signed_data message it
+# was made from, for peers that only understand JSON.
+ENVELOPE_MAGIC = b"\x00OLB"
+PREFIX = struct.Struct(">4sQB")
+LENGTH = struct.Struct(">H")
+CHAT_LENGTH = struct.Struct(">I")
+
+# Bounds of the chat schema, in raw bytes where JSON has base64, so that every
+# envelope converts to a chat stock peers accept
+MAX_ENVELOPE_STRING = 256
+MAX_ENVELOPE_DESTINATIONS = 256
+MAX_ENVELOPE_SIGNATURE = 768
+MAX_ENVELOPE_IV = 48
+MAX_ENVELOPE_SYMM_KEY = 768
+MAX_ENVELOPE_SYMM_KEYS = 1024
+MAX_ENVELOPE_CHAT = 384 * 1024
+MAX_HOPS = 255
+
+
+def is_envelope(frame) -> bool:
+    """
+    Returns True if a received frame is a binary chat envelope rather than JSON.
+    """
+    return isinstance(frame, bytes) and frame[:len(ENVELOPE_MAGIC)] == ENVELOPE_MAGIC
+
+
+def pack_string(value: str) -> bytes:
+    encoded = value.encode('utf-8')
+    return LENGTH.pack(len(encoded)) + encoded
+
+
+def pack_header(counter: int, hops: int, msg_id: str | None, origin: str | None,
+                destination_servers: list, signature: bytes) -> bytes:
+    parts = [PREFIX.pack(ENVELOPE_MAGIC, counter, min(hops, MAX_HOPS)),
+             pack_string(msg_id or ""), pack_string(origin or ""), LENGTH.pack(len(destination_servers))]
+    parts.extend(pack_string(server) for server in destination_servers)
+    parts.append(LENGTH.pack(len(signature)) + signature)
+    return b"".join(parts)
+
+
+def encode_chat_envelope(data: dict, counter: int, signature: bytes) -> bytes:
+    """
+    Encodes a signed chat as a binary envelope.
+
+    Args:
+        data: the signed chat data, with base64 iv, symm_keys and chat as sent in JSON.
+        counter: the counter the data was signed with.
+        signature: the raw signature.
+    """
+    symm_keys = [base64.b64decode(symm_key) for symm_key in data["symm_keys"]]
+    iv = base64.b64decode(data["iv"])
+    chat = base64.b64decode(data["chat"])
+
+    parts = [pack_header(counter, 0, None, None, data["destination_servers"], signature),
+             LENGTH.pack(len(iv)), iv, LENGTH.pack(len(symm_keys))]
+    for symm_key in symm_keys:
+        parts.append(LENGTH.pack(len(symm_key)))
+        parts.append(symm_key)
+    parts.append(CHAT_LENGTH.pack(len(chat)))
+    parts.append(chat)
+    return b"".join(parts)
+
+
+def read_field(frame: bytes, offset: int, max_length: int, prefix: struct.Struct = LENGTH) -> tuple:
+    """
+    Returns the start and end offsets of the length-prefixed field at offset.
+    """
+    if offset + prefix.size > len(frame):
+        raise ValueError("Envelope is truncated")
+    length, = prefix.unpack_from(frame, offset)
+    if length > max_length:
+        raise ValueError("Envelope field is too long")
+    offset += prefix.size
+    end = offset + length
+    if end > len(frame):
+        raise ValueError("Envelope is truncated")
+    return offset, end
+
+
+def read_string(frame: bytes, offset: int) -> tuple:
+    start, end = read_field(frame, offset, MAX_ENVELOPE_STRING)
+    try:
+        return frame[start:end].decode('utf-8'), end
+    except UnicodeDecodeError:
+        raise ValueError("Envelope string is not UTF-8")
+
+
+def read_count(frame: bytes, offset: int, max_count: int) -> int:
+    if offset + LENGTH.size > len(frame):
+        raise ValueError("Envelope is truncated")
+    count, = LENGTH.unpack_from(frame, offset)
+    if count > max_count:
+        raise ValueError("Envelope lists too many items")
+    return count
+
+
+class ChatEnvelope():
+    """
+    A received binary chat, with the routing header read and the body left as it is.
+
+    For the server's relay code it looks like the validated JSON message:
+    data holds the chat's type and destination_servers, and raw the relay
+    fields (msg_id, hops, origin) that were set, and the base64 signature.
+    body() returns the encrypted fields and signed_data() rebuilds the JSON form.
+
+    Raises:
+        ValueError from parse() if the envelope is malformed.
+    """
+    type = "signed_data"
+    data_type = "chat"
+
+    def __init__(self, frame: bytes, counter: int, hops: int, msg_id: str, origin: str,
+                 destination_servers: list, signature: bytes, body_offset: int):
+        self.frame = frame
+        self.counter = counter
+        self.hops = hops
+        self.msg_id = msg_id
+        self.origin = origin
+        self.destination_servers = destination_servers
+        self.signature = signature
+        self.body_offset = body_offset
+        # (start, end) of the iv, each symm_key and the chat, set by parse()
+        self.fields = None
+
+        self.data = {"type": "chat", "destination_servers": destination_servers}
+        self.raw = {"hops": hops, "signature": base64.b64encode(signature).decode('ascii')}
+        if msg_id:
+            self.raw["msg_id"] = msg_id
+        if origin:
+            self.raw["origin"] = origin
+
+    @classmethod
+    def parse(cls, frame: bytes) -> "ChatEnvelope":
+        """
+        Reads the header and checks that the body is well formed.
+        """
+        if len(frame) < PREFIX.size:
+            raise ValueError("Envelope is truncated")
+        magic, counter, hops = PREFIX.unpack_from(frame)
+        if magic != ENVELOPE_MAGIC:
+            raise ValueError("Not a chat envelope")
+
+        msg_id, offset = read_string(frame, PREFIX.size)
+        origin, offset = read_string(frame, offset)
+        count = read_count(frame, offset, MAX_ENVELOPE_DESTINATIONS)
+        offset += LENGTH.size
+        destination_servers = []
+        for _ in range(count):
+            server, offset = read_string(frame, offset)
+            destination_servers.append(server)
+        start, offset = read_field(frame, offset, MAX_ENVELOPE_SIGNATURE)
+
+        envelope = cls(frame, counter, hops, msg_id, origin, destination_servers, frame[start:offset], offset)
+        envelope.fields = envelope.read_body()
+        return envelope
+
+    def read_body(self) -> tuple:
+        frame = self.frame
+        iv = read_field(frame, self.body_offset, MAX_ENVELOPE_IV)
+        offset = iv[1]
+        count = read_count(frame, offset, MAX_ENVELOPE_SYMM_KEYS)
+        offset += LENGTH.size
+        symm_keys = []
+        for _ in range(count):
+            symm_key = read_field(frame, offset, MAX_ENVELOPE_SYMM_KEY)
+            symm_keys.append(symm_key)
+            offset = symm_key[1]
+        chat = read_field(frame, offset, MAX_ENVELOPE_CHAT, CHAT_LENGTH)
+        if chat[1] != len(frame):
+            raise ValueError("Trailing data after envelope")
+        return iv, symm_keys, chat
+
+    def body(self) -> tuple:
+        """
+        Returns the iv, symm_keys and chat (ciphertext and tag) as memoryviews of the frame.
+        """
+        view = memoryview(self.frame)
+        iv, symm_keys, chat = self.fields
+        return view[iv[0]:iv[1]], [view[start:end] for start, end in symm_keys], view[chat[0]:chat[1]]
+
+    def signed_data(self) -> dict:
+        """
+        Returns the chat as the JSON signed_data message it was signed as, without relay fields.
+        """
+        iv, symm_keys, chat = self.body()
+        data = {
+            "type": "chat",
+            "destination_servers": self.destination_servers,
+            "iv": base64.b64encode(iv).decode('ascii'),
+            "symm_keys": [base64.b64encode(symm_key).decode('ascii') for symm_key in symm_keys],
+            "chat": base64.b64encode(chat).decode('ascii'),
+        }
+        return {"type": "signed_data", "data": data, "counter": self.counter, "signature": self.raw["signature"]}
+
+    def relayed(self, msg_id: str, hops: int, origin: str | None) -> bytes:
+        """
+        Returns the envelope with new relay fields. The body is copied as it is.
+        """
+        header = pack_header(self.counter, hops, msg_id, origin, self.destination_servers, self.signature)
+        return header + memoryview(self.frame)[self.body_offset:]
+
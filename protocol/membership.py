@@ -0,0 +1,21 @@
+import base64
+import hashlib
+import json
+
+# Longest digest accepted in a hello
+MAX_DIGEST_LENGTH = 64
+
+
+def membership_digest(locations: dict) -> str:
+    """
+    Digest of the clients in a client list and the server each one is on,
+    given as { fingerprint : server address }. The same whatever their order.
+
+    Servers add it to client lists and clients send the digest of the list
+    they hold when they reconnect, so a server can tell that a client's view
+    is current without sending the list again. A client that moved to another
+    server changes the digest, as chats to it have to go there.
+    """
+    pairs = json.dumps(sorted(locations.items()), separators=(',', ':'))
+    digest = hashlib.sha256(pairs.encode('utf-8')).digest()
+    return base64.b64encode(digest).decode('ascii')
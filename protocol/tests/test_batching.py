@@ -0,0 +1,75 @@
+import asyncio
+import json
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from protocol.batching import BatchSettings, FrameBatcher, batch_frame, unpack_batch
+from protocol.envelope import ENVELOPE_MAGIC
+
+
+class Websocket():
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, frame):
+        self.sent.append(frame)
+
+
+class TestBatchFrames(unittest.TestCase):
+
+    def test_batch_frame_round_trip(self):
+        frames = ['{"type":"a"}', '{"type":"b","n":1}']
+        message = json.loads(batch_frame(frames))
+        self.assertEqual(unpack_batch(message), [{"type": "a"}, {"type": "b", "n": 1}])
+        self.assertEqual(json.loads(batch_frame([frame.encode() for frame in frames])), message)
+
+    def test_malformed_batch(self):
+        self.assertIsNone(unpack_batch({"type": "batch", "messages": "x"}))
+        self.assertIsNone(unpack_batch({"type": "batch", "messages": [1]}))
+
+
+class TestFrameBatcher(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.websocket = Websocket()
+        self.flushed = []
+        settings = BatchSettings(enabled=True, window=0.01, max_bytes=100, max_messages=3)
+        self.batcher = FrameBatcher(self.websocket, settings, self.flushed.append)
+
+    async def test_messages_within_window_share_a_frame(self):
+        await self.batcher.send('{"n":1}')
+        await self.batcher.send('{"n":2}')
+        self.assertEqual(self.websocket.sent, [])
+
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.websocket.sent, ['{"type":"batch","messages":[{"n":1},{"n":2}]}'])
+        self.assertEqual(self.flushed, [2])
+
+    async def test_single_message_is_sent_as_is(self):
+        await self.batcher.send('{"n":1}')
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.websocket.sent, ['{"n":1}'])
+
+    async def test_full_batch_is_sent_at_once(self):
+        for n in range(3):
+            await self.batcher.send('{"n":%d}' % n)
+        self.assertEqual(len(self.websocket.sent), 1)
+        self.assertIsNone(self.batcher.timer)
+
+    async def test_large_message_keeps_order(self):
+        large = '{"n":"%s"}' % ("x" * 200)
+        await self.batcher.send('{"n":1}')
+        await self.batcher.send(large)
+        self.assertEqual(self.websocket.sent, ['{"n":1}', large])
+
+    async def test_binary_envelope_is_sent_alone(self):
+        envelope = ENVELOPE_MAGIC + b"chat"
+        await self.batcher.send(b'{"n":1}')
+        await self.batcher.send(envelope)
+        self.assertEqual(self.websocket.sent, [b'{"n":1}', envelope])
+
+
+if __name__ == '__main__':
+    unittest.main()
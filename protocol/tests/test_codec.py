@@ -0,0 +1,77 @@
+import json
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from protocol.codec import Codec, OrjsonCodec, DecodeError, create_codec, orjson
+
+SAMPLES = [
+    {"type": "public_chat", "sender": "QMot+zP/N7262OwsiV+LHwnbNozYJpO3HzUAYww/DBg=", "message": "hello"},
+    {"type": "hello", "public_key": "-----BEGIN PUBLIC KEY-----\nMIIB\n-----END PUBLIC KEY-----\n"},
+    {"b": [1, 2, {"z": None, "a": True}], "a": "café   \x7f \x1f </script>"},
+    {"big": 2 ** 70, "nested": {"list": ["😀"]}},
+    {"floats": [1e16, 1e-7, 0.1, 1.2345678901234568e17, -2.5], "nested": {"f": 1e22}},
+]
+
+
+def reference_canonical(obj) -> bytes:
+    return json.dumps(obj, separators=(',', ':'), sort_keys=True).encode('utf-8')
+
+
+class CodecTests():
+    codec_class = Codec
+
+    def setUp(self):
+        self.codec = self.codec_class()
+
+    def test_canonical_matches_reference(self):
+        for sample in SAMPLES:
+            self.assertEqual(self.codec.canonical(sample), reference_canonical(sample))
+
+    def test_signing_payload_matches_reference(self):
+        for sample in SAMPLES:
+            payload = self.codec.signing_payload(self.codec.canonical(sample), 7)
+            self.assertEqual(payload, reference_canonical({"data": sample, "counter": 7}))
+
+    def test_signed_frame_round_trip(self):
+        sample = SAMPLES[0]
+        frame = self.codec.signed_frame(self.codec.canonical(sample), 3, "c2ln")
+        self.assertEqual(json.loads(frame), {"type": "signed_data", "data": sample, "counter": 3, "signature": "c2ln"})
+
+    def test_encode_decode_round_trip(self):
+        for sample in SAMPLES[:3] + SAMPLES[4:]:
+            frame = self.codec.encode(sample)
+            self.assertIsInstance(frame, str)
+            self.assertEqual(self.codec.decode(frame), sample)
+            self.assertEqual(self.codec.decode(self.codec.encode_bytes(sample)), sample)
+
+    def test_binary_frames(self):
+        codec = self.codec_class(binary_frames=True)
+        self.assertIsInstance(codec.encode(SAMPLES[0]), bytes)
+        self.assertIsInstance(codec.signed_frame(b'{}', 1, "c2ln"), bytes)
+
+    def test_decode_error(self):
+        with self.assertRaises(DecodeError):
+            self.codec.decode("not json")
+
+
+class TestStdlibCodec(CodecTests, unittest.TestCase):
+    codec_class = Codec
+
+
+@unittest.skipIf(orjson is None, "orjson is not installed")
+class TestOrjsonCodec(CodecTests, unittest.TestCase):
+    codec_class = OrjsonCodec
+
+
+class TestCreateCodec(unittest.TestCase):
+
+    def test_stdlib_backend(self):
+        codec = create_codec("json", binary_frames=False)
+        self.assertEqual(codec.name, "json")
+        self.assertFalse(codec.binary_frames)
+
+
+if __name__ == '__main__':
+    unittest.main()
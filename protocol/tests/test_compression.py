@@ -0,0 +1,90 @@
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from websockets.frames import Frame, OP_TEXT, OP_CONT, OP_PING
+from protocol.compression import (
+    CompressionSettings,
+    ThresholdPerMessageDeflate,
+    choose_encoding,
+    compress_body,
+    decompress_body,
+    is_compressible,
+)
+from websockets.extensions.permessage_deflate import PerMessageDeflate
+
+
+class TestThresholdPerMessageDeflate(unittest.TestCase):
+
+    def setUp(self):
+        self.sender = ThresholdPerMessageDeflate(False, False, 12, 12, {"memLevel": 5}, min_size=64)
+        self.receiver = PerMessageDeflate(False, False, 12, 12)
+
+    def roundtrip(self, frame: Frame) -> tuple:
+        encoded = self.sender.encode(frame)
+        return encoded, self.receiver.decode(encoded)
+
+    def test_small_messages_are_not_compressed(self):
+        encoded, decoded = self.roundtrip(Frame(OP_TEXT, b"hi"))
+        self.assertFalse(encoded.rsv1)
+        self.assertEqual(decoded.data, b"hi")
+
+    def test_large_messages_are_compressed(self):
+        data = b'{"type":"client_list","clients":["' + b"MIIBIjANBgkqhkiG9w0BAQEFAAOC" * 20 + b'"]}'
+        for _ in range(2):
+            encoded, decoded = self.roundtrip(Frame(OP_TEXT, data))
+            self.assertTrue(encoded.rsv1)
+            self.assertLess(len(encoded.data), len(data) // 4)
+            self.assertEqual(decoded.data, data)
+
+    def test_continuation_follows_first_frame(self):
+        encoded, _ = self.roundtrip(Frame(OP_TEXT, b"x", fin=False))
+        self.assertFalse(encoded.rsv1)
+        encoded = self.sender.encode(Frame(OP_CONT, b"y" * 200))
+        self.assertEqual(encoded.data, b"y" * 200)
+
+    def test_control_frames_untouched(self):
+        frame = Frame(OP_PING, b"x" * 200)
+        self.assertIs(self.sender.encode(frame), frame)
+
+
+class TestCompressionSettings(unittest.TestCase):
+
+    def test_disabled(self):
+        settings = CompressionSettings(enabled=False)
+        self.assertEqual(settings.server_extensions(), [])
+        self.assertEqual(settings.client_extensions(), [])
+
+    def test_extensions(self):
+        settings = CompressionSettings(window_bits=10, min_size=32)
+        [server] = settings.server_extensions()
+        [client] = settings.client_extensions()
+        self.assertEqual((server.server_max_window_bits, server.min_size), (10, 32))
+        self.assertEqual(client.client_max_window_bits, 10)
+
+    def test_invalid_window_bits(self):
+        with self.assertRaises(ValueError):
+            CompressionSettings(window_bits=16)
+
+
+class TestHttpEncoding(unittest.TestCase):
+
+    def test_choose_encoding(self):
+        self.assertEqual(choose_encoding("gzip, deflate, br"), "gzip")
+        self.assertIsNone(choose_encoding("gzip;q=0, identity"))
+        self.assertIsNone(choose_encoding(""))
+
+    def test_is_compressible(self):
+        self.assertTrue(is_compressible("notes.txt"))
+        self.assertTrue(is_compressible("data.json"))
+        self.assertFalse(is_compressible("photo.jpg"))
+        self.assertFalse(is_compressible("archive.tar.gz"))
+
+    def test_gzip_roundtrip(self):
+        data = b"abc" * 100
+        self.assertEqual(decompress_body(compress_body(data, "gzip"), "gzip"), data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import base64
+import json
+import os
+import struct
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from protocol.envelope import ChatEnvelope, encode_chat_envelope, is_envelope, MAX_ENVELOPE_DESTINATIONS
+
+
+def b64(data: bytes) -> str:
+    return base64.b64encode(data).decode('ascii')
+
+
+DATA = {
+    "type": "chat",
+    "destination_servers": ["127.0.0.1:9000", "127.0.0.1:9001"],
+    "iv": b64(b"\x01" * 12),
+    "symm_keys": [b64(b"\x02" * 256), b64(b"\x03" * 64)],
+    "chat": b64(b"ciphertext and tag"),
+}
+SIGNATURE = b"\x04" * 256
+
+
+class TestChatEnvelope(unittest.TestCase):
+
+    def test_round_trip(self):
+        envelope = ChatEnvelope.parse(encode_chat_envelope(DATA, 7, SIGNATURE))
+        self.assertEqual(envelope.counter, 7)
+        self.assertEqual(envelope.signature, SIGNATURE)
+        self.assertEqual(envelope.data, {"type": "chat", "destination_servers": DATA["destination_servers"]})
+        self.assertEqual(envelope.signed_data(),
+                         {"type": "signed_data", "data": DATA, "counter": 7, "signature": b64(SIGNATURE)})
+
+    def test_body_is_raw(self):
+        iv, symm_keys, chat = ChatEnvelope.parse(encode_chat_envelope(DATA, 1, SIGNATURE)).body()
+        self.assertEqual(bytes(iv), b"\x01" * 12)
+        self.assertEqual([bytes(symm_key) for symm_key in symm_keys], [b"\x02" * 256, b"\x03" * 64])
+        self.assertEqual(bytes(chat), b"ciphertext and tag")
+
+    def test_smaller_than_json(self):
+        frame = encode_chat_envelope(DATA, 1, SIGNATURE)
+        json_size = len(json.dumps(ChatEnvelope.parse(frame).signed_data(), separators=(',', ':')))
+        self.assertLess(len(frame), json_size)
+
+    def test_relayed_keeps_body(self):
+        envelope = ChatEnvelope.parse(encode_chat_envelope(DATA, 3, SIGNATURE))
+        relayed = ChatEnvelope.parse(envelope.relayed("abc", 2, "127.0.0.1:9000"))
+        self.assertEqual(relayed.raw["msg_id"], "abc")
+        self.assertEqual(relayed.raw["hops"], 2)
+        self.assertEqual(relayed.raw["origin"], "127.0.0.1:9000")
+        self.assertEqual(relayed.signed_data(), envelope.signed_data())
+
+    def test_unset_relay_fields_are_left_out(self):
+        envelope = ChatEnvelope.parse(encode_chat_envelope(DATA, 3, SIGNATURE))
+        self.assertEqual(envelope.raw, {"hops": 0, "signature": b64(SIGNATURE)})
+
+    def test_is_envelope(self):
+        self.assertTrue(is_envelope(encode_chat_envelope(DATA, 1, SIGNATURE)))
+        self.assertFalse(is_envelope(b'{"type":"signed_data"}'))
+        self.assertFalse(is_envelope('{"type":"signed_data"}'))
+
+    def test_malformed(self):
+        frame = encode_chat_envelope(DATA, 1, SIGNATURE)
+        for malformed in (frame[:-1], frame + b"\x00", frame[:10], b"{" + frame[1:]):
+            with self.assertRaises(ValueError):
+                ChatEnvelope.parse(malformed)
+
+    def test_too_many_destinations(self):
+        data = dict(DATA, destination_servers=["a"] * (MAX_ENVELOPE_DESTINATIONS + 1))
+        with self.assertRaises(ValueError):
+            ChatEnvelope.parse(encode_chat_envelope(data, 1, SIGNATURE))
+
+    def test_oversized_field(self):
+        frame = bytearray(encode_chat_envelope(DATA, 1, b""))
+        # Claim a signature far larger than allowed: it follows the prefix,
+        # empty msg_id and origin and the two destination servers
+        struct.pack_into(">H", frame, 13 + 2 + 2 + 2 + 2 * (2 + 14), 60000)
+        with self.assertRaises(ValueError):
+            ChatEnvelope.parse(bytes(frame))
+
+
+if __name__ == '__main__':
+    unittest.main()
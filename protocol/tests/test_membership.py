@@ -0,0 +1,24 @@
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from protocol.membership import membership_digest, MAX_DIGEST_LENGTH
+
+
+class TestMembershipDigest(unittest.TestCase):
+
+    def test_order_does_not_matter(self):
+        self.assertEqual(membership_digest({"a": "s1:80", "b": "s2:80"}), membership_digest({"b": "s2:80", "a": "s1:80"}))
+        self.assertLessEqual(len(membership_digest({"a": "s1:80"})), MAX_DIGEST_LENGTH)
+
+    def test_client_moving_server_changes_digest(self):
+        self.assertNotEqual(membership_digest({"a": "s1:80", "b": "s2:80"}), membership_digest({"a": "s2:80", "b": "s2:80"}))
+
+    def test_clients_change_digest(self):
+        self.assertNotEqual(membership_digest({"a": "s1:80"}), membership_digest({"a": "s1:80", "b": "s1:80"}))
+        self.assertNotEqual(membership_digest({}), membership_digest({"a": "s1:80"}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,225 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from cryptography.hazmat.primitives import serialization
+
+from security.security_module import Encryption
+
+EXECUTOR_THREAD = "thread"
+EXECUTOR_PROCESS = "process"
+# Runs operations on the event loop, as before this module existed
+EXECUTOR_INLINE = "inline"
+EXECUTORS = (EXECUTOR_THREAD, EXECUTOR_PROCESS, EXECUTOR_INLINE)
+
+# Most operations run by one executor task
+DEFAULT_BATCH_SIZE = 32
+
+# Operations whose key argument is a private key. The key is always the last argument.
+PRIVATE_KEY_OPERATIONS = frozenset({"sign", "unwrap_key", "unwrap_any"})
+
+# Keys serialized for process workers, per key object
+MAX_SERIALIZED_KEYS = 256
+
+# Executors shared by every AsyncEncryption in the process, by (kind, workers)
+executors = {}
+
+worker_encryption = Encryption()
+
+
+def get_executor(kind: str, workers: int):
+    executor = executors.get((kind, workers))
+    if executor is None:
+        if kind == EXECUTOR_PROCESS:
+            executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="olaf-crypto")
+        executors[(kind, workers)] = executor
+    return executor
+
+
+@functools.lru_cache(maxsize=MAX_SERIALIZED_KEYS)
+def load_serialized_key(der: bytes, private: bool):
+    if private:
+        return serialization.load_der_private_key(der, password=None)
+    return serialization.load_der_public_key(der)
+
+
+def unwrap_any(wrapped_keys: list, private_key) -> tuple:
+    """
+    Returns the index and value of the first of wrapped_keys that private_key unwraps.
+
+    Raises:
+        ValueError if none of them was wrapped for private_key.
+    """
+    for index, wrapped_key in enumerate(wrapped_keys):
+        try:
+            return index, worker_encryption.unwrap_key(wrapped_key, private_key)
+        except ValueError:
+            continue
+    raise ValueError("No key was wrapped for this private key")
+
+
+OPERATIONS = {
+    "sign": worker_encryption.sign_message_with_key,
+    "verify": worker_encryption.verify_signature,
+    "wrap_key": worker_encryption.wrap_key,
+    "unwrap_key": worker_encryption.unwrap_key,
+    "unwrap_any": unwrap_any,
+}
+
+
+def run_operations(operations: list) -> list:
+    """
+    Runs a batch of (operation, args) in a worker, returning (True, result) or
+    (False, exception) for each. Keys passed as DER bytes are loaded first.
+    """
+    results = []
+    for operation, args in operations:
+        try:
+            key = args[-1]
+            if isinstance(key, bytes):
+                args = args[:-1] + (load_serialized_key(key, operation in PRIVATE_KEY_OPERATIONS),)
+            results.append((True, OPERATIONS[operation](*args)))
+        except Exception as e:
+            results.append((False, e))
+    return results
+
+
+class AsyncEncryption():
+    """
+    Awaitable signing, verification and key wrapping that keeps the event
+    loop free while the public key operations run.
+
+    Operations requested in the same event loop iteration are run together,
+    up to batch_size per executor task, on a thread pool shared by the
+    process, or on a process pool if the cryptography backend holds the GIL.
+    Keys are sent to worker processes as DER and loaded once per process.
+
+    Every method queues its operation when called and returns a future, so
+    operations start in the order they were requested. Must be called from
+    the event loop.
+    """
+    def __init__(self, executor: str = EXECUTOR_THREAD, workers: int | None = None, batch_size: int = DEFAULT_BATCH_SIZE):
+        if executor not in EXECUTORS:
+            raise ValueError(f"Unknown crypto executor {executor!r}, expected one of {', '.join(EXECUTORS)}")
+        self.executor = executor
+        self.workers = workers or os.cpu_count() or 4
+        self.batch_size = max(1, batch_size)
+
+        # (operation, args, future) waiting for the next flush
+        self.pending = []
+        self.flush_handle = None
+        # {id(key): (key, der)}, the key is kept so its id is not reused
+        self.serialized = {}
+
+        self.operations = 0
+        self.tasks = 0
+
+    @classmethod
+    def from_env(cls) -> "AsyncEncryption":
+        """
+        Reads OLAF_CRYPTO_EXECUTOR (thread, process or inline), OLAF_CRYPTO_WORKERS
+        (default one per core) and OLAF_CRYPTO_BATCH_SIZE.
+        """
+        workers = os.getenv('OLAF_CRYPTO_WORKERS')
+        return cls(
+            executor=os.getenv('OLAF_CRYPTO_EXECUTOR', EXECUTOR_THREAD).lower(),
+            workers=int(workers) if workers else None,
+            batch_size=int(os.getenv('OLAF_CRYPTO_BATCH_SIZE', DEFAULT_BATCH_SIZE)),
+        )
+
+    def sign(self, message: bytes, private_key) -> asyncio.Future:
+        return self.submit("sign", message, private_key)
+
+    def verify(self, message: bytes, signature: bytes, public_key) -> asyncio.Future:
+        return self.submit("verify", message, signature, public_key)
+
+    def wrap_key(self, key: bytes, public_key) -> asyncio.Future:
+        return self.submit("wrap_key", key, public_key)
+
+    def wrap_keys(self, key: bytes, public_keys: list) -> asyncio.Future:
+        """
+        Wraps key for each of public_keys, in one executor task if the batch size allows.
+        The future's result is the list of wrapped keys.
+        """
+        return asyncio.gather(*(self.submit("wrap_key", key, public_key) for public_key in public_keys))
+
+    def unwrap_key(self, wrapped_key: bytes, private_key) -> asyncio.Future:
+        return self.submit("unwrap_key", wrapped_key, private_key)
+
+    def unwrap_any(self, wrapped_keys: list, private_key) -> asyncio.Future:
+        """
+        Finds the one of wrapped_keys meant for private_key, trying them in one executor task.
+
+        The future's result is the index of the wrapped key and the unwrapped
+        key. It fails with ValueError if none of them was wrapped for private_key.
+        """
+        return self.submit("unwrap_any", list(wrapped_keys), private_key)
+
+    def submit(self, operation: str, *args) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.operations += 1
+
+        if self.executor == EXECUTOR_INLINE:
+            self.complete([future], run_operations([(operation, args)]))
+            return future
+
+        if self.executor == EXECUTOR_PROCESS:
+            args = args[:-1] + (self.serialize(args[-1], operation in PRIVATE_KEY_OPERATIONS),)
+        self.pending.append((operation, args, future))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_soon(self.flush)
+        return future
+
+    def flush(self) -> None:
+        """
+        Hands the pending operations to the executor.
+        """
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        loop = asyncio.get_running_loop()
+        executor = get_executor(self.executor, self.workers)
+        while self.pending:
+            batch, self.pending = self.pending[:self.batch_size], self.pending[self.batch_size:]
+            self.tasks += 1
+            task = loop.run_in_executor(executor, run_operations, [(operation, args) for operation, args, _ in batch])
+            task.add_done_callback(functools.partial(self.task_done, [future for _, _, future in batch]))
+
+    def task_done(self, futures: list, task: asyncio.Future) -> None:
+        try:
+            results = task.result()
+        except BaseException as e:
+            # e.g. a worker process died, or a result could not be pickled
+            results = [(False, e)] * len(futures)
+        self.complete(futures, results)
+
+    def complete(self, futures: list, results: list) -> None:
+        for future, (ok, result) in zip(futures, results):
+            if future.done():
+                # The caller stopped waiting
+                continue
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+
+    def serialize(self, key, private: bool) -> bytes:
+        entry = self.serialized.get(id(key))
+        if entry is not None and entry[0] is key:
+            return entry[1]
+        if private:
+            der = key.private_bytes(encoding=serialization.Encoding.DER, format=serialization.PrivateFormat.PKCS8,
+                                    encryption_algorithm=serialization.NoEncryption())
+        else:
+            der = key.public_bytes(encoding=serialization.Encoding.DER,
+                                   format=serialization.PublicFormat.SubjectPublicKeyInfo)
+        if len(self.serialized) >= MAX_SERIALIZED_KEYS:
+            self.serialized.clear()
+        self.serialized[id(key)] = (key, der)
+        return der
@@ -1,7 +1,10 @@
 from cryptography.hazmat.primitives import serialization, hashes
-from cryptography.hazmat.primitives.asymmetric import rsa, padding
+from cryptography.hazmat.primitives.asymmetric import rsa, padding, ed25519, x25519
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.backends import default_backend
+from cryptography.exceptions import InvalidSignature, InvalidTag
 import hashlib
 import base64
 import os
@@ -12,20 +15,164 @@ PUBLIC_EXPONENT = 65537
 IV_SIZE = 16
 KEY_LENGTH = 16
 
+# Algorithm suites, named by OLAF_KEY_SUITE
+SUITE_RSA = "rsa"
+SUITE_ED25519 = "ed25519"
+
+# X25519 wrapped key: ephemeral public key, then the AES-GCM encrypted key and tag
+X25519_KEY_SIZE = 32
+WRAP_INFO = b"OLAF key wrap"
+# Every wrapping key is used once, so a fixed nonce is safe
+WRAP_NONCE = bytes(12)
+# Field prime of Curve25519 and Ed25519
+CURVE_PRIME = 2 ** 255 - 19
+
+
+# RSA-2048 with PSS signatures and OAEP key wrapping, understood by every OLAF client
+class RsaSuite:
+    name = SUITE_RSA
+    key_types = (rsa.RSAPrivateKey, rsa.RSAPublicKey)
+
+    def generate_private_key(self, backend):
+        return rsa.generate_private_key(
+            public_exponent= PUBLIC_EXPONENT,
+            key_size= KEY_SIZE_RSA,
+            backend=backend
+        )
+
+    def sign(self, message, private_key):
+        return private_key.sign(
+            message,
+            padding.PSS(
+                mgf=padding.MGF1(hashes.SHA256()),
+                salt_length=padding.PSS.MAX_LENGTH
+            ),
+            hashes.SHA256()
+        )
+
+    def verify(self, signature, message, public_key):
+        public_key.verify(
+            signature,
+            message,
+            padding.PSS(
+                mgf=padding.MGF1(hashes.SHA256()),
+                salt_length=padding.PSS.MAX_LENGTH
+            ),
+            hashes.SHA256()
+        )
+
+    def wrap_key(self, key, public_key):
+        return public_key.encrypt(
+            key,
+            padding.OAEP(
+                mgf=padding.MGF1(algorithm=hashes.SHA256()),
+                algorithm=hashes.SHA256(),
+                label=None
+            )
+        )
+
+    def unwrap_key(self, wrapped_key, private_key):
+        return private_key.decrypt(
+            wrapped_key,
+            padding.OAEP(
+                mgf=padding.MGF1(algorithm=hashes.SHA256()),
+                algorithm=hashes.SHA256(),
+                label=None
+            )
+        )
+
+
+# Ed25519 signatures, and keys wrapped for X25519 with HKDF and AES-GCM.
+# The X25519 key pair is derived from the Ed25519 identity the same way as
+# libsodium's crypto_sign_ed25519_*_to_curve25519, so one public key serves both.
+class Ed25519Suite:
+    name = SUITE_ED25519
+    key_types = (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey)
+
+    def generate_private_key(self, backend):
+        return ed25519.Ed25519PrivateKey.generate()
+
+    def sign(self, message, private_key):
+        return private_key.sign(message)
+
+    def verify(self, signature, message, public_key):
+        public_key.verify(signature, message)
+
+    # X25519 private key of an Ed25519 private key: the clamped first half of SHA-512 of the seed
+    def exchange_private_key(self, private_key):
+        seed = private_key.private_bytes(
+            encoding=serialization.Encoding.Raw,
+            format=serialization.PrivateFormat.Raw,
+            encryption_algorithm=serialization.NoEncryption()
+        )
+        return x25519.X25519PrivateKey.from_private_bytes(hashlib.sha512(seed).digest()[:32])
+
+    # X25519 public key of an Ed25519 public key: u = (1 + y) / (1 - y)
+    def exchange_public_key(self, public_key):
+        raw = public_key.public_bytes(encoding=serialization.Encoding.Raw, format=serialization.PublicFormat.Raw)
+        y = int.from_bytes(raw, 'little') & ((1 << 255) - 1)
+        u = (1 + y) * pow(1 - y, -1, CURVE_PRIME) % CURVE_PRIME
+        return x25519.X25519PublicKey.from_public_bytes(u.to_bytes(X25519_KEY_SIZE, 'little'))
+
+    def wrapping_key(self, shared_secret, ephemeral_public, recipient_public):
+        return HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=ephemeral_public + recipient_public,
+            info=WRAP_INFO,
+        ).derive(shared_secret)
+
+    def wrap_key(self, key, public_key):
+        recipient = self.exchange_public_key(public_key)
+        ephemeral = x25519.X25519PrivateKey.generate()
+        ephemeral_public = ephemeral.public_key().public_bytes(encoding=serialization.Encoding.Raw,
+                                                               format=serialization.PublicFormat.Raw)
+        recipient_public = recipient.public_bytes(encoding=serialization.Encoding.Raw,
+                                                  format=serialization.PublicFormat.Raw)
+        wrapping_key = self.wrapping_key(ephemeral.exchange(recipient), ephemeral_public, recipient_public)
+        return ephemeral_public + AESGCM(wrapping_key).encrypt(WRAP_NONCE, key, None)
+
+    def unwrap_key(self, wrapped_key, private_key):
+        if len(wrapped_key) < X25519_KEY_SIZE + 16:
+            raise ValueError("Wrapped key is too short")
+        exchange_key = self.exchange_private_key(private_key)
+        ephemeral_public = wrapped_key[:X25519_KEY_SIZE]
+        recipient_public = exchange_key.public_key().public_bytes(encoding=serialization.Encoding.Raw,
+                                                                  format=serialization.PublicFormat.Raw)
+        try:
+            shared_secret = exchange_key.exchange(x25519.X25519PublicKey.from_public_bytes(ephemeral_public))
+            wrapping_key = self.wrapping_key(shared_secret, ephemeral_public, recipient_public)
+            return AESGCM(wrapping_key).decrypt(WRAP_NONCE, wrapped_key[X25519_KEY_SIZE:], None)
+        except InvalidTag:
+            raise ValueError("Key was not wrapped for this private key")
+
+
+SUITES = {suite.name: suite for suite in (RsaSuite(), Ed25519Suite())}
+
 
 # Make class Encryption with cryptographic functions
 class Encryption:
-    # define self
-    def __init__(self):
+    # define self, with the algorithm suite of newly generated identities
+    def __init__(self, suite=SUITE_RSA):
         self.backend = default_backend()
+        if suite not in SUITES:
+            raise ValueError(f"Unknown key suite {suite!r}, expected one of {', '.join(SUITES)}")
+        self.suite = SUITES[suite]
+
+    # generate private key
+    def generate_private_key(self):
+        return self.suite.generate_private_key(self.backend)
+
+    # algorithm suite of a private or public key, which the key's type identifies
+    def suite_of(self, key):
+        for suite in SUITES.values():
+            if isinstance(key, suite.key_types):
+                return suite
+        raise ValueError(f"Unsupported key type {type(key).__name__}")
 
     # generate private and public key
     def generate_rsa_key_pair(self):
-        private_key = rsa.generate_private_key(
-            public_exponent= PUBLIC_EXPONENT,
-            key_size= KEY_SIZE_RSA,
-            backend=self.backend
-        )
+        private_key = self.generate_private_key()
         public_key = private_key.public_key()
 
         # Export keys
@@ -54,11 +201,44 @@ class Encryption:
         public_key = serialization.load_pem_public_key(pem_public_key, backend=self.backend)
         return public_key
     
+    # export public key as DER, the compact binary form of the PEM
+    def export_public_key_der(self, public_key):
+        der_public_key = public_key.public_bytes(
+            encoding=serialization.Encoding.DER,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+        return der_public_key
+
+    #load public key from der
+    def load_der_public_key(self, der_public_key):
+        public_key = serialization.load_der_public_key(der_public_key, backend=self.backend)
+        return public_key
+
     #load private key from pem
     def load_private_key(self, pem_private_key):
         private_key = serialization.load_pem_private_key(pem_private_key, password=None, backend=self.backend)
         return private_key
 
+    # load a private key this program wrote itself, optionally passphrase encrypted.
+    # Skips the RSA consistency check, which costs about as much as generating a key.
+    def load_trusted_private_key(self, pem_private_key, passphrase=None):
+        private_key = serialization.load_pem_private_key(pem_private_key, password=passphrase, backend=self.backend,
+                                                         unsafe_skip_rsa_key_validation=True)
+        return private_key
+
+    # export private key as PKCS8 pem, encrypted if a passphrase is given
+    def export_private_key(self, private_key, passphrase=None):
+        if passphrase:
+            encryption_algorithm = serialization.BestAvailableEncryption(passphrase)
+        else:
+            encryption_algorithm = serialization.NoEncryption()
+        pem_private_key = private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=encryption_algorithm
+        )
+        return pem_private_key
+
     # Generate random AES key
     def generate_aes_key(self):
         return os.urandom(KEY_LENGTH)
@@ -121,17 +301,27 @@ class Encryption:
     def sign_message(self, message, private_key_pem):
         # load private key
         private_key = serialization.load_pem_private_key(private_key_pem, password=None, backend=self.backend)
+        return self.sign_message_with_key(message, private_key)
 
-        # Sign the message
-        signature = private_key.sign(
-            message,
-            padding.PSS(
-                mgf=padding.MGF1(hashes.SHA256()),
-                salt_length=padding.PSS.MAX_LENGTH
-            ),
-            hashes.SHA256()
-        )
-        return signature
+    # Sign messages with an already loaded private key
+    def sign_message_with_key(self, message, private_key):
+        return self.suite_of(private_key).sign(message, private_key)
+
+    # Check a signature made with the private key of public_key
+    def verify_signature(self, message, signature, public_key):
+        try:
+            self.suite_of(public_key).verify(signature, message, public_key)
+            return True
+        except InvalidSignature:
+            return False
+
+    # Encrypt a symmetric key for the owner of public_key, with RSA-OAEP or X25519 depending on the key
+    def wrap_key(self, key, public_key):
+        return self.suite_of(public_key).wrap_key(key, public_key)
+
+    # Decrypt a symmetric key wrapped for private_key. Raises ValueError if it was wrapped for another key
+    def unwrap_key(self, wrapped_key, private_key):
+        return self.suite_of(private_key).unwrap_key(wrapped_key, private_key)
     
     # Calculate fingerprint using public key
     def generate_fingerprint(self, public_key_pem):
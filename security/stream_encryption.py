@@ -0,0 +1,184 @@
+import asyncio
+import base64
+import os
+import struct
+from collections import deque
+from urllib.parse import urldefrag
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+# Encrypted stream layout:
+#   header: magic, chunk size (uint32) and base nonce
+#   chunks: AES-GCM ciphertext and tag of every chunk_size bytes of plaintext,
+#           the last chunk shorter, or empty for an empty payload
+# Every chunk's nonce is the base nonce with the chunk index XORed into its last
+# 8 bytes, as in TLS 1.3. The associated data is the header, the chunk index and
+# whether the chunk is the last one, so chunks cannot be reordered, dropped or
+# cut off at a chunk boundary without failing authentication.
+STREAM_MAGIC = b"OLAFS1"
+HEADER = struct.Struct(">6sI12s")
+CHUNK_INFO = struct.Struct(">QB")
+NONCE_SIZE = 12
+TAG_SIZE = 16
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 16 * 1024 * 1024
+
+# Parameter in the fragment of a shared file URL carrying the file key. The
+# fragment is never sent to the server.
+FILE_KEY_PARAMETER = "olaf-key"
+
+
+def chunk_nonce(base_nonce: bytes, index: int) -> bytes:
+    return base_nonce[:4] + (int.from_bytes(base_nonce[4:], 'big') ^ index).to_bytes(8, 'big')
+
+
+def encrypted_size(size: int, chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    """
+    Returns the size of the encrypted stream of a payload of size bytes.
+    """
+    chunks = max(1, -(-size // chunk_size))
+    return HEADER.size + size + chunks * TAG_SIZE
+
+
+class ChunkEncryptor():
+    """
+    Encrypts a payload chunk by chunk, each chunk authenticated on its own.
+
+    Chunks may be encrypted in any order and on any thread. Every chunk but
+    the last must be exactly chunk_size bytes; data may be any bytes-like
+    object, e.g. a memoryview of a read buffer, and is not copied.
+    """
+    def __init__(self, key: bytes, chunk_size: int = DEFAULT_CHUNK_SIZE, base_nonce: bytes | None = None):
+        if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+            raise ValueError(f"chunk_size must be between 1 and {MAX_CHUNK_SIZE}")
+        self.aead = AESGCM(key)
+        self.chunk_size = chunk_size
+        self.base_nonce = base_nonce or os.urandom(NONCE_SIZE)
+        self.header = HEADER.pack(STREAM_MAGIC, chunk_size, self.base_nonce)
+
+    def encrypt_chunk(self, index: int, data, final: bool) -> bytes:
+        if len(data) > self.chunk_size or (not final and len(data) != self.chunk_size):
+            raise ValueError("Only the last chunk may be shorter than the chunk size")
+        return self.aead.encrypt(chunk_nonce(self.base_nonce, index), data,
+                                 self.header + CHUNK_INFO.pack(index, final))
+
+
+class ChunkDecryptor():
+    """
+    Decrypts an encrypted stream fed to it in pieces of any size.
+
+    feed() returns the plaintext of every chunk it completed, holding back
+    the last one until more data or finish() shows whether it is the final
+    chunk. The header is read from the start of the stream.
+
+    Raises:
+        ValueError if the stream is malformed, truncated or was tampered with.
+    """
+    def __init__(self, key: bytes):
+        self.aead = AESGCM(key)
+        self.header = None
+        self.chunk_size = None
+        self.base_nonce = None
+        self.buffer = bytearray()
+        self.index = 0
+        self.finished = False
+
+    def read_header(self) -> None:
+        magic, chunk_size, base_nonce = HEADER.unpack_from(self.buffer)
+        if magic != STREAM_MAGIC or not 0 < chunk_size <= MAX_CHUNK_SIZE:
+            raise ValueError("Not an encrypted stream")
+        self.header = bytes(self.buffer[:HEADER.size])
+        self.chunk_size, self.base_nonce = chunk_size, base_nonce
+        del self.buffer[:HEADER.size]
+
+    def decrypt_chunk(self, size: int, final: bool) -> bytes:
+        with memoryview(self.buffer) as view:
+            try:
+                plaintext = self.aead.decrypt(chunk_nonce(self.base_nonce, self.index), view[:size],
+                                              self.header + CHUNK_INFO.pack(self.index, final))
+            except InvalidTag:
+                raise ValueError(f"Chunk {self.index} failed authentication")
+        del self.buffer[:size]
+        self.index += 1
+        return plaintext
+
+    def feed(self, data) -> list:
+        if self.finished:
+            raise ValueError("Data after the final chunk")
+        self.buffer += data
+        if self.header is None:
+            if len(self.buffer) < HEADER.size:
+                return []
+            self.read_header()
+
+        plaintexts = []
+        encrypted_chunk_size = self.chunk_size + TAG_SIZE
+        # A full chunk is only known not to be the last once more data follows it
+        while len(self.buffer) > encrypted_chunk_size:
+            plaintexts.append(self.decrypt_chunk(encrypted_chunk_size, False))
+        return plaintexts
+
+    def finish(self) -> bytes:
+        """
+        Decrypts the final chunk once the whole stream was fed.
+        """
+        if self.header is None or len(self.buffer) < TAG_SIZE:
+            raise ValueError("Encrypted stream is truncated")
+        self.finished = True
+        return self.decrypt_chunk(len(self.buffer), True)
+
+
+async def encrypt_file(path: str, key: bytes, chunk_size: int = DEFAULT_CHUNK_SIZE, parallel: int = 1, executor=None):
+    """
+    Yields the encrypted stream of a file: its header, then each encrypted chunk.
+
+    The file is read into a fresh buffer per chunk and encrypted from a view
+    of it, both on executor threads. With parallel above 1, up to that many
+    chunks are encrypted at the same time, and still yielded in order.
+    """
+    loop = asyncio.get_running_loop()
+    encryptor = ChunkEncryptor(key, chunk_size)
+    f = await loop.run_in_executor(executor, open, path, 'rb')
+    try:
+        yield encryptor.header
+        size = os.fstat(f.fileno()).st_size
+        chunks = max(1, -(-size // chunk_size))
+        pending = deque()
+        for index in range(chunks):
+            buffer = bytearray(chunk_size)
+            read = await loop.run_in_executor(executor, f.readinto, buffer)
+            final = index == chunks - 1
+            pending.append(loop.run_in_executor(executor, encryptor.encrypt_chunk, index,
+                                                memoryview(buffer)[:read], final))
+            if len(pending) >= parallel:
+                yield await pending.popleft()
+        while pending:
+            yield await pending.popleft()
+    finally:
+        f.close()
+
+
+def file_key_fragment(key: bytes) -> str:
+    """
+    Returns the URL fragment sharing the key of an encrypted file.
+    """
+    return f"{FILE_KEY_PARAMETER}={base64.urlsafe_b64encode(key).decode('ascii')}"
+
+
+def split_file_url(url: str) -> tuple:
+    """
+    Separates a shared file URL into the URL to fetch and the file key.
+
+    Returns:
+        The URL without its fragment and the key, or None if the file is not encrypted.
+
+    Raises:
+        ValueError if the fragment carries a key that is not valid base64.
+    """
+    url, fragment = urldefrag(url)
+    name, _, value = fragment.partition("=")
+    if name != FILE_KEY_PARAMETER:
+        return url, None
+    return url, base64.urlsafe_b64decode(value.encode('ascii'))
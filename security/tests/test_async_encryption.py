@@ -0,0 +1,61 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from security.security_module import Encryption, SUITE_RSA, SUITE_ED25519
+from security.async_encryption import AsyncEncryption, EXECUTORS
+
+
+class TestAsyncEncryption(unittest.IsolatedAsyncioTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.encryption = Encryption()
+        cls.keys = [Encryption(SUITE_RSA).generate_private_key(), Encryption(SUITE_ED25519).generate_private_key()]
+
+    async def test_operations_on_every_executor(self):
+        aes_key = self.encryption.generate_aes_key()
+        for executor in EXECUTORS:
+            crypto = AsyncEncryption(executor, workers=2)
+            for key in self.keys:
+                with self.subTest(executor=executor, key=type(key).__name__):
+                    signature = await crypto.sign(b"message", key)
+                    self.assertTrue(await crypto.verify(b"message", signature, key.public_key()))
+                    self.assertFalse(await crypto.verify(b"other", signature, key.public_key()))
+
+                    wrapped = await crypto.wrap_key(aes_key, key.public_key())
+                    self.assertEqual(await crypto.unwrap_key(wrapped, key), aes_key)
+
+    async def test_operations_share_executor_tasks(self):
+        crypto = AsyncEncryption(workers=2, batch_size=4)
+        signatures = await asyncio.gather(*(crypto.sign(b"%d" % n, self.keys[1]) for n in range(10)))
+        self.assertEqual(crypto.tasks, 3)
+        for n, signature in enumerate(signatures):
+            self.assertTrue(self.encryption.verify_signature(b"%d" % n, signature, self.keys[1].public_key()))
+
+    async def test_unwrap_any_finds_own_key(self):
+        crypto = AsyncEncryption(workers=2)
+        aes_key = self.encryption.generate_aes_key()
+        wrapped = await crypto.wrap_keys(aes_key, [self.keys[1].public_key(), self.keys[0].public_key()])
+        self.assertEqual(crypto.tasks, 1)
+        self.assertEqual(await crypto.unwrap_any(wrapped, self.keys[0]), (1, aes_key))
+        with self.assertRaises(ValueError):
+            await crypto.unwrap_any(wrapped[:1], self.keys[0])
+
+    async def test_errors_reach_their_caller_only(self):
+        crypto = AsyncEncryption(workers=2)
+        wrapped = self.encryption.wrap_key(b"k" * 16, self.keys[1].public_key())
+        good, bad = await asyncio.gather(crypto.unwrap_key(wrapped, self.keys[1]), crypto.unwrap_key(b"x" * 64, self.keys[1]),
+                                         return_exceptions=True)
+        self.assertEqual(good, b"k" * 16)
+        self.assertIsInstance(bad, ValueError)
+
+    def test_unknown_executor(self):
+        with self.assertRaises(ValueError):
+            AsyncEncryption("gpu")
+
+
+if __name__ == '__main__':
+    unittest.main()
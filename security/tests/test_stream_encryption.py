@@ -0,0 +1,82 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from security.stream_encryption import (ChunkDecryptor, ChunkEncryptor, HEADER, TAG_SIZE, encrypt_file,
+                                        encrypted_size, file_key_fragment, split_file_url)
+
+
+def encrypt(key, payload, chunk_size):
+    encryptor = ChunkEncryptor(key, chunk_size)
+    chunks = [payload[start:start + chunk_size] for start in range(0, len(payload), chunk_size)] or [b""]
+    return encryptor.header + b"".join(encryptor.encrypt_chunk(index, chunk, index == len(chunks) - 1)
+                                       for index, chunk in enumerate(chunks))
+
+
+def decrypt(key, stream, piece_size):
+    decryptor = ChunkDecryptor(key)
+    plaintext = b""
+    for start in range(0, len(stream), piece_size):
+        plaintext += b"".join(decryptor.feed(stream[start:start + piece_size]))
+    return plaintext + decryptor.finish()
+
+
+class TestChunkedStream(unittest.TestCase):
+
+    def setUp(self):
+        self.key = os.urandom(16)
+
+    def test_round_trip(self):
+        for size in (0, 1, 99, 100, 101, 1000):
+            payload = os.urandom(size)
+            stream = encrypt(self.key, payload, 100)
+            self.assertEqual(len(stream), encrypted_size(size, 100))
+            for piece_size in (1, 7, 116, 5000):
+                self.assertEqual(decrypt(self.key, stream, piece_size), payload)
+
+    def test_tampering_is_detected(self):
+        stream = bytearray(encrypt(self.key, os.urandom(300), 100))
+        stream[HEADER.size + 150] ^= 1
+        with self.assertRaises(ValueError):
+            decrypt(self.key, bytes(stream), 64)
+
+    def test_truncation_at_chunk_boundary_is_detected(self):
+        stream = encrypt(self.key, os.urandom(300), 100)
+        with self.assertRaises(ValueError):
+            decrypt(self.key, stream[:HEADER.size + 2 * (100 + TAG_SIZE)], 64)
+
+    def test_reordered_chunks_are_detected(self):
+        stream = encrypt(self.key, os.urandom(300), 100)
+        first = HEADER.size
+        second = first + 100 + TAG_SIZE
+        reordered = stream[:first] + stream[second:second + 116] + stream[first:second] + stream[second + 116:]
+        with self.assertRaises(ValueError):
+            decrypt(self.key, reordered, 64)
+
+    def test_wrong_key(self):
+        with self.assertRaises(ValueError):
+            decrypt(os.urandom(16), encrypt(self.key, b"payload", 100), 64)
+
+    def test_file_key_in_url_fragment(self):
+        url = f"http://server:8000/files/a.txt#{file_key_fragment(self.key)}"
+        self.assertEqual(split_file_url(url), ("http://server:8000/files/a.txt", self.key))
+        self.assertEqual(split_file_url("http://server:8000/files/a.txt"), ("http://server:8000/files/a.txt", None))
+
+
+class TestEncryptFile(unittest.IsolatedAsyncioTestCase):
+
+    async def test_parallel_encryption_keeps_order(self):
+        key = os.urandom(16)
+        payload = os.urandom(10 * 1000 + 5)
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(payload)
+            f.flush()
+            for parallel in (1, 4):
+                stream = b"".join([chunk async for chunk in encrypt_file(f.name, key, 1000, parallel)])
+                self.assertEqual(decrypt(key, stream, 333), payload)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from security.security_module import Encryption, SUITE_RSA, SUITE_ED25519
+
+
+class TestAlgorithmSuites(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.encryptions = {suite: Encryption(suite) for suite in (SUITE_RSA, SUITE_ED25519)}
+        cls.keys = {suite: [encryption.generate_private_key() for _ in range(2)]
+                    for suite, encryption in cls.encryptions.items()}
+
+    def test_suite_is_read_from_the_public_key(self):
+        encryption = Encryption()
+        for suite, keys in self.keys.items():
+            pem = encryption.export_public_key(keys[0].public_key())
+            self.assertEqual(encryption.suite_of(encryption.load_public_key(pem)).name, suite)
+
+    def test_sign_and_verify(self):
+        encryption = Encryption()
+        for keys in self.keys.values():
+            signature = encryption.sign_message_with_key(b"message", keys[0])
+            self.assertTrue(encryption.verify_signature(b"message", signature, keys[0].public_key()))
+            self.assertFalse(encryption.verify_signature(b"other", signature, keys[0].public_key()))
+            self.assertFalse(encryption.verify_signature(b"message", signature, keys[1].public_key()))
+
+    def test_wrap_and_unwrap(self):
+        encryption = Encryption()
+        aes_key = encryption.generate_aes_key()
+        for keys in self.keys.values():
+            wrapped = encryption.wrap_key(aes_key, keys[0].public_key())
+            self.assertEqual(encryption.unwrap_key(wrapped, keys[0]), aes_key)
+            self.assertNotEqual(encryption.wrap_key(aes_key, keys[0].public_key()), wrapped)
+
+    def test_unwrap_for_another_key_raises_value_error(self):
+        encryption = Encryption()
+        aes_key = encryption.generate_aes_key()
+        for wrap_keys in self.keys.values():
+            wrapped = encryption.wrap_key(aes_key, wrap_keys[0].public_key())
+            for unwrap_keys in self.keys.values():
+                with self.assertRaises(ValueError):
+                    encryption.unwrap_key(wrapped, unwrap_keys[1])
+
+    def test_stored_ed25519_key_round_trip(self):
+        encryption = self.encryptions[SUITE_ED25519]
+        pem = encryption.export_private_key(self.keys[SUITE_ED25519][0], b"passphrase")
+        private_key = encryption.load_trusted_private_key(pem, b"passphrase")
+        wrapped = encryption.wrap_key(b"k" * 16, self.keys[SUITE_ED25519][0].public_key())
+        self.assertEqual(encryption.unwrap_key(wrapped, private_key), b"k" * 16)
+
+    def test_unknown_suite(self):
+        with self.assertRaises(ValueError):
+            Encryption("dsa")
+
+
+if __name__ == '__main__':
+    unittest.main()
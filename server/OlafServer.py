@@ -1,9 +1,7 @@
 import asyncio
 import websockets
-import json
 import os
 import sys
-import time
 import logging
 import base64
 from aiohttp import web
@@ -12,24 +10,80 @@ from websockets.asyncio.server import serve, ServerConnection
 # Modify sys.path in the script to recognise packages in root dir.
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from security.security_module import Encryption
+from security.async_encryption import AsyncEncryption
+from protocol.codec import codec, DecodeError
+from protocol.compression import CompressionSettings, choose_encoding
+from protocol.membership import membership_digest, MAX_DIGEST_LENGTH
+from protocol.batching import BatchSettings, FrameBatcher, BATCH_TYPE
+from protocol.envelope import ChatEnvelope, is_envelope
+from protocol.capabilities import (CAP_BATCH, CAP_LIST_DIGEST, CAP_KEY_REQUEST, CAP_RELAY_IDS, CAP_LINK_STATE,
+                                   CAP_BINARY_CHAT, CAP_GROUPS, CAP_LOAD_REPORT, CAP_REDIRECT, parse_capabilities,
+                                   capabilities_field)
+from message_schema import OlafMessage, validate_message, MAX_SERVER_ADDRESS_LENGTH
+from frame_limits import FrameLimits, message_type_of
+from rate_limit import RateLimiter
+from scheduler import FairScheduler
+from metrics import ServerMetrics, LoopLagMonitor
+from tracing import SlowOperationTracer
+from file_io import FileIO
+from file_cache import FileCache
+from key_directory import KeyDirectory, KeyFetcher, KEY_FORMAT_PEM, KEY_FORMAT_FINGERPRINT, KEY_FORMATS
+from relay_dedup import RelayDedup, message_id, message_hops
+from overlay import LinkStateDatabase
+from groups import GroupDirectory, valid_group_name
+from load_balancer import LoadBalancer
+
+DEFAULT_CLIENT_LIST_DELAY = 0.1
+
+# Envelope fields of relayed chats that stock servers are not sent
+RELAY_FIELDS = ("msg_id", "hops", "origin")
 
 # Required Directories
 UPLOAD_DIR = 'uploads/'
 KEYS_DIR = 'server_keys/'
+GROUPS_DIR = 'groups/'
 
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(KEYS_DIR, exist_ok=True)
+os.makedirs(GROUPS_DIR, exist_ok=True)
 
 class ConnectionHandler():
     websocket = None
     public_key = ""
     counter = 0
+    key_format = KEY_FORMAT_PEM
+    # Protocol extensions the peer advertised, none for stock OLAF peers
+    capabilities = frozenset()
+    # Set when the peer accepts batch frames
+    batcher = None
     async def send(self, message: dict) -> None:
         """
         Sends a message to the websocket
         """
-        data = json.dumps(message)
-        await self.websocket.send(data)
+        await self.send_frame(codec.encode(message))
+
+    async def send_frame(self, frame: str | bytes) -> None:
+        """
+        Sends an already encoded message to the websocket, batched with others if the peer accepts batches
+        """
+        if self.batcher is not None:
+            await self.batcher.send(frame)
+        else:
+            await self.websocket.send(frame)
+
+    async def try_send_frame(self, frame: str | bytes) -> bool:
+        """
+        Sends an already encoded message, returning False if the connection has closed.
+        """
+        try:
+            await self.send_frame(frame)
+            return True
+        except websockets.ConnectionClosed:
+            return False
+
+    def enable_batching(self, settings: BatchSettings, on_flush=None) -> None:
+        if self.batcher is None:
+            self.batcher = FrameBatcher(self.websocket, settings, on_flush)
     
 
 class OlafServerConnection(ConnectionHandler):
@@ -39,9 +93,16 @@ class OlafServerConnection(ConnectionHandler):
         self.public_key = public_key
 
 class OlafClientConnection(ConnectionHandler):
-    def __init__(self, websocket: ServerConnection, public_key: str):
+    def __init__(self, websocket: ServerConnection, public_key: str, key_format: str = KEY_FORMAT_PEM):
         self.websocket = websocket
         self.public_key = public_key
+        self.key_format = key_format
+        # Fingerprint of public_key, None if the key cannot be parsed
+        self.fingerprint = None
+        # Fingerprints of the keys already sent to this client in compact client lists
+        self.sent_keys = set()
+        # Membership digest of the client list this client holds
+        self.list_digest = None
 
 class WebSocketServer():
     def __init__(self, bind_address: str, host: str, ws_port: int, http_port: int, neighbours_list: list):
@@ -55,8 +116,23 @@ class WebSocketServer():
         self.server_name = f"{self.host}:{self.port}"
         self.server = None
         self.http_port = http_port
+        # Host clients outside the server's network reach it at, e.g. outside docker
+        self.external_address = os.getenv('EXTERNAL_ADDRESS') or self.host
         self.counter = 0
         self.encryption = Encryption()
+        # Signs server_hello messages off the event loop
+        self.crypto = AsyncEncryption.from_env()
+        self.frame_limits = FrameLimits.from_env()
+        self.rate_limiter = RateLimiter.from_env()
+        self.compression = CompressionSettings.from_env()
+        self.relay_dedup = RelayDedup.from_env()
+        self.batching = BatchSettings.from_env()
+        self.batches_sent = 0
+        self.batched_messages = 0
+        # Chats are relayed as binary envelopes to peers that accept them
+        self.binary_chat = os.getenv('BINARY_CHAT', 'on').lower() in ('on', '1', 'true')
+        # Seconds membership changes are collected before client lists and updates go out
+        self.client_list_delay = float(os.getenv('CLIENT_LIST_DELAY', DEFAULT_CLIENT_LIST_DELAY))
 
         # Configure the logger
         logging.basicConfig(
@@ -67,38 +143,140 @@ class WebSocketServer():
         logging.getLogger('websockets.server').setLevel(logging.ERROR)
         logging.getLogger('aiohttp.access').setLevel(logging.ERROR)
         self.logger = logging.getLogger(f"{self.host}:{self.port}")
+        self.scheduler = FairScheduler.from_env(self.logger)
+        self.file_io = FileIO.from_env(self.logger)
+        self.file_cache = FileCache.from_env(self.file_io)
 
-        # Load private and public keys
-        self.private_key, self.public_key = self.load_keys()
+        # Private and public keys, loaded when the server starts
+        self.private_key, self.public_key = None, None
+        self.neighbours = {}
 
         # Client related info
         self.clients = set()
         self.all_clients = {}
+        self.key_directory = KeyDirectory(self.encryption)
+        self.list_digest = membership_digest({})
+        # Pending publication of membership changes, and whether local clients changed
+        self.membership_task = None
+        self.local_membership_changed = False
+        self.client_lists_skipped = 0
+        self.key_fetcher = KeyFetcher(self.key_directory, logger=self.logger)
+        # key_request lookups waiting on neighbours
+        self.key_lookups = set()
+        # { fingerprint : OlafClientConnection } of the clients connected here
+        self.client_fingerprints = {}
+
+        # Named groups of clients, kept across restarts
+        self.groups = GroupDirectory.from_env(self.server_name)
+        self.groups_path = os.path.join(GROUPS_DIR, f"{self.host}_{self.port}_groups.json")
 
         # Server related info
         self.neighbour_connections = set()
         self.neighbours_list = neighbours_list
+        # In overlay mode neighbours_list holds a few direct links and chats are routed over link state
+        self.overlay_routing = os.getenv('OVERLAY_ROUTING', 'off').lower() in ('on', '1', 'true')
+        self.link_state = LinkStateDatabase(self.server_name)
+        # Load of this server and its neighbours, to point clients at the least loaded one
+        self.load_balancer = LoadBalancer.from_env(self.server_name)
+        self.load_report_task = None
+
+        # Runtime metrics
+        self.metrics = ServerMetrics()
+        self.register_metrics()
+        self.loop_lag_monitor = LoopLagMonitor(on_sample=self.record_loop_lag)
+        self.tracer = SlowOperationTracer.from_env(self.logger)
         
 
         self.loop = asyncio.get_event_loop()
     
-    def load_keys(self) -> tuple:
+    def register_metrics(self) -> None:
+        """
+        Registers the metrics that are read from server state when scraped.
+        """
+        registry = self.metrics.registry
+        registry.callback("olaf_connected_clients", "Clients connected to this server.", "gauge",
+                          lambda: len(self.clients))
+        registry.callback("olaf_connected_neighbours", "Neighbour links of this server.", "gauge",
+                          lambda: len(self.neighbour_connections))
+        registry.callback("olaf_send_buffer_bytes", "Bytes waiting in websocket send buffers, by connection kind.", "gauge",
+                          self.send_buffer_sizes, ("kind",))
+        registry.callback("olaf_scheduler_pending_messages", "Messages queued for handling.", "gauge",
+                          self.scheduler.pending)
+        registry.callback("olaf_file_io_pending_operations", "Filesystem operations queued or running off the event loop.", "gauge",
+                          lambda: self.file_io.pending)
+        registry.callback("olaf_file_cache_hits_total", "Downloads served without reading the file from disk.", "counter",
+                          lambda: self.file_cache.hits)
+        registry.callback("olaf_file_cache_misses_total", "Downloads that had to stat or read the file.", "counter",
+                          lambda: self.file_cache.misses)
+        registry.callback("olaf_file_cache_hit_ratio", "Share of downloads that were cache hits.", "gauge",
+                          self.file_cache.hit_ratio)
+        registry.callback("olaf_file_cache_evictions_total", "Files evicted from the download cache.", "counter",
+                          lambda: self.file_cache.evictions)
+        registry.callback("olaf_file_cache_bytes", "Bytes of file contents held in the download cache.", "gauge",
+                          lambda: self.file_cache.cached_bytes)
+        registry.callback("olaf_file_served_bytes_total", "Download bytes served, by source.", "counter",
+                          lambda: self.file_cache.served_bytes, ("source",))
+        registry.callback("olaf_client_lists_skipped_total", "Client lists not sent because the client's list was current.", "counter",
+                          lambda: self.client_lists_skipped)
+        registry.callback("olaf_key_requests_total", "key_request round trips sent to neighbours.", "counter",
+                          lambda: self.key_fetcher.requests)
+        registry.callback("olaf_key_requests_coalesced_total", "Key lookups that joined a round trip already in flight.", "counter",
+                          lambda: self.key_fetcher.coalesced)
+        registry.callback("olaf_key_fetches_total", "Key lookups forwarded to neighbours, by result.", "counter",
+                          lambda: {"found": self.key_fetcher.found, "missing": self.key_fetcher.not_found}, ("result",))
+        registry.callback("olaf_relay_duplicates_total", "Chats dropped because they were already relayed, by type.", "counter",
+                          lambda: self.relay_dedup.duplicates, ("type",))
+        registry.callback("olaf_relay_hop_limited_total", "Chats not forwarded to neighbours because they reached the hop limit.", "counter",
+                          lambda: self.relay_dedup.hop_limited)
+        registry.callback("olaf_batches_sent_total", "Batch frames sent.", "counter",
+                          lambda: self.batches_sent)
+        registry.callback("olaf_batched_messages_total", "Messages sent inside batch frames.", "counter",
+                          lambda: self.batched_messages)
+        registry.callback("olaf_rejected_frames_total", "Frames rejected before decoding, by reason.", "counter",
+                          lambda: self.frame_limits.rejected_frames, ("reason",))
+        registry.callback("olaf_rejected_bytes_total", "Bytes of frames rejected before decoding, by reason.", "counter",
+                          lambda: self.frame_limits.rejected_bytes, ("reason",))
+        registry.callback("olaf_throttled_messages_total", "Messages rejected by rate limits.", "counter",
+                          lambda: self.rate_limiter.throttled, ("kind", "type"))
+        registry.callback("olaf_client_redirects_total", "Clients sent to a less loaded neighbour in answer to their hello.", "counter",
+                          lambda: self.load_balancer.redirects)
+
+    def send_buffer_sizes(self) -> dict:
+        """
+        Returns the bytes buffered for sending, summed per connection kind.
+        """
+        sizes = {"client": 0, "neighbour": 0}
+        for kind, connections in (("client", self.clients), ("neighbour", self.neighbour_connections)):
+            for connection in connections:
+                transport = getattr(connection.websocket, "transport", None)
+                if transport is not None:
+                    sizes[kind] += transport.get_write_buffer_size()
+        return sizes
+
+    def record_loop_lag(self, lag: float) -> None:
+        """
+        Records an event loop lag sample.
+        """
+        self.metrics.loop_lag.set(lag)
+        self.metrics.loop_lag_histogram.observe(lag)
+
+    async def load_keys(self) -> tuple:
         """
         This function loads the private and public keys from a file onto the server.
         If no keys are found, it generates a pair and saves them to files for future use.
 
+        Files are read and written, and keys generated, off the event loop.
+
         Returns:
             tuple: A tuple containing the loaded or generated private and public keys.
         """
         private_key_path = os.path.join(KEYS_DIR, f"{self.host}_{self.port}_private_key.pem")
         public_key_path = os.path.join(KEYS_DIR, f"{self.host}_{self.port}_public_key.pem")
 
-        if os.path.exists(private_key_path) and os.path.exists(public_key_path):
+        if await self.file_io.exists(private_key_path) and await self.file_io.exists(public_key_path):
 
-            with open(private_key_path, 'rb') as f:
-                self.private_pem = f.read()
-            with open(public_key_path, 'rb') as f:
-                self.public_pem = f.read()
+            self.private_pem = await self.file_io.read_bytes(private_key_path)
+            self.public_pem = await self.file_io.read_bytes(public_key_path)
 
             private_key = self.encryption.load_private_key(self.private_pem)
             public_key = self.encryption.load_public_key(self.public_pem)
@@ -106,13 +284,10 @@ class WebSocketServer():
             self.logger.info("Key pair successfully loaded from files.")
 
         else:
-            self.public_pem, self.private_pem = self.encryption.generate_rsa_key_pair()
+            self.public_pem, self.private_pem = await self.file_io.run(self.encryption.generate_rsa_key_pair)
 
-            with open(private_key_path, 'wb') as f:
-                f.write(self.private_pem)
-
-            with open(public_key_path, 'wb') as f:
-                f.write(self.public_pem)
+            await self.file_io.write_bytes(private_key_path, self.private_pem)
+            await self.file_io.write_bytes(public_key_path, self.public_pem)
 
             private_key = self.encryption.load_private_key(self.private_pem)
             public_key = self.encryption.load_public_key(self.public_pem)
@@ -140,18 +315,18 @@ class WebSocketServer():
         
         return server_host, server_port
 
-    def load_neighbour_keys(self) -> None:
+    async def load_neighbour_keys(self) -> None:
         """
         This functions loads the neighbours public keys from a file. 
         These must be shared before starting any servers in the neighbourhood.
         
-        Returns:
-            dictionary of { server_addr : public_key }
+        Sets self.neighbours to a dictionary of { server_addr : public_key }
         """
         neighbours = {}
 
         if len(self.neighbours_list) < 1:
-            return neighbours
+            self.neighbours = neighbours
+            return
         
         try:
             for server_name in self.neighbours_list:
@@ -162,10 +337,9 @@ class WebSocketServer():
                 server_host, server_port = self.get_server_host_port(server_name)
 
                 public_key_path = os.path.join(KEYS_DIR, f"{server_host}_{server_port}_public_key.pem")
-                with open(public_key_path, 'rb') as f:
-                    self.public_pem = f.read()
+                public_pem = await self.file_io.read_bytes(public_key_path)
 
-                public_key = self.encryption.load_public_key(self.public_pem)
+                public_key = self.encryption.load_public_key(public_pem)
                 neighbours[server_name] = public_key
 
                 self.logger.info(f"Public key successfully loaded for {server_name} from file.")
@@ -215,30 +389,109 @@ class WebSocketServer():
             try:
                 # async for message in websocket:
                 message = await websocket.recv()
-                try:
-                    data = json.loads(message)
-
-                    # Handle all messages
-                    await self.handler(websocket, data)
-
-                except json.decoder.JSONDecodeError:
-                    self.logger.info(f"Failed to JSON decode message: {message}")
+                data, error = self.decode_frame(websocket, message)
+                if error:
                     err = {
-                        "error" : "Message received not in JSON string."
+                        "error" : error
                     }
                     await self.send(websocket, err)
+                    continue
+
+                # Handle all messages, interleaved fairly with other connections
+                await self.submit_message(websocket, data, message)
+
             except websockets.ConnectionClosedOK:
-                await self.disconnect(websocket)
+                await self.scheduler.submit(websocket, self.disconnect, websocket, last=True)
                 break
             except websockets.exceptions.ConnectionClosed as conn_closed:
+                if conn_closed.sent is not None and conn_closed.sent.code == 1009:
+                    # Frame was larger than the websocket layer allows
+                    self.frame_limits.record_rejection("websocket_max_size", 0)
                 # Remove from clients / neighbours list
-                await self.disconnect(websocket)
+                await self.scheduler.submit(websocket, self.disconnect, websocket, last=True)
                 break
+
+    def decode_frame(self, websocket: ServerConnection, message: str | bytes) -> tuple:
+        """
+        Applies frame size and rate limits and decodes the frame.
+
+        Oversized frames, frames of unknown type and frames over the connection's
+        rate limit are rejected from a scan of the raw frame, before any JSON
+        decoding takes place.
+
+        Returns:
+            A tuple containing the decoded message and None on success,
+            or None and an error message if the frame is rejected.
+        """
+        is_neighbour = self.existing_neighbour(websocket)
+        message_type, error = self.frame_limits.check_frame(message, is_neighbour)
+        if error:
+            self.logger.info(f"Rejected frame of {len(message)} bytes: {error}")
+            return None, error
+
+        if message_type is not None and not self.rate_limiter.allow(websocket, message_type, is_neighbour):
+            return None, f"Rate limit exceeded for {message_type}."
+
+        if is_envelope(message):
+            # A chat, its size and rate were checked from the magic bytes
+            try:
+                return ChatEnvelope.parse(message), None
+            except ValueError as e:
+                self.logger.info(f"Malformed binary envelope: {e}")
+                return None, "Malformed binary envelope."
+
+        try:
+            data = codec.decode(message)
+        except DecodeError:
+            self.logger.info(f"Failed to JSON decode message: {message[:200]}")
+            return None, "Message received not in JSON string."
+
+        if message_type is not None:
+            # Limits were picked from the pre-scanned type, which has to be the one handled
+            error = self.frame_limits.check_decoded_type(message_type, data, len(message))
+            if error:
+                self.logger.info(f"Rejected frame of {len(message)} bytes: {error}")
+                return None, error
+        else:
+            # Type could not be pre-scanned, check the limits for the decoded type.
+            message_type = message_type_of(data)
+            error = self.frame_limits.check_type_size(message_type, len(message))
+            if error:
+                self.logger.info(f"Rejected frame of {len(message)} bytes: {error}")
+                return None, error
+
+            if not self.rate_limiter.allow(websocket, message_type, is_neighbour):
+                return None, f"Rate limit exceeded for {message_type}."
+
+        return data, None
                         
+    async def submit_message(self, websocket: ServerConnection, data, message: str | bytes) -> None:
+        """
+        Queues a decoded message for handling. Batches from neighbours are
+        unpacked, with each message charged to the rate limits on its own.
+        """
+        if type(data) is not dict or data.get("type") != BATCH_TYPE or not self.existing_neighbour(websocket):
+            await self.scheduler.submit(websocket, self.handler, websocket, data, message)
+            return
+
+        batch, error = validate_message(data)
+        if error:
+            self.logger.info(f"Invalid batch received: {error}")
+            return
+        for inner in batch.raw['messages']:
+            if self.rate_limiter.allow(websocket, message_type_of(inner), True):
+                await self.scheduler.submit(websocket, self.handler, websocket, inner)
+
+    def record_batch(self, count: int) -> None:
+        if count > 1:
+            self.batches_sent += 1
+            self.batched_messages += count
+
     async def disconnect(self, websocket: ServerConnection) -> None:
         """
         Handles a disconnection
         """
+        self.rate_limiter.forget(websocket)
         tmp = []
         for client in self.clients:
 
@@ -249,16 +502,21 @@ class WebSocketServer():
             if websocket == neighbour.websocket:
                 tmp.append(neighbour)
         
+        links_changed = False
         for conn in tmp:
             if conn in self.clients:
                 self.clients.remove(conn)
-                await self.send_client_update_to_neighbours()
+                if self.client_fingerprints.get(conn.fingerprint) is conn:
+                    del self.client_fingerprints[conn.fingerprint]
+                links_changed = True
                 self.logger.info(f"Client Disconnected: {conn.public_key}")
             elif conn in self.neighbour_connections:
                 self.neighbour_connections.remove(conn)
+                self.load_balancer.forget(conn.server_addr)
+                links_changed = links_changed or self.overlay_routing
                 self.logger.warning(f"Neighbour Disconnected: {conn.server_addr}")
                         
-        await self.broadcast_client_list()
+        self.membership_changed(local=links_changed)
         await websocket.close(code=1000)
 
 
@@ -267,73 +525,22 @@ class WebSocketServer():
         """
         Send the data as serialised message to websocket
         """
-        message = json.dumps(data)
-        await websocket.send(message)
-    
-    def message_fits_standard(self, message: dict) -> bool:
+        await websocket.send(codec.encode(data))
+        self.metrics.sent(data.get("type") or "error").inc()
+
+    async def fan_out(self, connections, frame: str | bytes, message_type: str) -> None:
         """
-        Validates that the message has the required fields according to its type.
-        Returns True if valid, False otherwise.
+        Sends one encoded frame to every connection in connections.
         """
-
-        def has_required_fields(msg, required_fields):
-            """
-            Helper function to check if required fields are present.
-            """
-            for field in required_fields:
-                if field not in msg:
-                    self.logger.error(f"Validation Error: Message missing required field '{field}'.")
-                    return False
-            return True
-
-        try:
-            # Determine message type
-            message_type = message.get("type") or message.get("data", {}).get("type")
-            if not message_type:
-                self.logger.error("Validation Error: Message missing 'type' field.")
-                return False
-
-            # Define required fields based on message_type
-            message_type_to_fields = {
-                "signed_data": ["data", "counter", "signature"],
-                "client_list_request": ["type"],
-                "client_update": ["type", "clients"],
-                "client_list": ["type", "servers"],
-                "client_update_request": ["type"]
-            }
-
-            data_type_to_fields = {
-                "hello": ["type", "public_key"],
-                "chat": ["type", "destination_servers", "iv", "symm_keys", "chat"],
-                "public_chat": ["type", "sender", "message"],
-                "server_hello": ["type", "sender"]
-            }
-
-            # Validate required fields for top-level message
-            if message_type in message_type_to_fields:
-                if not has_required_fields(message, message_type_to_fields[message_type]):
-                    return False
-
-                # Check nested data if message_type is "signed_data"
-                if message_type == "signed_data":
-                    data = message.get("data", {})
-                    data_type = data.get("type")
-                    if data_type in data_type_to_fields:
-                        return has_required_fields(data, data_type_to_fields[data_type])
-                    else:
-                        self.logger.error(f"Validation Error: Unknown signed data type '{data_type}'.")
-                        return False
-
-            else:
-                self.logger.error(f"Validation Error: Unknown message type '{message_type}'.")
-                return False
-
-            return True
-
-        except Exception as e:
-            self.logger.error(f"Validation Error: Exception occurred - {e}")
-            return False
-
+        count = 0
+        for connection in connections:
+            # A connection closing mid fan-out is cleaned up by its receive loop
+            if await connection.try_send_frame(frame):
+                count += 1
+
+        self.metrics.sent(message_type).inc(count)
+        self.metrics.fanout[message_type].observe(count)
+    
     async def echo(self, websocket: ServerConnection) -> None:
         """
         Relays the message back to the sender.
@@ -341,15 +548,23 @@ class WebSocketServer():
         data = await self.recv(websocket)
         await self.send(websocket, data)
 
-    async def handler(self, websocket: ServerConnection, message: dict) -> None:
+    async def handler(self, websocket: ServerConnection, message: dict | ChatEnvelope, frame: str | bytes | None = None) -> None:
         """
         Handle websocket messages
+
+        frame is the message as received, if available, so relays can forward
+        it without encoding it again. Binary chat envelopes were checked when
+        they were parsed.
         """
 
         # Check whether message meets standardised format
-        if not self.message_fits_standard(message):
+        if isinstance(message, ChatEnvelope):
+            olaf_message, error = message, None
+        else:
+            olaf_message, error = validate_message(message, frame)
+        if error:
             # Return invalid message error.
-            self.logger.info(f"Unknown message type received: {message}")
+            self.logger.info(f"Invalid message received: {error}")
             err_msg = {
                 "error" : "Message does not fit OLAF Protocol standard."
             }
@@ -357,25 +572,44 @@ class WebSocketServer():
             return
 
         # Only valid messages from this point.
+        message_type = olaf_message.data_type or olaf_message.type
+        self.metrics.messages_received[message_type].inc()
+        operation = self.tracer.begin("message", message_type)
 
         # Handle each type accordingly
-        msg_type = message["type"]
-        match msg_type:
-            case "signed_data":
-                await self.signed_data_handler(websocket, message)
-            case "client_list_request":
-                await self.client_list_request_handler(websocket)
-            case "client_update":
-                await self.client_update_handler(websocket, message)
-            case "client_update_request":
-                await self.client_update_request_handler(websocket)
-            case _:
+        try:
+            match olaf_message.type:
+                case "signed_data":
+                    await self.signed_data_handler(websocket, olaf_message)
+                case "client_list_request":
+                    await self.client_list_request_handler(websocket)
+                case "client_update":
+                    await self.client_update_handler(websocket, olaf_message)
+                case "client_update_request":
+                    await self.client_update_request_handler(websocket)
+                case "key_request":
+                    await self.key_request_handler(websocket, olaf_message)
+                case "key_response":
+                    self.key_response_handler(websocket, olaf_message)
+                case "group_join":
+                    await self.group_join_handler(websocket, olaf_message)
+                case "group_leave":
+                    await self.group_leave_handler(websocket, olaf_message)
+                case "group_update":
+                    await self.group_update_handler(websocket, olaf_message)
+                case "load_report":
+                    self.load_report_handler(websocket, olaf_message)
+                case "link_state":
+                    await self.link_state_handler(websocket, olaf_message)
+                case _:
 
-                self.logger.info("Unknown party attempt to communicate")
-                err_msg = {
-                    "error" : "Connection must be established with hello / hello_server message first."
-                }
-                await self.send(websocket, err_msg)
+                    self.logger.info("Unknown party attempt to communicate")
+                    err_msg = {
+                        "error" : "Connection must be established with hello / hello_server message first."
+                    }
+                    await self.send(websocket, err_msg)
+        finally:
+            self.metrics.handler_latency[message_type].observe(self.tracer.end(operation))
      
     async def client_list_request_handler(self, websocket: ServerConnection) -> None:
         """
@@ -390,37 +624,19 @@ class WebSocketServer():
             await websocket.close(code=1000)
             return
 
-        # Generate client list
-        all_clients = []
-
-        for address, clients in self.all_clients.items():
-            tmp = {
-                "address" : address,
-                "clients" : clients
-            }
-            all_clients.append(tmp)
-
-        own_clients = {
-            "address" : f"{self.host}:{self.port}",
-            "clients" : [client.public_key for client in self.clients]
-        }
-        
-        servers = all_clients + [own_clients]
-
-        # Create client_list message
-        client_list = {
-            "type" : "client_list",
-            "servers" : servers
-        }
-
-        await self.send(websocket, client_list)
+        connection = self.existing_connection(websocket)
+        servers = self.current_client_list()
+        await connection.send_frame(self.client_list_frame(servers, connection))
+        if isinstance(connection, OlafClientConnection):
+            connection.list_digest = self.list_digest
+        self.metrics.sent("client_list").inc()
 
     
-    async def client_update_handler(self, websocket: ServerConnection, message: dict) -> None:
+    async def client_update_handler(self, websocket: ServerConnection, message: OlafMessage) -> None:
         """
         Updates the client list for a particular server
         """
-        updated_client_list = message['clients']
+        updated_client_list = message.raw['clients']
 
         # client udpates should only come from known neighbours
         existing_connection = self.existing_connection(websocket)
@@ -432,7 +648,7 @@ class WebSocketServer():
         # Update clients for particular server.
         self.all_clients[server_to_update] = updated_client_list
 
-        await self.broadcast_client_list()
+        self.membership_changed()
         
 
     async def client_update_request_handler(self, websocket: ServerConnection):
@@ -446,23 +662,214 @@ class WebSocketServer():
 
         await self.send(websocket, client_update)
 
-    async def signed_data_handler(self, websocket: ServerConnection, message: dict) -> None:
+    async def key_request_handler(self, websocket: ServerConnection, message: OlafMessage) -> None:
         """
-        Handles all signed_data
-        """        
-        try:
-            signed_data = message['data']
-            signed_data_type = signed_data['type']
+        Answers a 'key_request' with the keys of the requested fingerprints.
 
-        except KeyError:
+        Keys of clients in the neighbourhood are answered from the key
+        directory. For a client, the others are looked up on the neighbours in
+        the background so the handler does not wait on the round trip. A
+        neighbour is only answered from the directory, so requests never loop.
+        """
+        connection = self.existing_connection(websocket)
+        if connection is None:
             err_msg = {
-                "error" : "Invalid signed_data format"
+                "error" : "Must establish connection first before requesting keys"
             }
             await self.send(websocket, err_msg)
-            await websocket.close(code=100)
             return
 
-        
+        records = []
+        missing = []
+        for fingerprint in dict.fromkeys(message.raw['fingerprints']):
+            record = self.key_directory.lookup(fingerprint)
+            if record is not None:
+                records.append(record)
+            else:
+                missing.append(fingerprint)
+
+        if missing and isinstance(connection, OlafClientConnection) and self.key_request_neighbours():
+            task = asyncio.ensure_future(self.fetch_keys(connection, records, missing))
+            self.key_lookups.add(task)
+            task.add_done_callback(self.key_lookups.discard)
+            return
+
+        await self.send_key_response(connection, records, missing)
+
+    async def fetch_keys(self, connection: OlafClientConnection, records: list, missing: list) -> None:
+        """
+        Looks the missing fingerprints of a client's key_request up on the neighbours and answers it.
+        """
+        try:
+            fetched = await self.key_fetcher.fetch(missing, self.key_request_neighbours(), self.send_key_request)
+            records += [record for record in fetched.values() if record is not None]
+            missing = [fingerprint for fingerprint, record in fetched.items() if record is None]
+            await self.send_key_response(connection, records, missing)
+        except websockets.ConnectionClosed:
+            pass
+        except Exception as e:
+            self.logger.error(f"Key lookup failed: {e}")
+
+    def key_request_neighbours(self) -> list:
+        return [neighbour for neighbour in self.neighbour_connections if CAP_KEY_REQUEST in neighbour.capabilities]
+
+    async def send_key_request(self, neighbour: OlafServerConnection, fingerprints: list) -> None:
+        await neighbour.send({"type": "key_request", "fingerprints": fingerprints})
+        self.metrics.sent("key_request").inc()
+
+    async def send_key_response(self, connection: ConnectionHandler, records: list, missing: list) -> None:
+        """
+        Sends a key_response listing the found keys as compact client_list entries.
+        """
+        frame = b'{"type":"key_response","keys":[%s],"missing":%s}' % (
+            b",".join(record.full for record in records), codec.encode_bytes(missing))
+        await connection.send_frame(codec.frame(frame))
+        self.metrics.sent("key_response").inc()
+
+    def key_response_handler(self, websocket: ServerConnection, message: OlafMessage) -> None:
+        """
+        Hands a neighbour's 'key_response' to the lookups waiting on it.
+        Keys that do not match the fingerprint they are listed under are dropped.
+        """
+        connection = self.existing_connection(websocket)
+        if not isinstance(connection, OlafServerConnection):
+            self.logger.warning("key_response received from a connection that is not a neighbour")
+            return
+
+        records = [self.key_directory.record_from_entry(entry) for entry in message.raw['keys']]
+        missing = message.raw.get('missing')
+        if not isinstance(missing, list):
+            missing = []
+        self.key_fetcher.resolve(connection, [record for record in records if record is not None],
+                                 [fingerprint for fingerprint in missing if isinstance(fingerprint, str)])
+
+    async def group_join_handler(self, websocket: ServerConnection, message: OlafMessage) -> None:
+        """
+        Adds the client to a group, or sends it the members if it is in the group already.
+        """
+        connection = self.existing_connection(websocket)
+        if not isinstance(connection, OlafClientConnection) or connection.fingerprint is None:
+            await self.send(websocket, {"error" : "Only connected clients can join groups."})
+            return
+
+        group = message.raw["group"]
+        try:
+            joined = self.groups.join(group, connection.fingerprint)
+        except ValueError as e:
+            await self.send(websocket, {"error" : str(e)})
+            return
+        if joined:
+            await self.groups_changed([group], local=True)
+        else:
+            await self.send_group_members(group, [connection])
+
+    async def group_leave_handler(self, websocket: ServerConnection, message: OlafMessage) -> None:
+        """
+        Removes the client from a group.
+        """
+        connection = self.existing_connection(websocket)
+        if not isinstance(connection, OlafClientConnection) or connection.fingerprint is None:
+            await self.send(websocket, {"error" : "Only connected clients can leave groups."})
+            return
+
+        group = message.raw["group"]
+        if self.groups.leave(group, connection.fingerprint):
+            await self.groups_changed([group], local=True)
+        # The client is not among the members it is sent anymore
+        await self.send_group_members(group, [connection])
+
+    async def group_update_handler(self, websocket: ServerConnection, message: OlafMessage) -> None:
+        """
+        Records the memberships a server holds. In overlay mode updates are flooded on.
+        """
+        connection = self.existing_connection(websocket)
+        if not isinstance(connection, OlafServerConnection):
+            self.logger.warning("group_update received from a connection that is not a neighbour")
+            return
+
+        changed = self.groups.apply(message.raw)
+        if changed is None:
+            return
+        if self.overlay_routing:
+            neighbours = [neighbour for neighbour in self.group_neighbours() if neighbour is not connection]
+            await self.fan_out(neighbours, self.relay_frame(message), "group_update")
+
+        # Clients that moved to that server take their memberships along
+        released = self.groups.release(message.raw["server"], self.client_fingerprints)
+        await self.groups_changed(changed, local=released)
+
+    async def client_groups_connected(self, connection: OlafClientConnection) -> None:
+        """
+        Takes over the memberships of a client that connected here and sends it its groups.
+        """
+        claimed = self.groups.claim(connection.fingerprint)
+        if claimed:
+            await self.save_groups()
+            await self.send_group_update()
+        if CAP_GROUPS in connection.capabilities:
+            for group in self.groups.groups_of(connection.fingerprint):
+                await self.send_group_members(group, [connection])
+
+    async def groups_changed(self, groups, local: bool = False) -> None:
+        """
+        Sends the new members of groups to their members connected here. If
+        local is set, this server's memberships changed: they are stored and
+        sent to the neighbours.
+        """
+        if local:
+            await self.save_groups()
+            await self.send_group_update()
+        for group in groups:
+            members = self.groups.members(group)
+            connections = [self.client_fingerprints[fingerprint] for fingerprint in members
+                           if fingerprint in self.client_fingerprints]
+            await self.send_group_members(group, connections)
+
+    async def send_group_members(self, group: str, connections: list) -> None:
+        """
+        Sends the members of a group to the connections that support groups.
+        """
+        connections = [connection for connection in connections if CAP_GROUPS in connection.capabilities]
+        if not connections:
+            return
+        group_members = {
+            "type" : "group_members",
+            "group" : group,
+            "members" : sorted(self.groups.members(group))
+        }
+        await self.fan_out(connections, codec.encode(group_members), "group_members")
+
+    def group_neighbours(self) -> list:
+        return [neighbour for neighbour in self.neighbour_connections if CAP_GROUPS in neighbour.capabilities]
+
+    async def send_group_update(self, neighbours: list | None = None) -> None:
+        """
+        Sends this server's memberships to neighbours, every neighbour that supports groups by default.
+        """
+        if neighbours is None:
+            neighbours = self.group_neighbours()
+        await self.fan_out(neighbours, codec.encode(self.groups.originate()), "group_update")
+
+    async def load_groups(self) -> None:
+        """
+        Loads the memberships stored by this server before it restarted.
+        """
+        if not await self.file_io.exists(self.groups_path):
+            return
+        try:
+            self.groups.restore(await self.file_io.read_bytes(self.groups_path))
+        except ValueError as e:
+            self.logger.error(f"Unable to load groups from {self.groups_path}: {e}")
+
+    async def save_groups(self) -> None:
+        await self.file_io.write_bytes(self.groups_path, self.groups.snapshot())
+
+    async def signed_data_handler(self, websocket: ServerConnection, message: OlafMessage) -> None:
+        """
+        Handles all signed_data
+        """        
+        signed_data_type = message.data_type
+
         if not self.existing_connection(websocket):
             match signed_data_type:
                 case "server_hello":
@@ -484,12 +891,30 @@ class WebSocketServer():
         
         # Handle each type of signed_data
         match signed_data_type:
-            case "chat":
-                # Route message to destination server
-                await self.relay_chat(websocket,message)
-            case "public_chat":
-                # Broadcast to all clients.
-                await self.relay_public_chat(websocket, message)
+            case "server_hello":
+                await self.signed_data_handler_hello_server(websocket, message)
+            case "chat" | "public_chat":
+                # Drop messages that reached this server over another path already.
+                # Only neighbours say which message it is and how far it came.
+                from_neighbour = self.neighbour_address(websocket) is not None
+                hops = message_hops(message.raw, from_neighbour)
+                if hops is None:
+                    await self.send(websocket, {"error" : "Invalid hop count"})
+                    return
+                msg_id = message_id(message.raw, from_neighbour)
+                if not self.relay_dedup.first_seen(msg_id, signed_data_type):
+                    return
+                origin = self.message_origin(websocket, message)
+
+                if signed_data_type == "chat" and message.data.get("group") is not None:
+                    # Deliver to the members of a group, wherever they are
+                    await self.relay_group_chat(websocket, message, msg_id, hops, origin)
+                elif signed_data_type == "chat":
+                    # Route message to destination server
+                    await self.relay_chat(websocket, message, msg_id, hops, origin)
+                else:
+                    # Broadcast to all clients.
+                    await self.relay_public_chat(websocket, message, msg_id, hops, origin)
             case _:
                 err_msg = {
                     "error" : "Invalid data type from established connection"
@@ -497,57 +922,207 @@ class WebSocketServer():
                 await self.send(websocket, err_msg)
 
 
-    async def relay_chat(self, websocket, message: dict) -> None:
+    def relay_frame(self, message: OlafMessage | ChatEnvelope) -> str | bytes:
+        """
+        Returns the frame to forward a message with, reusing the received frame when possible.
+        """
+        if isinstance(message, ChatEnvelope):
+            return message.frame
+        if message.frame is not None:
+            return codec.as_frame(message.frame)
+        return codec.encode(message.raw)
+
+    def neighbour_address(self, websocket: ServerConnection) -> str | None:
+        """
+        Returns the address of the neighbour server websocket belongs to, or None if it is not a neighbour.
+        """
+        connection = self.existing_connection(websocket)
+        if isinstance(connection, OlafServerConnection):
+            return connection.server_addr
+        return None
+
+    def message_origin(self, websocket: ServerConnection, message: OlafMessage) -> str:
+        """
+        Returns the server a relayed message entered the neighbourhood at.
+        """
+        connection = self.existing_connection(websocket)
+        if not isinstance(connection, OlafServerConnection):
+            return self.server_name
+        origin = message.raw.get("origin")
+        if isinstance(origin, str) and len(origin) <= MAX_SERVER_ADDRESS_LENGTH:
+            return origin
+        return connection.server_addr
+
+    def neighbour_relay_frame(self, message: OlafMessage | ChatEnvelope, msg_id: str, hops: int, origin: str) -> str | bytes:
+        """
+        Returns the frame to forward a message to neighbours with, carrying its ID and one more hop,
+        and in overlay mode the server it entered at.
+        The signature only covers data and counter, so the envelope can change.
         """
-        Relay chat to required destination servers
+        relayed = message.signed_data() if isinstance(message, ChatEnvelope) else dict(message.raw)
+        relayed["msg_id"] = msg_id
+        relayed["hops"] = hops + 1
+        if self.overlay_routing:
+            relayed["origin"] = origin
+        return codec.encode(relayed)
+
+    def stock_relay_frame(self, message: OlafMessage | ChatEnvelope) -> str | bytes:
+        """
+        Returns the frame to forward a message to stock peers with, in the standard format.
+        """
+        if isinstance(message, ChatEnvelope):
+            return codec.encode(message.signed_data())
+        if not any(field in message.raw for field in RELAY_FIELDS):
+            return self.relay_frame(message)
+        return codec.encode({key: value for key, value in message.raw.items() if key not in RELAY_FIELDS})
+
+    async def relay_to_neighbours(self, neighbours, message: OlafMessage | ChatEnvelope, msg_id: str, hops: int,
+                                  origin: str, message_type: str) -> None:
+        """
+        Forwards a chat to neighbours, with its relay fields to those that support them.
+        Binary envelopes stay binary for neighbours that accept them, with only the header rewritten.
+        """
+        extended = [neighbour for neighbour in neighbours if CAP_RELAY_IDS in neighbour.capabilities]
+        stock = [neighbour for neighbour in neighbours if CAP_RELAY_IDS not in neighbour.capabilities]
+        if isinstance(message, ChatEnvelope):
+            binary = [neighbour for neighbour in extended if CAP_BINARY_CHAT in neighbour.capabilities]
+            extended = [neighbour for neighbour in extended if CAP_BINARY_CHAT not in neighbour.capabilities]
+            if binary:
+                frame = message.relayed(msg_id, hops + 1, origin if self.overlay_routing else None)
+                await self.fan_out(binary, frame, message_type)
+        if extended:
+            await self.fan_out(extended, self.neighbour_relay_frame(message, msg_id, hops, origin), message_type)
+        if stock:
+            await self.fan_out(stock, self.stock_relay_frame(message), message_type)
+
+    async def relay_to_clients(self, message: OlafMessage | ChatEnvelope, message_type: str) -> None:
+        """
+        Delivers a message to this server's clients. Binary envelopes go as
+        they are to clients that accept them and as JSON to the others.
+        """
+        if not isinstance(message, ChatEnvelope):
+            await self.fan_out(self.clients, self.relay_frame(message), message_type)
+            return
+        binary = [client for client in self.clients if CAP_BINARY_CHAT in client.capabilities]
+        stock = [client for client in self.clients if CAP_BINARY_CHAT not in client.capabilities]
+        if binary:
+            await self.fan_out(binary, message.frame, message_type)
+        if stock:
+            await self.fan_out(stock, self.stock_relay_frame(message), message_type)
+
+    async def relay_chat(self, websocket, message: OlafMessage | ChatEnvelope, msg_id: str, hops: int, origin: str) -> None:
+        """
+        Relay chat to required destination servers.
+        """
+        neighbours, local = self.next_hops(websocket, message.data["destination_servers"], origin)
+        if local:
+            await self.relay_to_clients(message, "chat")
+        if neighbours and self.relay_dedup.may_forward(hops):
+            await self.relay_to_neighbours(neighbours, message, msg_id, hops, origin, "chat")
+
+    def next_hops(self, websocket, destination_servers, origin: str) -> tuple:
+        """
+        Works out where a chat for destination_servers goes from this server.
+
+        In overlay mode, chats for servers that are not neighbours go to the
+        next server on the way there.
+
+        Returns:
+            The neighbours to forward it to, and whether it is for this server's clients.
         """
-        data = message ["data"]
-        destination_servers = data["destination_servers"]
         neighbour_addresses = {}
         for neighbour in self.neighbour_connections:
             neighbour_addresses[neighbour.server_addr] = neighbour
+        sender = self.neighbour_address(websocket)
 
+        neighbours = []
+        local = False
         for destination_server in destination_servers:
 
             if destination_server in self.server_address: # Comparison includes ws:// or wss://
-                for client in self.clients:
-                    await client.send(message)
-                continue
-            
-            if websocket == neighbour_addresses[destination_server].websocket:
-                # Do not send back to the server which you received the public chat from
+                local = True
                 continue
 
-            if destination_server in neighbour_addresses.keys():
-                await neighbour_addresses[destination_server].send(message)
-            else:
+            next_hop = destination_server
+            if self.overlay_routing:
+                next_hop = self.link_state.route(origin, destination_server) or destination_server
+
+            neighbour = neighbour_addresses.get(next_hop)
+            if neighbour is None:
                 self.logger.warning(f"Unknown destination server {destination_server} listed in chat message. Check if neighbourhood is complete.")
+            elif next_hop != sender and neighbour not in neighbours:
+                # Do not send back to the server which you received the chat from
+                neighbours.append(neighbour)
 
+        return neighbours, local
 
-    async def relay_public_chat(self, websocket: ServerConnection, message: dict) -> None:
+    async def relay_group_chat(self, websocket, message: OlafMessage, msg_id: str, hops: int, origin: str) -> None:
+        """
+        Delivers a chat to the members of its group: to the members connected
+        here, and on to the servers the others are on. The sender only names
+        the group.
+
+        Without overlay routing every server is a neighbour, so the server the
+        chat entered at sends it to all of them and they only deliver it locally.
+        """
+        group = message.data["group"]
+        connection = self.existing_connection(websocket)
+        if not valid_group_name(group):
+            await self.send(websocket, {"error" : "Invalid group name."})
+            return
+        members = self.groups.members(group)
+        if isinstance(connection, OlafClientConnection) and connection.fingerprint not in members:
+            await self.send(websocket, {"error" : "Not a member of this group."})
+            return
+
+        local = [self.client_fingerprints[fingerprint] for fingerprint in members if fingerprint in self.client_fingerprints]
+        if local:
+            await self.fan_out(local, self.relay_frame(message), "chat")
+
+        if isinstance(connection, OlafServerConnection) and not self.overlay_routing:
+            return
+        locations = self.key_directory.locations
+        destination_servers = {locations.get(fingerprint) for fingerprint in members}
+        destination_servers.discard(None)
+        destination_servers.discard(self.server_name)
+        neighbours, _ = self.next_hops(websocket, sorted(destination_servers), origin)
+        neighbours = [neighbour for neighbour in neighbours if CAP_GROUPS in neighbour.capabilities]
+        if neighbours and self.relay_dedup.may_forward(hops):
+            await self.relay_to_neighbours(neighbours, message, msg_id, hops, origin, "chat")
+
+
+    async def relay_public_chat(self, websocket: ServerConnection, message: OlafMessage, msg_id: str, hops: int, origin: str) -> None:
         """
         Broadcasts the message to all clients in every server.
+
+        In overlay mode it is passed down the spanning tree rooted at the
+        server it entered at, so each server gets it once.
         """
+        # Encoded once for every recipient
+        frame = self.relay_frame(message)
         
         # Send public Chat Message to all clients.
-        for client in self.clients:
-            await client.send(message)
+        await self.fan_out(self.clients, frame, "public_chat")
         
         # Send public Chat Message to all servers.
-        for server in self.neighbour_connections:
-            if server.websocket == websocket:
-                # Do not send back to the server which you received the public chat from
-                continue
-            
-            await self.send(server.websocket, message)
-
-
-    async def signed_data_handler_hello(self, websocket: ServerConnection, message: dict[str, str]) -> None:
+        # Do not send back to the server which you received the public chat from
+        # Servers that list each other are linked twice, once in each direction. Use one link per server.
+        sender = self.neighbour_address(websocket)
+        neighbours = {server.server_addr: server for server in self.neighbour_connections if server.server_addr != sender}
+        if self.overlay_routing:
+            children = self.link_state.children(origin)
+            if children is not None:
+                neighbours = {address: server for address, server in neighbours.items() if address in children}
+        if neighbours and self.relay_dedup.may_forward(hops):
+            await self.relay_to_neighbours(neighbours.values(), message, msg_id, hops, origin, "public_chat")
+
+
+    async def signed_data_handler_hello(self, websocket: ServerConnection, message: OlafMessage) -> None:
         """
         Adds a client connection to maintain
         """
 
-        signed_data = message['data']
+        signed_data = message.data
 
         # Check if websocket is an active connection. Reject hello if so.
         active_connections = [client.websocket for client in self.clients]
@@ -559,46 +1134,152 @@ class WebSocketServer():
             await self.send(websocket, err_msg)
             return
 
+        # An overloaded server hands clients that can follow a redirect to a neighbour
+        capabilities = parse_capabilities(signed_data)
+        if CAP_REDIRECT in capabilities:
+            target = self.load_balancer.redirect_target(len(self.clients))
+            if target is not None:
+                self.logger.info(f"Redirecting new client to {target.address}")
+                await self.send(websocket, {"type" : "redirect", "address" : target.address, "http_port" : target.http_port})
+                await websocket.close(code=1000)
+                return
+
         public_key = signed_data['public_key']
-        client_connection = OlafClientConnection(websocket, public_key)
+        key_format = signed_data.get('key_format')
+        if key_format not in KEY_FORMATS:
+            key_format = KEY_FORMAT_PEM
+        client_connection = OlafClientConnection(websocket, public_key, key_format)
+
+        # A reconnecting client says which client list it has. If that is
+        # still the current list, it is not sent again.
+        list_digest = signed_data.get('client_list_digest')
+        if isinstance(list_digest, str) and len(list_digest) <= MAX_DIGEST_LENGTH and CAP_LIST_DIGEST in capabilities:
+            client_connection.list_digest = list_digest
         
+        client_connection.capabilities = capabilities
+        if self.batching.enabled and CAP_BATCH in client_connection.capabilities:
+            client_connection.enable_batching(self.batching, self.record_batch)
+
         self.clients.add(client_connection)
         self.logger.info(f"New Client Added: {public_key}")
 
-        await self.send_client_update_to_neighbours()
-        await self.broadcast_client_list()
+        record = self.key_directory.record(public_key)
+        if record is not None:
+            client_connection.fingerprint = record.fingerprint
+            self.client_fingerprints[record.fingerprint] = client_connection
+            await self.client_groups_connected(client_connection)
+
+        self.membership_changed(local=True)
         
         
-    async def broadcast_client_list(self) -> None:
+    def client_list_servers(self) -> list:
         """
-        Broadcasts the client list to all clients.
+        Returns the clients of every server in the neighbourhood as a list of (address, [public key, ...]).
         """
-                
-        # Generate client list
-        all_clients = []
-
-        for address, clients in self.all_clients.items():
-            tmp = {
-                "address" : address,
-                "clients" : clients
-            }
-            all_clients.append(tmp)
+        servers = list(self.all_clients.items())
+        if self.overlay_routing:
+            # Servers no longer reachable over the overlay have left
+            reachable = self.link_state.reachable()
+            reachable.update(neighbour.server_addr for neighbour in self.neighbour_connections)
+            servers = [(address, clients) for address, clients in servers if address in reachable]
+        servers.append((f"{self.host}:{self.port}", [client.public_key for client in self.clients]))
+        return servers
+
+    def current_client_list(self) -> list:
+        """
+        Returns client_list_servers(), after indexing its keys and updating the membership digest.
+        """
+        servers = self.client_list_servers()
+        self.key_directory.update(servers)
+        self.list_digest = membership_digest(self.key_directory.locations)
+        return servers
 
-        own_clients = {
-            "address" : f"{self.host}:{self.port}",
-            "clients" : [client.public_key for client in self.clients]
-        }
-        
-        servers = all_clients + [own_clients]
+    def client_list_frame(self, servers: list, connection: ConnectionHandler | None = None) -> str | bytes:
+        """
+        Encodes a client_list in the key format of connection, full PEM keys by default.
+        The membership digest is only added for connections that support it, and
+        this server's capabilities for connections that advertised their own.
+        """
+        digest = None
+        if connection is not None and CAP_LIST_DIGEST in connection.capabilities:
+            digest = self.list_digest
+        capabilities = None
+        if connection is not None and connection.capabilities:
+            capabilities = capabilities_field(self.server_capabilities())
+
+        if connection is not None and connection.key_format != KEY_FORMAT_PEM:
+            return codec.frame(self.key_directory.compact_client_list(
+                servers, connection.sent_keys, include_keys=connection.key_format != KEY_FORMAT_FINGERPRINT,
+                digest=digest, capabilities=capabilities))
 
-        # Create client_list message
         client_list = {
             "type" : "client_list",
-            "servers" : servers
+            "servers" : [{"address" : address, "clients" : clients} for address, clients in servers]
         }
-                
+        if digest is not None:
+            client_list["digest"] = digest
+        if capabilities is not None:
+            client_list["capabilities"] = capabilities
+        return codec.encode(client_list)
+
+    def membership_changed(self, local: bool = False) -> None:
+        """
+        Schedules client lists, and a client_update to neighbours if local is
+        set, to go out after client_list_delay seconds. Changes made in the
+        meantime, e.g. many clients reconnecting after a restart, go out together.
+        """
+        self.local_membership_changed = self.local_membership_changed or local
+        if self.membership_task is None:
+            self.membership_task = asyncio.ensure_future(self.publish_membership())
+
+    async def publish_membership(self) -> None:
+        await asyncio.sleep(self.client_list_delay)
+        self.membership_task = None
+        local, self.local_membership_changed = self.local_membership_changed, False
+        try:
+            if local:
+                await self.send_client_update_to_neighbours()
+                if self.overlay_routing:
+                    await self.send_link_state()
+            await self.broadcast_client_list()
+        except Exception as e:
+            self.logger.error(f"Unable to publish client list: {e}", exc_info=True)
+
+    async def broadcast_client_list(self) -> None:
+        """
+        Broadcasts the client list to all clients whose list is out of date.
+
+        Clients that asked for compact keys get their own list, with only the
+        keys they have not been sent yet. Everyone else shares one frame per
+        set of capabilities.
+        """
+        servers = self.current_client_list()
+
+        # { (supports digests, advertised capabilities) : [client, ...] }
+        pem_clients = {}
+        compact_clients = []
         for client in self.clients:
-            await client.send(client_list)
+            if client.list_digest == self.list_digest:
+                if not client.sent_keys:
+                    # Reconnected with the current list, which has every key in it
+                    client.sent_keys.update(self.key_directory.by_fingerprint)
+                self.client_lists_skipped += 1
+                continue
+            client.list_digest = self.list_digest
+            if client.key_format == KEY_FORMAT_PEM:
+                group = (CAP_LIST_DIGEST in client.capabilities, bool(client.capabilities))
+                pem_clients.setdefault(group, []).append(client)
+            else:
+                compact_clients.append(client)
+
+        for clients in pem_clients.values():
+            await self.fan_out(clients, self.client_list_frame(servers, clients[0]), "client_list")
+
+        sent = 0
+        for client in compact_clients:
+            if await client.try_send_frame(self.client_list_frame(servers, client)):
+                sent += 1
+        self.metrics.sent("client_list").inc(sent)
     
     
     async def send_client_update_to_neighbours(self) -> None:
@@ -609,16 +1290,61 @@ class WebSocketServer():
             "type" : "client_update",
             "clients" : [client.public_key for client in self.clients]
         }
+        frame = codec.encode(client_update)
 
-        for neighbour in self.neighbour_connections:
-            await neighbour.send(client_update)
+        await self.fan_out(self.neighbour_connections, frame, "client_update")
     
-    async def signed_data_handler_hello_server(self, websocket: ServerConnection, message: dict) -> None:
+    async def send_link_state(self) -> None:
+        """
+        Floods this server's links and clients to the overlay.
+        """
+        link_state = self.link_state.originate([neighbour.server_addr for neighbour in self.neighbour_connections],
+                                               [client.public_key for client in self.clients])
+        await self.fan_out(self.link_state_neighbours(), codec.encode(link_state), "link_state")
+
+    async def link_state_handler(self, websocket: ServerConnection, message: OlafMessage) -> None:
+        """
+        Records a 'link_state' from the overlay and floods it on if it is new.
+        """
+        connection = self.existing_connection(websocket)
+        if not isinstance(connection, OlafServerConnection):
+            self.logger.warning("link_state received from a connection that is not a neighbour")
+            return
+        if not self.overlay_routing or not self.link_state.apply(message.raw):
+            return
+
+        self.all_clients[message.raw['origin']] = message.raw['clients']
+        neighbours = [neighbour for neighbour in self.link_state_neighbours() if neighbour is not connection]
+        await self.fan_out(neighbours, self.relay_frame(message), "link_state")
+        self.membership_changed()
+
+    def link_state_neighbours(self) -> list:
+        return [neighbour for neighbour in self.neighbour_connections if CAP_LINK_STATE in neighbour.capabilities]
+
+    async def neighbour_added(self, connection: OlafServerConnection) -> None:
+        """
+        Tells a new neighbour about this server's groups and load. Brings a new
+        overlay link up to date with every known link state, and advertises the link.
+        """
+        if CAP_GROUPS in connection.capabilities:
+            await self.send_group_update([connection])
+        if CAP_LOAD_REPORT in connection.capabilities:
+            await self.fan_out([connection], codec.encode(self.local_load_report()), "load_report")
+        if not self.overlay_routing or CAP_LINK_STATE not in connection.capabilities:
+            return
+        sent = 0
+        for link_state in self.link_state.messages():
+            if await connection.try_send_frame(codec.encode(link_state)):
+                sent += 1
+        self.metrics.sent("link_state").inc(sent)
+        self.membership_changed(local=True)
+
+    async def signed_data_handler_hello_server(self, websocket: ServerConnection, message: OlafMessage) -> None:
         """
         Handles the 'hello_server' message
         """
-        signed_data = message['data']
-        counter = message['counter']
+        signed_data = message.data
+        counter = message.counter
         public_key = "default_key"
         server_addr = signed_data['sender']
 
@@ -628,48 +1354,105 @@ class WebSocketServer():
             server_addr = server_addr[6:]
 
         connection = self.existing_connection(websocket)
+        capabilities = parse_capabilities(signed_data)
 
         if not connection:            
             neighbour_connection = OlafServerConnection(websocket, server_addr, public_key)
             neighbour_connection.counter = counter
+            self.set_neighbour_capabilities(neighbour_connection, capabilities)
             self.neighbour_connections.add(neighbour_connection)
 
             self.logger.info(f"Successfully added neighbour {server_addr}")
-        else:
+            if capabilities:
+                # Tell a server that negotiates what this one supports. Stock
+                # servers only expect a server_hello on links they accept.
+                await neighbour_connection.send_frame(await self.build_server_hello())
+            await self.neighbour_added(neighbour_connection)
+        elif isinstance(connection, OlafServerConnection):
             if counter <= connection.counter:
                 # Message is a replay
                 await self.disconnect(websocket)
                 return
-            self.logger.warning(f"Neighbour {connection.server_addr} is sending a hello_server message with a counter > 1.")
+            # Answer to the server_hello sent on a link this server opened
+            connection.counter = counter
+            self.set_neighbour_capabilities(connection, capabilities)
+            self.logger.info(f"Neighbour {connection.server_addr} supports {capabilities_field(capabilities)}")
+            await self.neighbour_added(connection)
         
 
-    def build_signed_data(self, data: dict) -> dict:
+    def server_capabilities(self) -> frozenset:
         """
-        Build a signed message with the given data
+        Returns the protocol extensions this server advertises to neighbours, and to clients that advertise theirs.
         """
-        message = {
-            "data": data,
-            "counter": self.counter
-        }
+        capabilities = {CAP_LIST_DIGEST, CAP_KEY_REQUEST, CAP_RELAY_IDS, CAP_GROUPS, CAP_LOAD_REPORT}
+        if self.batching.enabled:
+            capabilities.add(CAP_BATCH)
+        if self.binary_chat:
+            capabilities.add(CAP_BINARY_CHAT)
+        if self.overlay_routing:
+            capabilities.add(CAP_LINK_STATE)
+        return frozenset(capabilities)
+
+    def client_address(self) -> str:
+        """
+        Returns the host:port clients connect to this server at.
+        """
+        return f"{self.external_address}:{self.port}"
+
+    def local_load_report(self) -> dict:
+        """
+        Measures this server's load and returns it as a load_report.
+        """
+        return self.load_balancer.update_local(self.client_address(), int(self.http_port), len(self.clients),
+                                               sum(self.send_buffer_sizes().values()),
+                                               int(self.loop_lag_monitor.lag * 1000))
 
-        message_str = json.dumps(message, separators=(',', ':'), sort_keys=True)
-        message_bytes = message_str.encode('utf-8')
+    async def report_load(self) -> None:
+        """
+        Sends this server's load to the neighbours that take load reports, every report interval.
+        """
+        while True:
+            await asyncio.sleep(self.load_balancer.interval)
+            neighbours = [neighbour for neighbour in self.neighbour_connections if CAP_LOAD_REPORT in neighbour.capabilities]
+            report = self.local_load_report()
+            if neighbours:
+                await self.fan_out(neighbours, codec.encode(report), "load_report")
+
+    def load_report_handler(self, websocket: ServerConnection, message: OlafMessage) -> None:
+        """
+        Records the load of a neighbour.
+        """
+        if not isinstance(self.existing_connection(websocket), OlafServerConnection):
+            self.logger.warning("load_report received from a connection that is not a neighbour")
+            return
+        if not self.load_balancer.apply(message.raw):
+            self.logger.warning(f"Ignored malformed load_report from {message.raw['server']}")
+
+    def set_neighbour_capabilities(self, connection: OlafServerConnection, capabilities: frozenset) -> None:
+        connection.capabilities = capabilities
+        if self.batching.enabled and CAP_BATCH in capabilities:
+            connection.enable_batching(self.batching, self.record_batch)
+
+    async def build_signed_data(self, data: dict) -> str | bytes:
+        """
+        Build a signed message with the given data, encoded as a frame.
+
+        data is encoded once. The same bytes are signed and embedded in the
+        frame. The signature is computed off the event loop with the loaded
+        private key.
+        """
+        data_json = codec.canonical(data)
+        counter = self.counter
+        message_bytes = codec.signing_payload(data_json, counter)
 
         # Sign the message
-        signature = self.encryption.sign_message(message_bytes, self.private_pem)
+        signature = await self.crypto.sign(message_bytes, self.private_key)
         signature_base64 = base64.b64encode(signature).decode('utf-8')
 
         # Prepare the signed message
-        signed_data = {
-            "type": "signed_data",
-            "data": data,
-            "counter": self.counter,
-            "signature": signature_base64
-        }
-
-        return signed_data
+        return codec.signed_frame(data_json, counter, signature_base64)
     
-    def build_server_hello(self):
+    async def build_server_hello(self):
         """
         Send a hello message to the server.
         
@@ -680,10 +1463,12 @@ class WebSocketServer():
         
         message_data = {
             "type": "server_hello",
-            "sender": f"{self.host}:{self.port}"  
+            "sender": f"{self.host}:{self.port}",
+            # Stock servers ignore fields they do not know
+            "capabilities": capabilities_field(self.server_capabilities())
         }
 
-        server_hello = self.build_signed_data(message_data)
+        server_hello = await self.build_signed_data(message_data)
 
         return server_hello
 
@@ -692,7 +1477,8 @@ class WebSocketServer():
         Connects to another server
         """
         try:
-            websocket = await websockets.connect(f"ws://{server_addr}")
+            websocket = await websockets.connect(f"ws://{server_addr}", max_size=self.frame_limits.max_neighbour_frame_size,
+                                               compression=None, extensions=self.compression.client_extensions())
         
             if 'ws://' in server_addr:
                 base_server_addr = server_addr[5:]
@@ -711,21 +1497,22 @@ class WebSocketServer():
             self.neighbour_connections.add(neighbour_connection)
             
             # Send server_hello upon established connection
-            server_hello = self.build_server_hello()
+            server_hello = await self.build_server_hello()
             client_update_request = {
                 "type" : "client_update_request"
             }
 
-            await neighbour_connection.send(server_hello)
+            await neighbour_connection.send_frame(server_hello)
             await neighbour_connection.send(client_update_request)
 
             self.logger.info(f"New neighbour added: {neighbour_connection.server_addr}")
             asyncio.ensure_future(self.recv_from_server(websocket))
+            await self.neighbour_added(neighbour_connection)
 
         except Exception as e:
             self.logger.error(f"Failed to connect to {server_addr}: {e}", exc_info=True)
             # Wait 5 secs before trying again.
-            time.sleep(5)
+            await asyncio.sleep(5)
             await self.connect_to_server(server_addr, public_key)
 
     async def recv_from_server(self, websocket: ServerConnection) -> None:
@@ -734,27 +1521,39 @@ class WebSocketServer():
         """
         try: 
             async for message in websocket:
-                try:
-                    data = json.loads(message)
-                    await self.handler(websocket, data)
-                except json.JSONDecodeError:
-                    self.logger.error(f"Unkown Message Format: { message }. Unable to handle message")
+                data, error = self.decode_frame(websocket, message)
+                if error:
+                    self.logger.error(f"Unable to handle message from neighbour: {error}")
+                    continue
+                await self.submit_message(websocket, data, message)
         except Exception as e:
             self.logger.error(f"Exception occured: {e}")
         finally:
-            await self.disconnect(websocket)
+            await self.scheduler.submit(websocket, self.disconnect, websocket, last=True)
 
     async def start_server(self) -> None:
         """
         Start the websocket server
         """
 
-        self.server = await serve(self.recv, self.bind_address, self.port, ping_interval=20, ping_timeout=10)
+        self.private_key, self.public_key = await self.load_keys()
+        await self.load_groups()
+
+        self.scheduler.start()
+        self.loop_lag_monitor.start()
+        self.tracer.start()
+        self.local_load_report()
+        self.load_report_task = asyncio.ensure_future(self.report_load())
+        self.server = await serve(self.recv, self.bind_address, self.port, ping_interval=20, ping_timeout=10, max_size=self.frame_limits.max_frame_size,
+                                  compression=None, extensions=self.compression.server_extensions())
 
-        app = web.Application()
+        app = web.Application(middlewares=[self.tracer.middleware])
         app.router.add_post('/api/upload', self.handle_file_upload)
         app.router.add_get('/files/{filename}', self.handle_file_download)
         app.router.add_get('/files', self.handle_file_list)
+        app.router.add_get('/metrics', self.handle_metrics)
+        app.router.add_get('/debug/slow', self.handle_debug_slow)
+        app.router.add_get('/api/servers', self.handle_server_list)
         
         runner = web.AppRunner(app)
         await runner.setup()
@@ -774,8 +1573,8 @@ class WebSocketServer():
         """
         # Wait for servers to start up
         self.logger.info("Waiting 5 secs for servers to start up.")
-        time.sleep(5)
-        self.load_neighbour_keys()
+        await asyncio.sleep(5)
+        await self.load_neighbour_keys()
         for neighbour_addr, neighbour_public_key in self.neighbours.items():
             self.logger.info(f"Scheduling connection to {neighbour_addr}...")
             await self.connect_to_server(neighbour_addr,neighbour_public_key)
@@ -795,43 +1594,100 @@ class WebSocketServer():
         size = 0
 
         filepath = os.path.join(UPLOAD_DIR, filename)
-        with open(filepath, 'wb') as f:
+        writer = await self.file_io.open_writer(filepath)
+        try:
             while True:
                 chunk = await field.read_chunk()
                 if not chunk:
                     break
                 size += len(chunk)
                 if size > max_file_size:
-                    os.remove(filepath)
+                    await writer.abort()
+                    self.file_cache.invalidate(filepath)
                     return web.json_response({'error': 'File size exceeds limit'}, status=413)
-                f.write(chunk)
+                await writer.write(chunk)
+        except BaseException:
+            await asyncio.shield(writer.abort())
+            self.file_cache.invalidate(filepath)
+            raise
+        await writer.close()
+        self.file_cache.invalidate(filepath)
+
+        self.metrics.upload_bytes.inc(size)
 
         # The file URL must use env var since our client is not dockerised.
-        file_url = f"http://{EXTERNAL_ADDRESS}:{self.http_port}/files/{filename}"
+        file_url = f"http://{self.external_address}:{self.http_port}/files/{filename}"
         return web.json_response({'file_url': file_url})
     
     async def handle_file_download(self, request):
         """
         Serve filename 
+
+        Small files are served from memory, compressed if the client accepts it
+        and the file is compressible. Larger ones are sent as they are with sendfile.
         """
         filename = request.match_info['filename']
         filepath = os.path.join(UPLOAD_DIR, filename)
-        if not os.path.exists(filepath):
+        entry = await self.file_cache.get(filepath)
+        if entry is None:
             return web.HTTPNotFound()
 
-        # Serve the file as an HTTP response
-        return web.FileResponse(filepath)
+        if entry.body is None:
+            self.file_cache.served(entry)
+            self.metrics.download_bytes.inc(entry.size)
+            return web.FileResponse(filepath, headers=entry.headers)
+
+        body, headers = entry.body, entry.headers
+        encoding = choose_encoding(request.headers.get('Accept-Encoding', '')) if entry.compressible else None
+        variant = await self.file_cache.variant(entry, encoding) if encoding else None
+        if variant is not None:
+            body = variant
+            headers = dict(headers, **{'Content-Encoding': encoding, 'ETag': f'{entry.etag[:-1]}-{encoding}"'})
+
+        if headers['ETag'] in request.headers.get('If-None-Match', ''):
+            return web.Response(status=304, headers=headers)
+
+        self.file_cache.served(entry, len(body) if variant is not None else None)
+        self.metrics.download_bytes.inc(len(body))
+        return web.Response(body=body, headers=headers)
     
     async def handle_file_list(self, request):
         """
         Logbook of uploaded files
         """
-        files = os.listdir(UPLOAD_DIR)  
+        files = await self.file_io.listdir(UPLOAD_DIR)
         files.sort()  
 
         # Create a JSON response with the list of files
         return web.json_response({'files': files})
 
+    async def handle_metrics(self, request):
+        """
+        Metrics in the Prometheus text exposition format
+        """
+        body = self.metrics.registry.render()
+        return web.Response(body=body.encode('utf-8'), headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    async def handle_server_list(self, request):
+        """
+        The least loaded server for a new client to connect to, and the load of this server and its neighbours
+        """
+        recommended = self.load_balancer.recommend()
+        return web.json_response({
+            'recommended': recommended.summary() if recommended is not None else None,
+            'servers': [report.summary() for report in self.load_balancer.current()],
+        })
+
+    async def handle_debug_slow(self, request):
+        """
+        Slowest recent handlers, routes and event loop stalls
+        """
+        try:
+            limit = int(request.query.get('limit', 20))
+        except ValueError:
+            return web.json_response({'error': 'limit must be an integer'}, status=400)
+        return web.json_response({'operations': self.tracer.slowest(limit)})
+
 
 if __name__ == "__main__":
 
@@ -851,7 +1707,6 @@ if __name__ == "__main__":
     HTTP_PORT = os.getenv('HTTP_PORT')
     BIND_ADDRESS = os.getenv('BIND_ADDRESS', '0.0.0.0')
     HOST = os.getenv('HOST')
-    EXTERNAL_ADDRESS = os.getenv('EXTERNAL_ADDRESS')
  
     ws_server_1 = WebSocketServer(bind_address=BIND_ADDRESS, host=HOST, ws_port=WS_PORT, http_port=HTTP_PORT, neighbours_list=NEIGHBOURS)
     
@@ -0,0 +1,209 @@
+import asyncio
+import mimetypes
+import os
+import stat
+import time
+from collections import OrderedDict
+from email.utils import formatdate
+
+from protocol.compression import is_compressible, compress_body
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_FILE_SIZE = 1024 * 1024
+DEFAULT_REVALIDATE_AFTER = 5.0
+
+# A compressed variant is only kept if it is at most this share of the original.
+MIN_COMPRESSION_RATIO = 0.9
+
+
+class CachedFile():
+    """
+    A file ready to be served: its response headers, and its contents if it is
+    small enough to be kept in memory (body is None for files served from disk).
+
+    variants holds the body compressed per content encoding, or None for an
+    encoding that did not make it smaller.
+    """
+    __slots__ = ('path', 'size', 'mtime_ns', 'etag', 'headers', 'body', 'checked', 'compressible', 'variants')
+
+    def __init__(self, path: str, st: os.stat_result, body: bytes | None, checked: float):
+        self.path = path
+        self.size = st.st_size
+        self.mtime_ns = st.st_mtime_ns
+        self.etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+        content_type, encoding = mimetypes.guess_type(path)
+        if content_type is None or encoding is not None:
+            # Compressed files are downloaded as they are, not decoded by the browser.
+            content_type = 'application/octet-stream'
+        self.headers = {
+            'Content-Type': content_type,
+            'ETag': self.etag,
+            'Last-Modified': formatdate(st.st_mtime, usegmt=True),
+            'Cache-Control': 'public, max-age=60',
+        }
+        self.body = body
+        self.checked = checked
+        self.compressible = body is not None and is_compressible(path)
+        if self.compressible:
+            self.headers['Vary'] = 'Accept-Encoding'
+        self.variants = {}
+
+    @property
+    def cached_bytes(self) -> int:
+        if self.body is None:
+            return 0
+        return len(self.body) + sum(len(variant) for variant in self.variants.values() if variant is not None)
+
+
+class FileCache():
+    """
+    LRU of recently downloaded files.
+
+    Files up to max_file_size are kept in memory, evicting the least recently
+    used ones once max_bytes is exceeded. Larger files only keep their headers
+    and are sent from disk with sendfile. Entries are dropped when a file is
+    uploaded again, and re-checked against the disk at most every
+    revalidate_after seconds. Concurrent misses for the same file share one read.
+    """
+    def __init__(self, file_io, max_bytes: int = DEFAULT_MAX_BYTES, max_file_size: int = DEFAULT_MAX_FILE_SIZE,
+                 revalidate_after: float = DEFAULT_REVALIDATE_AFTER):
+        self.file_io = file_io
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.revalidate_after = revalidate_after
+
+        # { path : CachedFile }, least recently used first
+        self.entries = OrderedDict()
+        self.loading = {}
+        self.cached_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.served_bytes = {"memory": 0, "compressed": 0, "sendfile": 0}
+
+    @classmethod
+    def from_env(cls, file_io) -> "FileCache":
+        """
+        Builds a cache from FILE_CACHE_MAX_BYTES, FILE_CACHE_MAX_FILE_SIZE and FILE_CACHE_REVALIDATE_AFTER.
+        """
+        return cls(
+            file_io,
+            max_bytes=int(os.getenv('FILE_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)),
+            max_file_size=int(os.getenv('FILE_CACHE_MAX_FILE_SIZE', DEFAULT_MAX_FILE_SIZE)),
+            revalidate_after=float(os.getenv('FILE_CACHE_REVALIDATE_AFTER', DEFAULT_REVALIDATE_AFTER)),
+        )
+
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    async def get(self, path: str) -> CachedFile | None:
+        """
+        Returns the cached file for path, loading it on a miss.
+
+        Returns:
+            The CachedFile, or None if path is not a regular file.
+        """
+        entry = self.entries.get(path)
+        if entry is not None and time.monotonic() - entry.checked < self.revalidate_after:
+            self.entries.move_to_end(path)
+            self.hits += 1
+            return entry
+
+        loading = self.loading.get(path)
+        if loading is not None:
+            self.hits += 1
+            return await asyncio.shield(loading)
+
+        self.misses += 1
+        future = self.loading[path] = asyncio.ensure_future(self.load(path, entry))
+        return await asyncio.shield(future)
+
+    async def load(self, path: str, previous: CachedFile | None) -> CachedFile | None:
+        try:
+            try:
+                st = await self.file_io.stat(path)
+            except OSError:
+                self.invalidate(path)
+                return None
+            if not stat.S_ISREG(st.st_mode):
+                self.invalidate(path)
+                return None
+
+            now = time.monotonic()
+            if previous is not None and previous.mtime_ns == st.st_mtime_ns and previous.size == st.st_size:
+                # Unchanged on disk
+                previous.checked = now
+                if path in self.entries:
+                    self.entries.move_to_end(path)
+                return previous
+
+            body = None
+            if st.st_size <= self.max_file_size:
+                body = await self.file_io.read_bytes(path)
+                if len(body) != st.st_size:
+                    # Written to while being read, serve it from disk and do not keep it.
+                    self.invalidate(path)
+                    return CachedFile(path, st, None, now)
+
+            entry = CachedFile(path, st, body, now)
+            if self.loading.get(path) is asyncio.current_task():
+                # Not invalidated while loading
+                self.store(path, entry)
+            return entry
+        finally:
+            if self.loading.get(path) is asyncio.current_task():
+                del self.loading[path]
+
+    async def variant(self, entry: CachedFile, encoding: str) -> bytes | None:
+        """
+        Returns the body of entry compressed with encoding, compressing it once on the I/O pool.
+
+        Returns:
+            The compressed body, or None if the file is not worth compressing.
+        """
+        if not entry.compressible:
+            return None
+        if encoding in entry.variants:
+            return entry.variants[encoding]
+
+        compressed = await self.file_io.run(compress_body, entry.body, encoding)
+        if len(compressed) > len(entry.body) * MIN_COMPRESSION_RATIO:
+            compressed = None
+        if encoding not in entry.variants:
+            entry.variants[encoding] = compressed
+            if compressed is not None and self.entries.get(entry.path) is entry:
+                self.cached_bytes += len(compressed)
+        return entry.variants[encoding]
+
+    def store(self, path: str, entry: CachedFile) -> None:
+        self.invalidate(path)
+        self.entries[path] = entry
+        self.cached_bytes += entry.cached_bytes
+
+        while self.cached_bytes > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.cached_bytes -= evicted.cached_bytes
+            self.evictions += 1
+
+    def invalidate(self, path: str) -> None:
+        """
+        Drops path from the cache, e.g. after it has been uploaded again.
+        A load of path in progress is not stored.
+        """
+        self.loading.pop(path, None)
+        entry = self.entries.pop(path, None)
+        if entry is not None:
+            self.cached_bytes -= entry.cached_bytes
+
+    def served(self, entry: CachedFile, size: int | None = None) -> None:
+        """
+        Counts entry as served once, size bytes on the wire if it was sent compressed.
+        """
+        if entry.body is None:
+            self.served_bytes["sendfile"] += entry.size
+        elif size is None:
+            self.served_bytes["memory"] += entry.size
+        else:
+            self.served_bytes["compressed"] += size
@@ -0,0 +1,157 @@
+import asyncio
+import functools
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_PENDING = 64
+DEFAULT_WRITE_BATCH_SIZE = 256 * 1024
+
+
+class FileIO():
+    """
+    Runs the server's filesystem work on a dedicated thread pool.
+
+    The event loop only hands work over and awaits the result, so a slow or
+    networked volume delays the request that touches it rather than every
+    websocket on the server. At most max_pending operations are queued for the
+    pool at once; callers past that wait on the loop without holding a thread.
+    """
+    def __init__(self, workers: int = DEFAULT_WORKERS, max_pending: int = DEFAULT_MAX_PENDING,
+                 write_batch_size: int = DEFAULT_WRITE_BATCH_SIZE, logger: logging.Logger | None = None):
+        self.workers = workers
+        self.write_batch_size = write_batch_size
+        self.logger = logger or logging.getLogger(__name__)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="file-io")
+        self.slots = asyncio.Semaphore(max_pending)
+        self.pending = 0
+
+    @classmethod
+    def from_env(cls, logger: logging.Logger | None = None) -> "FileIO":
+        """
+        Builds a FileIO from FILE_IO_WORKERS, FILE_IO_MAX_PENDING and UPLOAD_WRITE_BATCH_SIZE.
+        """
+        return cls(
+            workers=int(os.getenv('FILE_IO_WORKERS', DEFAULT_WORKERS)),
+            max_pending=int(os.getenv('FILE_IO_MAX_PENDING', DEFAULT_MAX_PENDING)),
+            write_batch_size=int(os.getenv('UPLOAD_WRITE_BATCH_SIZE', DEFAULT_WRITE_BATCH_SIZE)),
+            logger=logger,
+        )
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, function, *args, **kwargs):
+        """
+        Runs a blocking function on the pool and returns its result.
+        """
+        async with self.slots:
+            self.pending += 1
+            try:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self.executor, functools.partial(function, *args, **kwargs))
+            finally:
+                self.pending -= 1
+
+    async def read_bytes(self, path: str) -> bytes:
+        return await self.run(read_bytes, path)
+
+    async def write_bytes(self, path: str, data: bytes) -> None:
+        await self.run(write_bytes, path, data)
+
+    async def listdir(self, path: str) -> list:
+        return await self.run(os.listdir, path)
+
+    async def stat(self, path: str) -> os.stat_result:
+        return await self.run(os.stat, path)
+
+    async def exists(self, path: str) -> bool:
+        return await self.run(os.path.exists, path)
+
+    async def remove(self, path: str) -> None:
+        await self.run(os.remove, path)
+
+    async def open_writer(self, path: str) -> "BatchedWriter":
+        """
+        Opens path for writing through a BatchedWriter.
+        """
+        f = await self.run(open, path, 'wb')
+        return BatchedWriter(self, f, self.write_batch_size)
+
+
+def read_bytes(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def write_bytes(path: str, data: bytes) -> None:
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def write_chunks(f, chunks: list) -> None:
+    f.writelines(chunks)
+
+
+class BatchedWriter():
+    """
+    Collects chunks in memory and writes them to the file on the pool in batches.
+
+    One batch is written while the next is being collected, so a slow disk and
+    a slow uploader overlap instead of adding up.
+    """
+    def __init__(self, file_io: FileIO, f, batch_size: int):
+        self.file_io = file_io
+        self.file = f
+        self.batch_size = batch_size
+        self.chunks = []
+        self.buffered = 0
+        self.writing = None
+        self.size = 0
+        self.closed = False
+
+    async def write(self, chunk: bytes) -> None:
+        self.chunks.append(chunk)
+        self.buffered += len(chunk)
+        self.size += len(chunk)
+        if self.buffered >= self.batch_size:
+            await self.flush()
+
+    async def flush(self) -> None:
+        """
+        Waits for the batch being written, then starts writing the collected chunks.
+        """
+        if self.writing is not None:
+            await self.writing
+            self.writing = None
+        if self.chunks:
+            chunks, self.chunks, self.buffered = self.chunks, [], 0
+            self.writing = asyncio.ensure_future(self.file_io.run(write_chunks, self.file, chunks))
+
+    async def close(self) -> None:
+        """
+        Writes everything still buffered and closes the file.
+        """
+        try:
+            await self.flush()
+            if self.writing is not None:
+                await self.writing
+                self.writing = None
+        finally:
+            self.closed = True
+            await self.file_io.run(self.file.close)
+
+    async def abort(self) -> None:
+        """
+        Drops buffered chunks, closes the file and removes it.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.chunks = []
+        if self.writing is not None:
+            await asyncio.gather(self.writing, return_exceptions=True)
+            self.writing = None
+        await self.file_io.run(self.file.close)
+        await self.file_io.remove(self.file.name)
@@ -0,0 +1,197 @@
+import os
+import re
+
+from protocol.envelope import is_envelope
+from message_schema import MESSAGE_SCHEMAS, DATA_SCHEMAS
+
+# Largest frame the websocket layer will accept at all. Neighbour links carry
+# everyone's traffic (client_update, relayed chats) so they get the most room.
+DEFAULT_MAX_NEIGHBOUR_FRAME_SIZE = 4 * 1024 * 1024
+DEFAULT_MAX_CLIENT_FRAME_SIZE = 1024 * 1024
+
+# Per message type frame size limits. For signed_data the key is the signed
+# payload type.
+DEFAULT_TYPE_LIMITS = {
+    "client_list_request": 1024,
+    "client_update_request": 1024,
+    "client_update": DEFAULT_MAX_NEIGHBOUR_FRAME_SIZE,
+    "client_list": DEFAULT_MAX_NEIGHBOUR_FRAME_SIZE,
+    "key_request": 32 * 1024,
+    "key_response": DEFAULT_MAX_CLIENT_FRAME_SIZE,
+    "link_state": DEFAULT_MAX_NEIGHBOUR_FRAME_SIZE,
+    "group_join": 1024,
+    "group_leave": 1024,
+    "group_update": DEFAULT_MAX_NEIGHBOUR_FRAME_SIZE,
+    "load_report": 4 * 1024,
+    "batch": DEFAULT_MAX_NEIGHBOUR_FRAME_SIZE,
+    "hello": 8 * 1024,
+    "server_hello": 4 * 1024,
+    "public_chat": 128 * 1024,
+    "chat": DEFAULT_MAX_CLIENT_FRAME_SIZE,
+}
+
+# Only the start of the frame is inspected. Standard OLAF senders put "type"
+# first, followed by "data" for signed_data, so this is enough to route them.
+PRESCAN_WINDOW = 256
+
+_TYPE_PREFIX = r'^\s*\{\s*"type"\s*:\s*"(?P<type>[^"\\]{0,64})"(?:\s*,\s*"data"\s*:\s*\{\s*"type"\s*:\s*"(?P<data_type>[^"\\]{0,64})")?'
+_TYPE_PREFIX_STR = re.compile(_TYPE_PREFIX)
+_TYPE_PREFIX_BYTES = re.compile(_TYPE_PREFIX.encode('ascii'))
+
+
+def prescan_type(frame: str | bytes) -> tuple:
+    """
+    Reads the message type from the start of a raw frame without decoding it.
+
+    Returns:
+        tuple of (type, data_type). Both are None when the frame does not start
+        with a "type" field; data_type is None unless a nested signed payload
+        type directly follows. Binary chat envelopes are signed chats.
+    """
+    if is_envelope(frame):
+        return "signed_data", "chat"
+    if isinstance(frame, str):
+        match = _TYPE_PREFIX_STR.match(frame, 0, PRESCAN_WINDOW)
+        if match is None:
+            return None, None
+        return match.group('type'), match.group('data_type')
+
+    match = _TYPE_PREFIX_BYTES.match(frame, 0, PRESCAN_WINDOW)
+    if match is None:
+        return None, None
+    data_type = match.group('data_type')
+    return match.group('type').decode('ascii', 'replace'), data_type.decode('ascii', 'replace') if data_type is not None else None
+
+
+def parse_type_limits(value: str | None) -> dict:
+    """
+    Parses per-type overrides of the form "public_chat=65536,chat=524288".
+    """
+    limits = {}
+    if not value:
+        return limits
+
+    for entry in value.split(','):
+        name, _, size = entry.partition('=')
+        if name.strip() and size.strip():
+            limits[name.strip()] = int(size)
+    return limits
+
+
+class FrameLimits():
+    """
+    Size limits applied to incoming frames before they are JSON decoded.
+
+    Rejections are counted per reason, both as frames and bytes.
+    """
+    def __init__(self, max_client_frame_size: int = DEFAULT_MAX_CLIENT_FRAME_SIZE,
+                 max_neighbour_frame_size: int = DEFAULT_MAX_NEIGHBOUR_FRAME_SIZE,
+                 type_limits: dict | None = None):
+        self.max_client_frame_size = max_client_frame_size
+        self.max_neighbour_frame_size = max_neighbour_frame_size
+        self.type_limits = dict(DEFAULT_TYPE_LIMITS)
+        if type_limits:
+            self.type_limits.update(type_limits)
+
+        self.rejected_frames = {}
+        self.rejected_bytes = {}
+
+    @classmethod
+    def from_env(cls) -> "FrameLimits":
+        """
+        Builds limits from MAX_CLIENT_FRAME_SIZE, MAX_NEIGHBOUR_FRAME_SIZE and FRAME_TYPE_LIMITS.
+        """
+        return cls(
+            max_client_frame_size=int(os.getenv('MAX_CLIENT_FRAME_SIZE', DEFAULT_MAX_CLIENT_FRAME_SIZE)),
+            max_neighbour_frame_size=int(os.getenv('MAX_NEIGHBOUR_FRAME_SIZE', DEFAULT_MAX_NEIGHBOUR_FRAME_SIZE)),
+            type_limits=parse_type_limits(os.getenv('FRAME_TYPE_LIMITS')),
+        )
+
+    @property
+    def max_frame_size(self) -> int:
+        """
+        Limit enforced by the websocket layer, before a connection is identified.
+        """
+        return max(self.max_client_frame_size, self.max_neighbour_frame_size)
+
+    def record_rejection(self, reason: str, size: int) -> None:
+        """
+        Counts a rejected frame.
+        """
+        self.rejected_frames[reason] = self.rejected_frames.get(reason, 0) + 1
+        self.rejected_bytes[reason] = self.rejected_bytes.get(reason, 0) + size
+
+    def check_frame(self, frame: str | bytes, is_neighbour: bool) -> tuple:
+        """
+        Checks a raw frame against the connection and message type limits.
+
+        Args:
+            frame: the frame as returned by websocket.recv()
+            is_neighbour: whether the frame came from an established neighbour
+
+        Returns:
+            tuple of (message_type, error). message_type is the pre-scanned type
+            (the signed payload type for signed_data) or None if the frame has to
+            be decoded to find out. error is None if the frame may be decoded.
+        """
+        size = len(frame)
+        connection_limit = self.max_neighbour_frame_size if is_neighbour else self.max_client_frame_size
+        if size > connection_limit:
+            self.record_rejection("connection_limit", size)
+            return None, "Message exceeds connection size limit."
+
+        message_type, data_type = prescan_type(frame)
+        if message_type is None:
+            return None, None
+
+        if message_type not in MESSAGE_SCHEMAS:
+            self.record_rejection("unknown_type", size)
+            return None, "Message does not fit OLAF Protocol standard."
+
+        if message_type == "signed_data":
+            if data_type is None:
+                return None, None
+            if data_type not in DATA_SCHEMAS:
+                self.record_rejection("unknown_type", size)
+                return None, "Message does not fit OLAF Protocol standard."
+            message_type = data_type
+
+        return message_type, self.check_type_size(message_type, size)
+
+    def check_decoded_type(self, message_type: str, message, size: int) -> str | None:
+        """
+        Checks that a decoded frame has the type it was pre-scanned as. JSON
+        decoders keep the last of repeated keys, so a frame starting with
+        another "type" than the one it is handled as is rejected, rather than
+        being held to that type's limits.
+        """
+        if message_type_of(message) != message_type:
+            self.record_rejection("type_mismatch", size)
+            return "Message type does not match the start of the frame."
+        return None
+
+    def check_type_size(self, message_type: str | None, size: int) -> str | None:
+        """
+        Checks a frame size against the limit for its message type.
+        """
+        if message_type is None:
+            return None
+        limit = self.type_limits.get(message_type)
+        if limit is not None and size > limit:
+            self.record_rejection("type_limit", size)
+            return f"Message exceeds size limit for {message_type}."
+        return None
+
+
+def message_type_of(message: dict) -> str | None:
+    """
+    Returns the type a decoded message is limited by: the signed payload type for
+    signed_data, the top-level type otherwise.
+    """
+    if type(message) is not dict:
+        return None
+    message_type = message.get("type")
+    if message_type == "signed_data":
+        data = message.get("data")
+        message_type = data.get("type") if type(data) is dict else None
+    return message_type if type(message_type) is str else None
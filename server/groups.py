@@ -0,0 +1,227 @@
+import json
+import os
+import time
+from typing import NamedTuple
+
+DEFAULT_MAX_GROUPS = 4096
+DEFAULT_MAX_GROUP_MEMBERS = 1024
+MAX_GROUP_NAME_LENGTH = 64
+MAX_MEMBER_LENGTH = 64
+
+
+def valid_group_name(name) -> bool:
+    return type(name) is str and 0 < len(name) <= MAX_GROUP_NAME_LENGTH and name.isprintable()
+
+
+class GroupState(NamedTuple):
+    """
+    The latest group_update a server sent: the members it holds, per group.
+    """
+    version: int
+    groups: dict
+
+
+class GroupDirectory():
+    """
+    Named groups of clients, by fingerprint, and who is in them across the neighbourhood.
+
+    Each server holds the memberships of the clients that joined through it
+    and tells the other servers with group_update messages, so every server
+    knows the members of every group. A client that connects to another
+    server takes its memberships along: the new server claims them, and the
+    old one releases them once it sees them claimed. Memberships outlive
+    connections, and offline members are kept in their groups.
+    """
+    def __init__(self, server_name: str, max_groups: int = DEFAULT_MAX_GROUPS,
+                 max_members: int = DEFAULT_MAX_GROUP_MEMBERS):
+        self.server_name = server_name
+        self.max_groups = max_groups
+        self.max_members = max_members
+
+        # { group : set of fingerprints } joined through this server
+        self.local = {}
+        # { server name : GroupState }
+        self.states = {}
+        # Versions start at the clock so they keep increasing across restarts
+        self.version = int(time.time() * 1000)
+        # { group : frozenset of fingerprints } of the whole neighbourhood, rebuilt after changes
+        self.index = None
+
+    @classmethod
+    def from_env(cls, server_name: str) -> "GroupDirectory":
+        """
+        Reads MAX_GROUPS and MAX_GROUP_MEMBERS.
+        """
+        return cls(
+            server_name,
+            max_groups=int(os.getenv('MAX_GROUPS', DEFAULT_MAX_GROUPS)),
+            max_members=int(os.getenv('MAX_GROUP_MEMBERS', DEFAULT_MAX_GROUP_MEMBERS)),
+        )
+
+    def groups(self) -> dict:
+        """
+        Returns { group : frozenset of fingerprints } of every group on every server.
+        """
+        if self.index is None:
+            index = {group: set(members) for group, members in self.local.items()}
+            for state in self.states.values():
+                for group, members in state.groups.items():
+                    index.setdefault(group, set()).update(members)
+            self.index = {group: frozenset(members) for group, members in index.items() if members}
+        return self.index
+
+    def members(self, group: str) -> frozenset:
+        """
+        Returns the members of a group on every server.
+        """
+        return self.groups().get(group, frozenset())
+
+    def groups_of(self, fingerprint: str) -> list:
+        """
+        Returns the groups a client is a member of.
+        """
+        return [group for group, members in self.groups().items() if fingerprint in members]
+
+    def join(self, group: str, fingerprint: str) -> bool:
+        """
+        Adds a client to a group, creating the group if needed.
+
+        Returns:
+            False if this server held the membership already.
+
+        Raises:
+            ValueError if the group name is invalid or the group or directory is full.
+        """
+        if not valid_group_name(group):
+            raise ValueError("Invalid group name.")
+        if fingerprint in self.local.get(group, ()):
+            return False
+        members = self.members(group)
+        if fingerprint not in members:
+            if len(members) >= self.max_members:
+                raise ValueError("Group is full.")
+            if not members and len(self.groups()) >= self.max_groups:
+                raise ValueError("Too many groups.")
+
+        self.local.setdefault(group, set()).add(fingerprint)
+        self.index = None
+        return True
+
+    def leave(self, group: str, fingerprint: str) -> bool:
+        """
+        Removes a client from a group.
+
+        Returns:
+            False if this server did not hold the membership.
+        """
+        members = self.local.get(group)
+        if members is None or fingerprint not in members:
+            return False
+        members.discard(fingerprint)
+        if not members:
+            del self.local[group]
+        self.index = None
+        return True
+
+    def claim(self, fingerprint: str) -> list:
+        """
+        Takes over the memberships other servers hold for a client that connected here.
+
+        Returns:
+            The groups claimed.
+        """
+        claimed = [group for group in self.groups_of(fingerprint) if fingerprint not in self.local.get(group, ())]
+        for group in claimed:
+            self.local.setdefault(group, set()).add(fingerprint)
+        if claimed:
+            self.index = None
+        return claimed
+
+    def release(self, server: str, connected) -> bool:
+        """
+        Drops the memberships server now holds too, of clients not connected here.
+
+        Returns:
+            True if any membership was dropped.
+        """
+        state = self.states.get(server)
+        if state is None:
+            return False
+        released = False
+        for group, members in state.groups.items():
+            local = self.local.get(group)
+            if local is None:
+                continue
+            moved = {fingerprint for fingerprint in members if fingerprint in local and fingerprint not in connected}
+            if moved:
+                local -= moved
+                if not local:
+                    del self.local[group]
+                released = True
+        if released:
+            self.index = None
+        return released
+
+    def originate(self) -> dict:
+        """
+        Returns the group_update message listing this server's memberships.
+        """
+        self.version = max(self.version + 1, int(time.time() * 1000))
+        return {
+            "type" : "group_update",
+            "server" : self.server_name,
+            "version" : self.version,
+            "groups" : [{"group": group, "members": sorted(members)} for group, members in sorted(self.local.items())]
+        }
+
+    def apply(self, message: dict) -> set | None:
+        """
+        Records a group_update received from a neighbour. Malformed entries are skipped.
+
+        Returns:
+            The groups whose members changed, or None if the update is not
+            newer than what was known about its server and is to be ignored.
+        """
+        server = message["server"]
+        version = message["version"]
+        if server == self.server_name:
+            return None
+        current = self.states.get(server)
+        if current is not None and version <= current.version:
+            return None
+
+        groups = {}
+        for entry in message["groups"][:self.max_groups]:
+            group = entry.get("group") if type(entry) is dict else None
+            members = entry.get("members") if type(entry) is dict else None
+            if not valid_group_name(group) or type(members) is not list:
+                continue
+            groups[group] = frozenset(member for member in members[:self.max_members]
+                                      if type(member) is str and len(member) <= MAX_MEMBER_LENGTH)
+
+        previous = current.groups if current is not None else {}
+        updated = {group for group in previous.keys() | groups.keys() if previous.get(group) != groups.get(group)}
+        before = {group: self.members(group) for group in updated}
+        self.states[server] = GroupState(version, groups)
+        self.index = None
+        return {group for group in updated if self.members(group) != before[group]}
+
+    def snapshot(self) -> bytes:
+        """
+        Encodes the memberships held by this server, to be stored across restarts.
+        """
+        return json.dumps({group: sorted(members) for group, members in self.local.items()}).encode('utf-8')
+
+    def restore(self, data: bytes) -> None:
+        """
+        Loads memberships stored with snapshot().
+
+        Raises:
+            ValueError if data is not a stored snapshot.
+        """
+        groups = json.loads(data)
+        if type(groups) is not dict:
+            raise ValueError("Not a group snapshot")
+        self.local = {group: set(members) for group, members in groups.items()
+                      if valid_group_name(group) and type(members) is list and members}
+        self.index = None
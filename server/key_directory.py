@@ -0,0 +1,298 @@
+import asyncio
+import base64
+import binascii
+import logging
+from collections import OrderedDict
+from typing import NamedTuple
+
+from cryptography.exceptions import UnsupportedAlgorithm
+
+from protocol.codec import codec
+
+# Key formats a client can ask for in its hello
+KEY_FORMAT_PEM = "pem"
+KEY_FORMAT_DER = "der"
+KEY_FORMAT_FINGERPRINT = "fingerprint"
+KEY_FORMATS = (KEY_FORMAT_PEM, KEY_FORMAT_DER, KEY_FORMAT_FINGERPRINT)
+
+DEFAULT_MAX_FETCHED_KEYS = 1024
+DEFAULT_FETCH_TIMEOUT = 5.0
+
+
+class KeyRecord(NamedTuple):
+    """
+    A client public key in the forms it is sent in.
+
+    fingerprint is computed over the PEM exactly as the client sent it, which
+    is what every OLAF client fingerprints. der is the base64 DER key, or None
+    if the PEM is not in the canonical form that converting the DER back gives,
+    in which case the PEM itself has to be sent for the fingerprint to match.
+    full and short are the encoded compact client_list entries: the fingerprint
+    with the key, and the fingerprint alone for receivers that have the key.
+    """
+    fingerprint: str
+    pem: str
+    der: str | None
+    full: bytes
+    short: bytes
+
+
+class KeyDirectory():
+    """
+    Public keys of the clients in the neighbourhood, parsed once per key.
+
+    Records are looked up by PEM, so keys repeated in every client_update and
+    client_list are never parsed or fingerprinted again, and by fingerprint to
+    answer key requests. Keys fetched from neighbours for clients that are not
+    listed here are kept in a bounded LRU.
+    """
+    def __init__(self, encryption, max_fetched: int = DEFAULT_MAX_FETCHED_KEYS):
+        self.encryption = encryption
+        self.max_fetched = max_fetched
+
+        # { pem : KeyRecord }
+        self.by_pem = {}
+        # { fingerprint : KeyRecord } of the listed clients
+        self.by_fingerprint = {}
+        # { fingerprint : address } of the server each listed client is on
+        self.locations = {}
+        # { fingerprint : KeyRecord } fetched from neighbours, least recently used first
+        self.fetched = OrderedDict()
+
+    def record(self, pem: str) -> KeyRecord | None:
+        """
+        Returns the record of a PEM public key, or None if it cannot be parsed.
+        """
+        record = self.by_pem.get(pem)
+        if record is not None:
+            return record
+
+        try:
+            pem_bytes = pem.encode('utf-8')
+            public_key = self.encryption.load_public_key(pem_bytes)
+        except (ValueError, TypeError, UnicodeError, UnsupportedAlgorithm):
+            return None
+
+        fingerprint = self.encryption.generate_fingerprint(pem_bytes)
+        if self.encryption.export_public_key(public_key) == pem_bytes:
+            der = base64.b64encode(self.encryption.export_public_key_der(public_key)).decode('ascii')
+            full = {"fingerprint": fingerprint, "key": der}
+        else:
+            der = None
+            full = {"fingerprint": fingerprint, "pem": pem}
+
+        record = KeyRecord(fingerprint, pem, der, codec.encode_bytes(full), codec.encode_bytes(fingerprint))
+        self.by_pem[pem] = record
+        return record
+
+    def record_from_entry(self, entry: dict) -> KeyRecord | None:
+        """
+        Reads a {"fingerprint", "key"} or {"fingerprint", "pem"} entry of a key_response.
+
+        Returns:
+            The record, or None if the entry is malformed or the key does not
+            match the fingerprint it was sent under.
+        """
+        fingerprint = entry.get("fingerprint")
+        try:
+            if "key" in entry:
+                public_key = self.encryption.load_der_public_key(base64.b64decode(entry["key"], validate=True))
+                pem = self.encryption.export_public_key(public_key).decode('utf-8')
+            else:
+                pem = entry["pem"]
+        except (KeyError, ValueError, TypeError, binascii.Error, UnsupportedAlgorithm):
+            return None
+
+        if type(pem) is not str:
+            return None
+        record = self.record(pem)
+        if record is None or record.fingerprint != fingerprint:
+            return None
+        return record
+
+    def update(self, servers: list) -> None:
+        """
+        Indexes the keys of the clients currently in the neighbourhood and
+        forgets records of keys no longer listed.
+
+        Args:
+            servers: list of (address, [pem, ...]).
+        """
+        by_fingerprint = {}
+        locations = {}
+        for address, pems in servers:
+            for pem in pems:
+                record = self.record(pem)
+                if record is not None:
+                    by_fingerprint[record.fingerprint] = record
+                    locations[record.fingerprint] = address
+
+        self.by_fingerprint = by_fingerprint
+        self.locations = locations
+        self.by_pem = {record.pem: record for record in by_fingerprint.values()}
+
+    def add_fetched(self, record: KeyRecord) -> None:
+        self.fetched[record.fingerprint] = record
+        self.fetched.move_to_end(record.fingerprint)
+        while len(self.fetched) > self.max_fetched:
+            self.fetched.popitem(last=False)
+
+    def lookup(self, fingerprint: str) -> KeyRecord | None:
+        """
+        Returns the record of a fingerprint if this server knows the key.
+        """
+        record = self.by_fingerprint.get(fingerprint)
+        if record is None:
+            record = self.fetched.get(fingerprint)
+            if record is not None:
+                self.fetched.move_to_end(fingerprint)
+        return record
+
+    def compact_client_list(self, servers: list, sent: set, include_keys: bool = True, digest: str | None = None,
+                            capabilities: list | None = None) -> bytes:
+        """
+        Encodes a compact client_list for one receiver.
+
+        Args:
+            servers: list of (address, [pem, ...]).
+            sent: fingerprints whose keys the receiver already has. Updated with
+                the keys included in this list.
+            include_keys: False to list fingerprints only, for receivers that
+                fetch keys with key_request.
+            digest: membership digest of the list, added if given.
+            capabilities: the sending server's capabilities, added if given.
+
+        Returns:
+            The encoded client_list. Keys the receiver has are listed by
+            fingerprint, the others as {"fingerprint", "key"} with the DER key
+            (or {"fingerprint", "pem"} for non-canonical PEMs). Keys that cannot
+            be parsed are left out.
+        """
+        parts = []
+        for address, pems in servers:
+            entries = []
+            for pem in pems:
+                record = self.record(pem)
+                if record is None:
+                    continue
+                if not include_keys or record.fingerprint in sent:
+                    entries.append(record.short)
+                else:
+                    entries.append(record.full)
+                    sent.add(record.fingerprint)
+            parts.append(b'{"address":%s,"clients":[%s]}' % (codec.encode_bytes(address), b",".join(entries)))
+
+        key_format = KEY_FORMAT_DER if include_keys else KEY_FORMAT_FINGERPRINT
+        extra = b'' if digest is None else b',"digest":%s' % codec.encode_bytes(digest)
+        if capabilities is not None:
+            extra += b',"capabilities":%s' % codec.encode_bytes(capabilities)
+        return b'{"type":"client_list","key_format":"%s","servers":[%s]%s}' % (
+            key_format.encode(), b",".join(parts), extra)
+
+
+class PendingKey():
+    """
+    A key lookup waiting on neighbours. waiting holds the neighbours that have not answered yet.
+    """
+    __slots__ = ('future', 'waiting')
+
+    def __init__(self, future: asyncio.Future, waiting: set):
+        self.future = future
+        self.waiting = waiting
+
+
+class KeyFetcher():
+    """
+    Fetches keys this server does not have from its neighbours.
+
+    All lookups of a fingerprint in flight share one key_request round trip:
+    later requests for it wait on the same future. A lookup resolves with the
+    first neighbour that has the key, or None once every neighbour asked has
+    said it does not, or after timeout seconds.
+    """
+    def __init__(self, directory: KeyDirectory, timeout: float = DEFAULT_FETCH_TIMEOUT,
+                 logger: logging.Logger | None = None):
+        self.directory = directory
+        self.timeout = timeout
+        self.logger = logger or logging.getLogger(__name__)
+
+        # { fingerprint : PendingKey }
+        self.pending = {}
+
+        self.requests = 0
+        self.coalesced = 0
+        self.found = 0
+        self.not_found = 0
+
+    async def fetch(self, fingerprints: list, neighbours: list, send) -> dict:
+        """
+        Looks fingerprints up on neighbours.
+
+        Args:
+            fingerprints: fingerprints not found in the directory.
+            neighbours: the neighbour connections to ask.
+            send: coroutine function send(neighbour, fingerprints) sending a key_request.
+
+        Returns:
+            dict of { fingerprint : KeyRecord or None }.
+        """
+        loop = asyncio.get_running_loop()
+        futures = {}
+        new = []
+        for fingerprint in fingerprints:
+            pending = self.pending.get(fingerprint)
+            if pending is None:
+                pending = PendingKey(loop.create_future(), set(neighbours))
+                if neighbours:
+                    self.pending[fingerprint] = pending
+                    new.append(fingerprint)
+                else:
+                    pending.future.set_result(None)
+            else:
+                self.coalesced += 1
+            futures[fingerprint] = pending.future
+
+        if new:
+            self.requests += 1
+            loop.call_later(self.timeout, self.expire, new)
+            for neighbour in neighbours:
+                try:
+                    await send(neighbour, new)
+                except Exception as e:
+                    self.logger.warning(f"Unable to send key_request to {neighbour.server_addr}: {e}")
+                    self.resolve(neighbour, [], new)
+
+        await asyncio.wait(futures.values())
+        return {fingerprint: future.result() for fingerprint, future in futures.items()}
+
+    def resolve(self, neighbour, records: list, missing: list) -> None:
+        """
+        Applies a neighbour's key_response.
+        """
+        for record in records:
+            pending = self.pending.pop(record.fingerprint, None)
+            if pending is not None and not pending.future.done():
+                self.directory.add_fetched(record)
+                self.found += 1
+                pending.future.set_result(record)
+
+        for fingerprint in missing:
+            pending = self.pending.get(fingerprint)
+            if pending is None:
+                continue
+            pending.waiting.discard(neighbour)
+            if not pending.waiting:
+                self.finish(fingerprint)
+
+    def expire(self, fingerprints: list) -> None:
+        for fingerprint in fingerprints:
+            self.finish(fingerprint)
+
+    def finish(self, fingerprint: str) -> None:
+        """
+        Resolves a lookup nobody had the key for.
+        """
+        pending = self.pending.pop(fingerprint, None)
+        if pending is not None and not pending.future.done():
+            self.not_found += 1
+            pending.future.set_result(None)
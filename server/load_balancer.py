@@ -0,0 +1,197 @@
+import os
+import time
+from typing import NamedTuple
+
+DEFAULT_LOAD_REPORT_INTERVAL = 2.0
+DEFAULT_REDIRECT_MARGIN = 0.25
+DEFAULT_REDIRECT_MIN_CLIENTS = 50
+
+# Bytes waiting to be sent, and milliseconds of event loop lag, that weigh as
+# much as one more client, or double a server's load
+SEND_QUEUE_UNIT = 64 * 1024
+LOOP_LAG_UNIT_MS = 50
+
+MAX_REPORTED_VALUE = 2 ** 53
+
+
+class LoadReport(NamedTuple):
+    """
+    How busy a server was when it last reported.
+
+    server is its name on the server links and address the host:port clients
+    connect to, with http_port for its HTTP API. send_queue is the bytes
+    waiting in its send buffers and loop_lag_ms its event loop lag. received
+    is the clock time the report was made or received.
+    """
+    server: str
+    address: str
+    http_port: int
+    clients: int
+    send_queue: int
+    loop_lag_ms: int
+    received: float
+
+    def load(self) -> float:
+        """
+        Returns a single load figure: clients, plus one per SEND_QUEUE_UNIT of
+        queued bytes, scaled up by event loop lag.
+        """
+        return (self.clients + self.send_queue / SEND_QUEUE_UNIT) * (1 + self.loop_lag_ms / LOOP_LAG_UNIT_MS)
+
+    def summary(self) -> dict:
+        return {
+            "address": self.address,
+            "http_port": self.http_port,
+            "clients": self.clients,
+            "send_queue": self.send_queue,
+            "loop_lag_ms": self.loop_lag_ms,
+            "load": round(self.load(), 2),
+        }
+
+
+def report_value(message: dict, name: str) -> int | None:
+    value = message.get(name)
+    if type(value) is not int or not 0 <= value < MAX_REPORTED_VALUE:
+        return None
+    return value
+
+
+class LoadBalancer():
+    """
+    The load of this server and of its neighbours, to send clients to the least loaded one.
+
+    Servers send their neighbours a load_report every interval seconds.
+    Reports not renewed for three intervals are dropped. Every client sent to
+    a server counts towards its load until the server's next report, so a
+    wave of clients is spread rather than all sent to the same server.
+
+    When redirect is on, a server with at least min_clients clients and a load
+    over (1 + margin) times that of its least loaded neighbour hands new
+    clients to that neighbour.
+    """
+    def __init__(self, server_name: str, interval: float = DEFAULT_LOAD_REPORT_INTERVAL, redirect: bool = False,
+                 margin: float = DEFAULT_REDIRECT_MARGIN, min_clients: int = DEFAULT_REDIRECT_MIN_CLIENTS,
+                 clock=time.monotonic):
+        self.server_name = server_name
+        self.interval = interval
+        self.redirect = redirect
+        self.margin = margin
+        self.min_clients = min_clients
+        self.clock = clock
+
+        self.local = None
+        # { server name : LoadReport } of the neighbours
+        self.reports = {}
+        # { server name : clients sent there since its last report }
+        self.assigned = {}
+        self.redirects = 0
+
+    @classmethod
+    def from_env(cls, server_name: str) -> "LoadBalancer":
+        """
+        Reads LOAD_REPORT_INTERVAL, LOAD_REDIRECT, LOAD_REDIRECT_MARGIN and LOAD_REDIRECT_MIN_CLIENTS.
+        """
+        return cls(
+            server_name,
+            interval=float(os.getenv('LOAD_REPORT_INTERVAL', DEFAULT_LOAD_REPORT_INTERVAL)),
+            redirect=os.getenv('LOAD_REDIRECT', 'off').lower() in ('on', '1', 'true'),
+            margin=float(os.getenv('LOAD_REDIRECT_MARGIN', DEFAULT_REDIRECT_MARGIN)),
+            min_clients=int(os.getenv('LOAD_REDIRECT_MIN_CLIENTS', DEFAULT_REDIRECT_MIN_CLIENTS)),
+        )
+
+    def update_local(self, address: str, http_port: int, clients: int, send_queue: int, loop_lag_ms: int) -> dict:
+        """
+        Records this server's load.
+
+        Returns:
+            The load_report message to send to the neighbours.
+        """
+        self.local = LoadReport(self.server_name, address, http_port, clients, send_queue, loop_lag_ms, self.clock())
+        self.assigned.pop(self.server_name, None)
+        return {
+            "type" : "load_report",
+            "server" : self.server_name,
+            "address" : address,
+            "http_port" : http_port,
+            "clients" : clients,
+            "send_queue" : send_queue,
+            "loop_lag_ms" : loop_lag_ms,
+        }
+
+    def apply(self, message: dict) -> bool:
+        """
+        Records a load_report received from a neighbour.
+
+        Returns:
+            False if the report is malformed or claims to be from this server.
+        """
+        server = message["server"]
+        address = message["address"]
+        values = [report_value(message, name) for name in ("http_port", "clients", "send_queue", "loop_lag_ms")]
+        if server == self.server_name or not address or None in values:
+            return False
+
+        self.reports[server] = LoadReport(server, address, *values, self.clock())
+        self.assigned.pop(server, None)
+        return True
+
+    def forget(self, server: str) -> None:
+        """
+        Drops the report of a neighbour that disconnected.
+        """
+        self.reports.pop(server, None)
+        self.assigned.pop(server, None)
+
+    def estimate(self, report: LoadReport, clients: int | None = None) -> float:
+        """
+        Returns the load of a server counting the clients sent there since it reported.
+        """
+        if clients is None:
+            clients = report.clients + self.assigned.get(report.server, 0)
+        return report._replace(clients=clients).load()
+
+    def current(self) -> list:
+        """
+        Returns the reports of this server and of the neighbours that reported recently.
+        """
+        expired = self.clock() - 3 * self.interval
+        for server in [server for server, report in self.reports.items() if report.received < expired]:
+            self.forget(server)
+        reports = list(self.reports.values())
+        if self.local is not None:
+            reports.insert(0, self.local)
+        return reports
+
+    def recommend(self) -> LoadReport | None:
+        """
+        Returns the least loaded server, this one on ties, and counts a client towards it.
+        """
+        reports = self.current()
+        if not reports:
+            return None
+        report = min(reports, key=self.estimate)
+        self.assign(report)
+        return report
+
+    def redirect_target(self, clients: int) -> LoadReport | None:
+        """
+        Returns the neighbour a new client should be sent to instead of being
+        accepted here, or None to accept it.
+
+        Args:
+            clients: the clients connected to this server now.
+        """
+        if not self.redirect or self.local is None or clients < self.min_clients:
+            return None
+        neighbours = [report for report in self.current() if report is not self.local]
+        if not neighbours:
+            return None
+        target = min(neighbours, key=self.estimate)
+        if self.estimate(self.local, clients) <= self.estimate(target) * (1 + self.margin):
+            return None
+        self.assign(target)
+        self.redirects += 1
+        return target
+
+    def assign(self, report: LoadReport) -> None:
+        self.assigned[report.server] = self.assigned.get(report.server, 0) + 1
@@ -0,0 +1,208 @@
+from typing import NamedTuple
+
+# Field kinds understood by the validator
+STR = str
+LIST = list
+INT = int
+DICT = dict
+
+# Upper bounds on individual fields. Anything larger is rejected before the
+# rest of the message is looked at.
+MAX_TYPE_LENGTH = 64
+MAX_SIGNATURE_LENGTH = 1024
+MAX_PUBLIC_KEY_LENGTH = 4096
+MAX_SENDER_LENGTH = 512
+MAX_PUBLIC_MESSAGE_LENGTH = 64 * 1024
+MAX_CHAT_LENGTH = 512 * 1024
+MAX_IV_LENGTH = 64
+MAX_SERVER_ADDRESS_LENGTH = 256
+MAX_DESTINATION_SERVERS = 256
+MAX_SYMM_KEYS = 1024
+MAX_LISTED_CLIENTS = 10000
+MAX_LISTED_SERVERS = 1024
+MAX_FINGERPRINT_LENGTH = 64
+MAX_REQUESTED_KEYS = 256
+MAX_BATCHED_MESSAGES = 1024
+MAX_GROUP_NAME_LENGTH = 64
+MAX_LISTED_GROUPS = 4096
+
+
+class Field(NamedTuple):
+    """
+    A single required field of a message.
+
+    kind is the python type the decoded JSON value must have. max_length bounds
+    the length of strings and lists. For lists, item_kind and item_max_length
+    describe every element (item_kind of None skips element checks).
+    """
+    name: str
+    kind: type
+    max_length: int | None = None
+    item_kind: type | None = None
+    item_max_length: int | None = None
+
+
+class OlafMessage(NamedTuple):
+    """
+    A message that passed schema validation.
+
+    type is the top-level message type. For signed_data, data_type, data and
+    counter are populated from the signed payload. raw is the decoded message
+    as it arrived and frame the encoded message as it arrived (if known), used
+    when relaying.
+    """
+    type: str
+    data_type: str | None
+    data: dict | None
+    counter: int | None
+    raw: dict
+    frame: str | bytes | None = None
+
+
+# Top-level message schemas, keyed by "type"
+MESSAGE_SCHEMAS = {
+    "signed_data": (
+        Field("data", DICT),
+        Field("counter", INT),
+        Field("signature", STR, MAX_SIGNATURE_LENGTH),
+    ),
+    "client_list_request": (),
+    "client_update": (
+        Field("clients", LIST, MAX_LISTED_CLIENTS, STR, MAX_PUBLIC_KEY_LENGTH),
+    ),
+    "client_list": (
+        Field("servers", LIST, MAX_LISTED_SERVERS, DICT),
+    ),
+    "client_update_request": (),
+    "key_request": (
+        Field("fingerprints", LIST, MAX_REQUESTED_KEYS, STR, MAX_FINGERPRINT_LENGTH),
+    ),
+    "key_response": (
+        Field("keys", LIST, MAX_REQUESTED_KEYS, DICT),
+    ),
+    "batch": (
+        Field("messages", LIST, MAX_BATCHED_MESSAGES, DICT),
+    ),
+    "group_join": (
+        Field("group", STR, MAX_GROUP_NAME_LENGTH),
+    ),
+    "group_leave": (
+        Field("group", STR, MAX_GROUP_NAME_LENGTH),
+    ),
+    "group_update": (
+        Field("server", STR, MAX_SERVER_ADDRESS_LENGTH),
+        Field("version", INT),
+        Field("groups", LIST, MAX_LISTED_GROUPS, DICT),
+    ),
+    "load_report": (
+        Field("server", STR, MAX_SERVER_ADDRESS_LENGTH),
+        Field("address", STR, MAX_SERVER_ADDRESS_LENGTH),
+        Field("http_port", INT),
+        Field("clients", INT),
+        Field("send_queue", INT),
+        Field("loop_lag_ms", INT),
+    ),
+    "link_state": (
+        Field("origin", STR, MAX_SERVER_ADDRESS_LENGTH),
+        Field("seq", INT),
+        Field("neighbours", LIST, MAX_LISTED_SERVERS, STR, MAX_SERVER_ADDRESS_LENGTH),
+        Field("clients", LIST, MAX_LISTED_CLIENTS, STR, MAX_PUBLIC_KEY_LENGTH),
+    ),
+}
+
+# Schemas of the payload carried in signed_data, keyed by data["type"]
+DATA_SCHEMAS = {
+    "hello": (
+        Field("public_key", STR, MAX_PUBLIC_KEY_LENGTH),
+    ),
+    "chat": (
+        Field("destination_servers", LIST, MAX_DESTINATION_SERVERS, STR, MAX_SERVER_ADDRESS_LENGTH),
+        Field("iv", STR, MAX_IV_LENGTH),
+        Field("symm_keys", LIST, MAX_SYMM_KEYS, STR, MAX_SIGNATURE_LENGTH),
+        Field("chat", STR, MAX_CHAT_LENGTH),
+    ),
+    "public_chat": (
+        Field("sender", STR, MAX_SENDER_LENGTH),
+        Field("message", STR, MAX_PUBLIC_MESSAGE_LENGTH),
+    ),
+    "server_hello": (
+        Field("sender", STR, MAX_SENDER_LENGTH),
+    ),
+}
+
+
+def check_fields(message: dict, schema: tuple) -> str | None:
+    """
+    Checks presence, type and size of every field in schema.
+
+    Returns:
+        None if the message matches, otherwise a short description of the first problem.
+    """
+    for name, kind, max_length, item_kind, item_max_length in schema:
+        value = message.get(name)
+        if value is None:
+            return f"missing required field '{name}'"
+
+        # bool is a subclass of int, so compare exact types.
+        if type(value) is not kind:
+            return f"field '{name}' must be of type {kind.__name__}"
+
+        if max_length is not None and len(value) > max_length:
+            return f"field '{name}' exceeds maximum length {max_length}"
+
+        if item_kind is None:
+            continue
+
+        for item in value:
+            if type(item) is not item_kind:
+                return f"field '{name}' must only contain {item_kind.__name__} values"
+            if item_max_length is not None and len(item) > item_max_length:
+                return f"field '{name}' contains a value exceeding maximum length {item_max_length}"
+
+    return None
+
+
+def validate_message(message, frame: str | bytes | None = None) -> tuple:
+    """
+    Validates a decoded message against the OLAF protocol schemas in a single pass.
+
+    Args:
+        message: The decoded JSON message.
+        frame: The frame message was decoded from, kept on the result for relaying.
+
+    Returns:
+        A tuple containing the validated OlafMessage and None on success,
+        or None and an error description if validation fails.
+    """
+    if type(message) is not dict:
+        return None, "message must be a JSON object"
+
+    message_type = message.get("type")
+    if type(message_type) is not str:
+        return None, "missing 'type' field"
+
+    schema = MESSAGE_SCHEMAS.get(message_type)
+    if schema is None:
+        return None, f"unknown message type '{message_type[:MAX_TYPE_LENGTH]}'"
+
+    error = check_fields(message, schema)
+    if error:
+        return None, error
+
+    if message_type != "signed_data":
+        return OlafMessage(message_type, None, None, None, message, frame), None
+
+    data = message["data"]
+    data_type = data.get("type")
+    if type(data_type) is not str:
+        return None, "signed data missing 'type' field"
+
+    data_schema = DATA_SCHEMAS.get(data_type)
+    if data_schema is None:
+        return None, f"unknown signed data type '{data_type[:MAX_TYPE_LENGTH]}'"
+
+    error = check_fields(data, data_schema)
+    if error:
+        return None, error
+
+    return OlafMessage(message_type, data_type, data, message["counter"], message, frame), None
@@ -0,0 +1,259 @@
+import asyncio
+import bisect
+import time
+
+from message_schema import MESSAGE_SCHEMAS, DATA_SCHEMAS
+
+# Message types children are pre-bound for, including group_members and redirect
+# which only servers send. Anything else is counted as "other".
+MESSAGE_TYPES = tuple(MESSAGE_SCHEMAS) + tuple(DATA_SCHEMAS) + ("group_members", "redirect", "error", "other")
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+FANOUT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class CounterChild():
+    """
+    A single labelled counter. inc() is all the hot path pays for.
+    """
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+
+class GaugeChild():
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+
+class HistogramChild():
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metric():
+    """
+    A metric family. Children for every label combination are created once with
+    labels() and kept by the caller, so recording never formats labels.
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+
+    def new_child(self):
+        # An untyped child just holds whatever value it was last set to
+        return GaugeChild()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self.new_child()
+        return child
+
+    def samples(self) -> list:
+        return [(self.name, values, "", child.value) for values, child in self.children.items()]
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for name, values, extra, value in self.samples():
+            lines.append(f"{name}{format_labels(self.labelnames, values, extra)} {format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def new_child(self):
+        return CounterChild()
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def new_child(self):
+        return GaugeChild()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def new_child(self):
+        return HistogramChild(self.buckets)
+
+    def samples(self) -> list:
+        samples = []
+        for values, child in self.children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", values, f'le="{format_value(bound)}"', cumulative))
+            samples.append((f"{self.name}_sum", values, "", child.sum))
+            samples.append((f"{self.name}_count", values, "", child.count))
+        return samples
+
+
+class CallbackMetric(Metric):
+    """
+    A metric whose values are read at scrape time.
+
+    callback returns either a single value, or a dict of {label values tuple : value}.
+    """
+    def __init__(self, name: str, help_text: str, kind: str, callback, labelnames: tuple = ()):
+        super().__init__(name, help_text, labelnames)
+        self.kind = kind
+        self.callback = callback
+
+    def samples(self) -> list:
+        result = self.callback()
+        if isinstance(result, dict):
+            return [(self.name, values if isinstance(values, tuple) else (values,), "", value)
+                    for values, value in result.items()]
+        return [(self.name, (), "", result)]
+
+
+class MetricsRegistry():
+    """
+    Holds metric families and renders them in the Prometheus text exposition format.
+    """
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: tuple = ()) -> Counter:
+        return self.register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: tuple = ()) -> Gauge:
+        return self.register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def callback(self, name: str, help_text: str, kind: str, callback, labelnames: tuple = ()) -> CallbackMetric:
+        return self.register(CallbackMetric(name, help_text, kind, callback, labelnames))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def bind_by_type(metric: Metric) -> dict:
+    """
+    Pre-binds a child of a metric labelled by message type for every known type.
+    """
+    return {message_type: metric.labels(message_type) for message_type in MESSAGE_TYPES}
+
+
+class ServerMetrics():
+    """
+    The metrics kept by an OLAF server, with children pre-bound per message type.
+    """
+    def __init__(self, registry: MetricsRegistry | None = None):
+        self.registry = registry or MetricsRegistry()
+        registry = self.registry
+
+        self.messages_received = bind_by_type(registry.counter(
+            "olaf_messages_received_total", "Messages received, by type.", ("type",)))
+        self.messages_sent = bind_by_type(registry.counter(
+            "olaf_messages_sent_total", "Messages sent, by type.", ("type",)))
+        self.fanout = bind_by_type(registry.histogram(
+            "olaf_fanout_size", "Number of connections a single message was sent to.", ("type",), FANOUT_BUCKETS))
+        self.handler_latency = bind_by_type(registry.histogram(
+            "olaf_handler_latency_seconds", "Time spent handling a message, by type.", ("type",), LATENCY_BUCKETS))
+
+        self.upload_bytes = registry.counter("olaf_upload_bytes_total", "Bytes received through file uploads.").labels()
+        self.download_bytes = registry.counter("olaf_download_bytes_total", "Bytes served through file downloads.").labels()
+
+        self.loop_lag = registry.gauge("olaf_event_loop_lag_seconds", "Most recent event loop lag sample.").labels()
+        self.loop_lag_histogram = registry.histogram(
+            "olaf_event_loop_lag_seconds_distribution", "Event loop lag samples.", (), LAG_BUCKETS).labels()
+
+    def received(self, message_type: str):
+        return self.messages_received.get(message_type) or self.messages_received["other"]
+
+    def sent(self, message_type: str):
+        return self.messages_sent.get(message_type) or self.messages_sent["other"]
+
+
+class LoopLagMonitor():
+    """
+    Measures event loop lag by sleeping for interval and timing how late it wakes up.
+    """
+    def __init__(self, interval: float = 0.5, on_sample=None):
+        self.interval = interval
+        self.on_sample = on_sample
+        self.lag = 0.0
+        self.task = None
+
+    def start(self) -> None:
+        self.task = asyncio.ensure_future(self.run())
+
+    def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self) -> None:
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, time.perf_counter() - expected)
+            if self.on_sample is not None:
+                self.on_sample(self.lag)
@@ -0,0 +1,166 @@
+import time
+from collections import deque
+from typing import NamedTuple
+
+DEFAULT_MAX_OVERLAY_SERVERS = 1024
+
+
+class LinkState(NamedTuple):
+    """
+    The latest link_state a server advertised: its direct links and its clients' public keys.
+    """
+    seq: int
+    neighbours: frozenset
+    clients: list
+
+
+class LinkStateDatabase():
+    """
+    Topology of an overlay neighbourhood, where each server only links to a
+    few others, built from the link_state messages flooded by every server.
+
+    A link is used only if both ends advertise it. Routes follow the shortest
+    path tree rooted at the server a message entered the neighbourhood at.
+    Ties are broken by server name, so every server with the same link states
+    computes the same tree: public chats go down the tree and reach each
+    server once, and chats follow the tree branch to their destination.
+    """
+    def __init__(self, server_name: str, max_servers: int = DEFAULT_MAX_OVERLAY_SERVERS):
+        self.server_name = server_name
+        self.max_servers = max_servers
+
+        # { server name : LinkState }
+        self.states = {}
+        # Sequence numbers start at the clock so they keep increasing across restarts
+        self.seq = int(time.time() * 1000)
+        # { root : { server : parent } }, cleared when the topology changes
+        self.trees = {}
+
+    def originate(self, neighbours, clients: list) -> dict:
+        """
+        Records this server's own links and clients.
+
+        Returns:
+            The link_state message to flood to the neighbours.
+        """
+        self.seq += 1
+        self.states[self.server_name] = LinkState(self.seq, frozenset(neighbours), clients)
+        self.trees.clear()
+        return {
+            "type" : "link_state",
+            "origin" : self.server_name,
+            "seq" : self.seq,
+            "neighbours" : sorted(neighbours),
+            "clients" : clients
+        }
+
+    def apply(self, message: dict) -> bool:
+        """
+        Records a link_state received from a neighbour.
+
+        Returns:
+            True if it is newer than what was known about its origin, in which
+            case it has to be flooded on.
+        """
+        origin = message["origin"]
+        seq = message["seq"]
+        if origin == self.server_name:
+            return False
+
+        current = self.states.get(origin)
+        if current is not None and seq <= current.seq:
+            return False
+        if current is None and len(self.states) >= self.max_servers:
+            return False
+
+        neighbours = frozenset(neighbour for neighbour in message["neighbours"] if isinstance(neighbour, str))
+        self.states[origin] = LinkState(seq, neighbours, message["clients"])
+        self.trees.clear()
+        return True
+
+    def messages(self) -> list:
+        """
+        Returns every known link_state, for a neighbour that just linked up.
+        """
+        return [{
+            "type" : "link_state",
+            "origin" : origin,
+            "seq" : state.seq,
+            "neighbours" : sorted(state.neighbours),
+            "clients" : state.clients
+        } for origin, state in self.states.items()]
+
+    def links(self, server: str) -> list:
+        """
+        Returns the servers linked to server in both directions, sorted by name.
+        """
+        state = self.states.get(server)
+        if state is None:
+            return []
+        return sorted(neighbour for neighbour in state.neighbours
+                      if neighbour in self.states and server in self.states[neighbour].neighbours)
+
+    def tree(self, root: str) -> dict:
+        """
+        Returns the shortest path tree rooted at root as { server : parent }, root's parent being None.
+        """
+        parents = self.trees.get(root)
+        if parents is not None:
+            return parents
+
+        parents = {root: None}
+        queue = deque([root])
+        while queue:
+            server = queue.popleft()
+            for neighbour in self.links(server):
+                if neighbour not in parents:
+                    parents[neighbour] = server
+                    queue.append(neighbour)
+
+        self.trees[root] = parents
+        return parents
+
+    def reachable(self) -> set:
+        """
+        Returns the servers this server has a path to, itself included.
+        """
+        return set(self.tree(self.server_name))
+
+    def children(self, root: str) -> list | None:
+        """
+        Returns the servers this server passes a message from root on to,
+        or None if this server is not in root's tree.
+        """
+        parents = self.tree(root)
+        if self.server_name not in parents:
+            return None
+        return [server for server, parent in parents.items() if parent == self.server_name]
+
+    def next_hop(self, root: str, destination: str) -> str | None:
+        """
+        Returns the neighbour to pass a message from root for destination on
+        to, or None if destination is not below this server in root's tree.
+        """
+        parents = self.tree(root)
+        if destination not in parents:
+            return None
+
+        server = destination
+        while server != root:
+            parent = parents[server]
+            if parent == self.server_name:
+                return server
+            server = parent
+        return None
+
+    def route(self, root: str, destination: str) -> str | None:
+        """
+        Returns the neighbour to forward a message from root for destination to.
+
+        Falls back to this server's own shortest path while the link states of
+        the servers still disagree, e.g. right after a link went down.
+        """
+        hop = self.next_hop(root, destination)
+        if hop is None and root != self.server_name:
+            hop = self.next_hop(self.server_name, destination)
+        return hop
@@ -0,0 +1,150 @@
+import os
+import time
+
+from message_schema import MESSAGE_SCHEMAS, DATA_SCHEMAS
+
+# (rate per second, burst) budgets. "*" is the overall budget of a connection,
+# every other key is the budget of a single message type (signed payload type
+# for signed_data).
+DEFAULT_CLIENT_BUDGETS = {
+    "*": (50, 100),
+    "public_chat": (5, 20),
+    "chat": (20, 50),
+    "client_list_request": (2, 10),
+    "key_request": (5, 20),
+    "group_join": (2, 10),
+    "group_leave": (2, 10),
+    "hello": (1, 3),
+}
+
+DEFAULT_NEIGHBOUR_BUDGETS = {
+    "*": (2000, 4000),
+    "public_chat": (500, 1000),
+    "chat": (1000, 2000),
+    "client_update": (50, 200),
+    "key_request": (100, 200),
+    "link_state": (100, 500),
+    "group_update": (50, 200),
+    "load_report": (10, 50),
+}
+
+
+def parse_budgets(value: str | None) -> dict:
+    """
+    Parses budget overrides of the form "public_chat=5:20,chat=20:50" (rate:burst).
+    """
+    budgets = {}
+    if not value:
+        return budgets
+
+    for entry in value.split(','):
+        name, _, budget = entry.partition('=')
+        rate, _, burst = budget.partition(':')
+        if name.strip() and rate.strip():
+            rate = float(rate)
+            budgets[name.strip()] = (rate, float(burst) if burst.strip() else rate)
+    return budgets
+
+
+class TokenBucket():
+    """
+    Token bucket refilled continuously at rate tokens per second up to capacity.
+    """
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float, now: float | None = None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def consume(self, now: float, amount: float = 1) -> bool:
+        """
+        Takes amount tokens from the bucket. Returns False if there are not enough.
+        """
+        tokens = self.tokens + (now - self.updated) * self.rate
+        if tokens > self.capacity:
+            tokens = self.capacity
+        self.updated = now
+
+        if tokens < amount:
+            self.tokens = tokens
+            return False
+
+        self.tokens = tokens - amount
+        return True
+
+
+class RateLimiter():
+    """
+    Token bucket rate limits per connection and per message type.
+
+    Clients and neighbours have separate budgets. Throttled messages are counted
+    per (connection kind, message type), with types senders made up counted as
+    "unknown" so they cannot grow the counts.
+    """
+    def __init__(self, client_budgets: dict | None = None, neighbour_budgets: dict | None = None):
+        self.client_budgets = dict(DEFAULT_CLIENT_BUDGETS)
+        if client_budgets:
+            self.client_budgets.update(client_budgets)
+
+        self.neighbour_budgets = dict(DEFAULT_NEIGHBOUR_BUDGETS)
+        if neighbour_budgets:
+            self.neighbour_budgets.update(neighbour_budgets)
+
+        # { (connection key, is neighbour) : { message type : TokenBucket } }
+        self.buckets = {}
+        self.throttled = {}
+
+    @classmethod
+    def from_env(cls) -> "RateLimiter":
+        """
+        Builds limits from CLIENT_RATE_LIMITS and NEIGHBOUR_RATE_LIMITS.
+        """
+        return cls(
+            client_budgets=parse_budgets(os.getenv('CLIENT_RATE_LIMITS')),
+            neighbour_budgets=parse_budgets(os.getenv('NEIGHBOUR_RATE_LIMITS')),
+        )
+
+    def allow(self, key, message_type: str | None, is_neighbour: bool) -> bool:
+        """
+        Charges one message of message_type to the connection identified by key.
+
+        Returns:
+            True if the message is within budget, False if it must be throttled.
+        """
+        budgets = self.neighbour_budgets if is_neighbour else self.client_budgets
+        # A connection is treated as a client until its server_hello is handled,
+        # so keep its client and neighbour buckets apart.
+        connection_buckets = self.buckets.get((key, is_neighbour))
+        if connection_buckets is None:
+            connection_buckets = self.buckets[(key, is_neighbour)] = {}
+
+        now = time.monotonic()
+        allowed = self._consume(connection_buckets, "*", budgets, now)
+        if allowed and message_type is not None:
+            allowed = self._consume(connection_buckets, message_type, budgets, now)
+
+        if not allowed:
+            if message_type not in MESSAGE_SCHEMAS and message_type not in DATA_SCHEMAS:
+                message_type = "unknown"
+            throttled_key = ("neighbour" if is_neighbour else "client", message_type)
+            self.throttled[throttled_key] = self.throttled.get(throttled_key, 0) + 1
+        return allowed
+
+    def _consume(self, connection_buckets: dict, bucket_name: str, budgets: dict, now: float) -> bool:
+        bucket = connection_buckets.get(bucket_name)
+        if bucket is None:
+            budget = budgets.get(bucket_name)
+            if budget is None:
+                # No budget configured for this type
+                return True
+            bucket = connection_buckets[bucket_name] = TokenBucket(*budget, now=now)
+        return bucket.consume(now)
+
+    def forget(self, key) -> None:
+        """
+        Drops the buckets of a closed connection.
+        """
+        self.buckets.pop((key, False), None)
+        self.buckets.pop((key, True), None)
@@ -0,0 +1,110 @@
+import base64
+import hashlib
+import os
+import time
+
+DEFAULT_DEDUP_TTL = 120.0
+DEFAULT_DEDUP_MAX_ENTRIES = 100000
+DEFAULT_MAX_HOPS = 8
+
+# Longest msg_id accepted from a neighbour
+MAX_MESSAGE_ID_LENGTH = 32
+
+
+def message_id(message: dict, from_neighbour: bool = False) -> str:
+    """
+    Returns the ID of a relayed signed_data message.
+
+    The msg_id a neighbour added is used if there is one. Otherwise, and
+    always for messages from clients, which must not be able to pick the ID
+    of another message, the ID is derived from the signature. That is unique
+    per message since it covers the sender's counter, so every server names
+    a message the same way.
+    """
+    msg_id = message.get("msg_id")
+    if from_neighbour and isinstance(msg_id, str) and 0 < len(msg_id) <= MAX_MESSAGE_ID_LENGTH:
+        return msg_id
+    digest = hashlib.sha256(message["signature"].encode('utf-8')).digest()
+    return base64.b64encode(digest[:12]).decode('ascii')
+
+
+def message_hops(message: dict, from_neighbour: bool = False) -> int | None:
+    """
+    Returns how many servers relayed a message so far, or None if hops is not a count.
+    Messages from clients have not been relayed yet, whatever they say.
+    """
+    if not from_neighbour:
+        return 0
+    hops = message.get("hops", 0)
+    if type(hops) is not int or hops < 0:
+        return None
+    return hops
+
+
+class RelayDedup():
+    """
+    Remembers the IDs of recently relayed messages so that messages reaching
+    this server over more than one path are only delivered and forwarded once.
+
+    IDs are kept in two generations. A new generation starts when the current
+    one is ttl seconds old or holds half of max_entries, and the oldest is then
+    dropped, so an ID is remembered for between ttl and 2 * ttl seconds and
+    memory is bounded by max_entries IDs.
+    """
+    def __init__(self, ttl: float = DEFAULT_DEDUP_TTL, max_entries: int = DEFAULT_DEDUP_MAX_ENTRIES,
+                 max_hops: int = DEFAULT_MAX_HOPS, clock=time.monotonic):
+        self.ttl = ttl
+        self.generation_size = max(1, max_entries // 2)
+        self.max_hops = max_hops
+        self.clock = clock
+
+        self.current = set()
+        self.previous = set()
+        self.started = clock()
+
+        self.duplicates = {}
+        self.hop_limited = 0
+
+    @classmethod
+    def from_env(cls) -> "RelayDedup":
+        """
+        Builds the cache from RELAY_DEDUP_TTL, RELAY_DEDUP_MAX_ENTRIES and RELAY_MAX_HOPS.
+        """
+        return cls(
+            ttl=float(os.getenv('RELAY_DEDUP_TTL', DEFAULT_DEDUP_TTL)),
+            max_entries=int(os.getenv('RELAY_DEDUP_MAX_ENTRIES', DEFAULT_DEDUP_MAX_ENTRIES)),
+            max_hops=int(os.getenv('RELAY_MAX_HOPS', DEFAULT_MAX_HOPS)),
+        )
+
+    def __len__(self) -> int:
+        return len(self.current) + len(self.previous)
+
+    def first_seen(self, msg_id: str, message_type: str) -> bool:
+        """
+        Records msg_id.
+
+        Returns:
+            True the first time msg_id is seen, False for a duplicate, which
+            is counted under message_type.
+        """
+        now = self.clock()
+        if len(self.current) >= self.generation_size or now - self.started >= self.ttl:
+            # After a quiet spell the current generation is already expired too
+            self.previous = self.current if now - self.started < 2 * self.ttl else set()
+            self.current = set()
+            self.started = now
+
+        if msg_id in self.current or msg_id in self.previous:
+            self.duplicates[message_type] = self.duplicates.get(message_type, 0) + 1
+            return False
+        self.current.add(msg_id)
+        return True
+
+    def may_forward(self, hops: int) -> bool:
+        """
+        Returns whether a message relayed hops times so far may go to another server.
+        """
+        if hops < self.max_hops:
+            return True
+        self.hop_limited += 1
+        return False
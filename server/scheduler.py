@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import os
+from collections import deque
+
+DEFAULT_WORKERS = 8
+DEFAULT_MAX_PENDING = 32
+
+
+class FairScheduler():
+    """
+    Interleaves message handling across connections.
+
+    Every connection has its own queue of pending work. Workers take connections
+    round-robin and run one item of the connection at a time, so messages of a
+    connection are handled in order while a busy connection only gets its turn
+    like everyone else. A connection with max_pending items queued waits in
+    submit(), which stops its websocket from being read.
+    """
+    def __init__(self, workers: int = DEFAULT_WORKERS, max_pending: int = DEFAULT_MAX_PENDING,
+                 logger: logging.Logger | None = None):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.logger = logger or logging.getLogger(__name__)
+
+        # { connection key : deque of (function, args) }
+        self.queues = {}
+        self.slots = {}
+        self.ready = deque()
+        self.active = set()
+        self.closing = set()
+        self.wakeup = None
+        self.tasks = []
+
+    @classmethod
+    def from_env(cls, logger: logging.Logger | None = None) -> "FairScheduler":
+        """
+        Builds a scheduler from SCHEDULER_WORKERS and SCHEDULER_MAX_PENDING.
+        """
+        return cls(
+            workers=int(os.getenv('SCHEDULER_WORKERS', DEFAULT_WORKERS)),
+            max_pending=int(os.getenv('SCHEDULER_MAX_PENDING', DEFAULT_MAX_PENDING)),
+            logger=logger,
+        )
+
+    def start(self) -> None:
+        """
+        Starts the worker tasks on the running event loop.
+        """
+        self.wakeup = asyncio.Event()
+        self.tasks = [asyncio.ensure_future(self.worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        """
+        Cancels the worker tasks.
+        """
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def submit(self, key, function, *args, last: bool = False) -> None:
+        """
+        Queues function(*args) to run for the connection identified by key.
+
+        Runs the work inline if the scheduler has not been started. Passing
+        last=True marks the final item of a connection, after which its queue
+        is dropped.
+        """
+        if not self.tasks:
+            await function(*args)
+            return
+
+        slots = self.slots.get(key)
+        if slots is None:
+            slots = self.slots[key] = asyncio.Semaphore(self.max_pending)
+            self.queues[key] = deque()
+        await slots.acquire()
+
+        queue = self.queues[key]
+        queue.append((function, args))
+        if last:
+            self.closing.add(key)
+        if len(queue) == 1 and key not in self.active:
+            self.ready.append(key)
+            self.wakeup.set()
+
+    def pending(self) -> int:
+        """
+        Total number of queued items over all connections.
+        """
+        return sum(len(queue) for queue in self.queues.values())
+
+    async def worker(self) -> None:
+        """
+        Runs queued work, one item per connection per turn.
+        """
+        while True:
+            if not self.ready:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            key = self.ready.popleft()
+            queue = self.queues[key]
+            function, args = queue.popleft()
+            self.active.add(key)
+
+            try:
+                await function(*args)
+            except Exception as e:
+                self.logger.error(f"Exception occured while handling message: {e}", exc_info=True)
+            finally:
+                self.active.discard(key)
+                self.slots[key].release()
+
+                if queue:
+                    self.ready.append(key)
+                    self.wakeup.set()
+                elif key in self.closing:
+                    # Connection is gone and all of its work is done
+                    del self.queues[key]
+                    del self.slots[key]
+                    self.closing.discard(key)
+
+            # Give other connections and the websocket readers a turn.
+            await asyncio.sleep(0)
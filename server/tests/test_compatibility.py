@@ -0,0 +1,333 @@
+import asyncio
+import base64
+import json
+import os
+import socket
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import websockets
+from websockets.asyncio.server import serve
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from security.security_module import Encryption
+from protocol.envelope import encode_chat_envelope, is_envelope
+from protocol.membership import membership_digest
+
+# The server module creates its upload and key directories on import
+_cwd = os.getcwd()
+_directory = tempfile.TemporaryDirectory()
+os.chdir(_directory.name)
+try:
+    from OlafServer import WebSocketServer
+finally:
+    os.chdir(_cwd)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Peer():
+    """
+    A client or server speaking the unmodified OLAF message formats.
+    """
+    def __init__(self, encryption, public_pem, private_pem):
+        self.encryption = encryption
+        self.public_pem = public_pem
+        self.private_pem = private_pem
+        self.counter = 0
+        self.websocket = None
+
+    async def connect(self, port):
+        self.websocket = await websockets.connect(f"ws://127.0.0.1:{port}", compression=None)
+
+    async def send_signed(self, data, **fields):
+        self.counter += 1
+        payload = json.dumps({"counter": self.counter, "data": data}, separators=(',', ':'), sort_keys=True).encode()
+        signature = base64.b64encode(self.encryption.sign_message(payload, self.private_pem)).decode()
+        frame = json.dumps({"type": "signed_data", "data": data, "counter": self.counter, "signature": signature, **fields})
+        await self.websocket.send(frame)
+        return frame
+
+    async def send_envelope(self, data):
+        """
+        Sends a chat as a binary envelope, returning the envelope and the equivalent JSON message.
+        """
+        self.counter += 1
+        payload = json.dumps({"counter": self.counter, "data": data}, separators=(',', ':'), sort_keys=True).encode()
+        signature = self.encryption.sign_message(payload, self.private_pem)
+        envelope = encode_chat_envelope(data, self.counter, signature)
+        await self.websocket.send(envelope)
+        return envelope, {"type": "signed_data", "data": data, "counter": self.counter,
+                          "signature": base64.b64encode(signature).decode()}
+
+    async def receive(self, timeout=2):
+        return await asyncio.wait_for(self.websocket.recv(), timeout)
+
+    async def receive_envelope(self, timeout=2):
+        while True:
+            frame = await self.receive(timeout)
+            if is_envelope(frame):
+                return frame
+
+    async def receive_type(self, message_type, timeout=2):
+        while True:
+            frame = await self.receive(timeout)
+            if is_envelope(frame):
+                continue
+            message = json.loads(frame)
+            if message.get("type") == message_type or message.get("data", {}).get("type") == message_type:
+                return message
+
+
+class TestStockPeers(unittest.IsolatedAsyncioTestCase):
+    """
+    Extensions are only used with peers that advertise them: stock peers get the standard formats.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.encryption = Encryption()
+        cls.keys = [cls.encryption.generate_rsa_key_pair() for _ in range(3)]
+
+    async def asyncSetUp(self):
+        self.port = free_port()
+        self.server = WebSocketServer('127.0.0.1', '127.0.0.1', self.port, free_port(), [])
+        self.server.public_pem, self.server.private_pem = self.keys[2]
+        self.server.private_key = self.encryption.load_private_key(self.server.private_pem)
+        self.server.client_list_delay = 0
+        self.server.groups_path = os.path.join(_directory.name, f"{self.port}_groups.json")
+        self.server.batching.enabled = True
+        self.server.scheduler.start()
+        self.server.server = await serve(self.server.recv, '127.0.0.1', self.port, compression=None)
+        self.peers = []
+
+    async def asyncTearDown(self):
+        for peer in self.peers:
+            await peer.websocket.close()
+        self.server.server.close()
+        await self.server.server.wait_closed()
+        await self.server.scheduler.stop()
+
+    async def peer(self, keys=0):
+        peer = Peer(self.encryption, *self.keys[keys])
+        await peer.connect(self.port)
+        self.peers.append(peer)
+        return peer
+
+    async def hello(self, peer, **extra):
+        await peer.send_signed({"type": "hello", "public_key": peer.public_pem.decode(), **extra})
+        return await peer.receive_type("client_list")
+
+    async def test_stock_client_gets_standard_client_list(self):
+        client = await self.peer()
+        client_list = await self.hello(client)
+        self.assertEqual(set(client_list), {"type", "servers"})
+        self.assertEqual(client_list["servers"][-1]["clients"], [client.public_pem.decode()])
+
+    async def test_client_with_capabilities_gets_digest(self):
+        client = await self.peer()
+        client_list = await self.hello(client, capabilities=["list_digest"])
+        locations = {client.encryption.generate_fingerprint(pem.encode()): server["address"]
+                     for server in client_list["servers"] for pem in server["clients"]}
+        self.assertEqual(client_list["digest"], membership_digest(locations))
+
+    async def test_stock_client_gets_public_chat_unchanged(self):
+        sender = await self.peer(0)
+        receiver = await self.peer(1)
+        await self.hello(sender)
+        await self.hello(receiver)
+
+        frame = await sender.send_signed({"type": "public_chat", "sender": "abc", "message": "hi"})
+        self.assertEqual(await receiver.receive(), frame)
+
+    async def test_repeated_type_key_does_not_escape_public_chat_budget(self):
+        sender = await self.peer(0)
+        receiver = await self.peer(1)
+        await self.hello(sender)
+        await self.hello(receiver)
+
+        # Pre-scanned and charged as client_update_request, decoded as a public_chat
+        frame = '{"type":"client_update_request",' + json.dumps(
+            {"type": "signed_data", "data": {"type": "public_chat", "sender": "abc", "message": "hi"},
+             "counter": 1, "signature": "c2ln"})[1:]
+        for _ in range(30):
+            await sender.websocket.send(frame)
+        errors = []
+        while len(errors) < 30:
+            message = json.loads(await sender.receive())
+            if "error" in message:
+                errors.append(message["error"])
+        self.assertEqual(set(errors), {"Message type does not match the start of the frame."})
+        with self.assertRaises(asyncio.TimeoutError):
+            await receiver.receive_type("public_chat", timeout=0.3)
+
+    async def test_stock_server_gets_standard_relays(self):
+        neighbour = await self.peer(0)
+        await neighbour.send_signed({"type": "server_hello", "sender": "127.0.0.1:1"})
+        client = await self.peer(1)
+        await self.hello(client)
+
+        frame = await client.send_signed({"type": "public_chat", "sender": "abc", "message": "hi"})
+        relayed = await neighbour.receive_type("public_chat")
+        self.assertEqual(relayed, json.loads(frame))
+
+    async def test_server_with_capabilities_gets_relay_fields(self):
+        neighbour = await self.peer(0)
+        await neighbour.send_signed({"type": "server_hello", "sender": "127.0.0.1:1", "capabilities": ["relay_ids"]})
+        server_hello = await neighbour.receive_type("server_hello")
+        self.assertIn("relay_ids", server_hello["data"]["capabilities"])
+
+        client = await self.peer(1)
+        await self.hello(client)
+        await client.send_signed({"type": "public_chat", "sender": "abc", "message": "hi"})
+        relayed = await neighbour.receive_type("public_chat")
+        self.assertEqual(relayed["hops"], 1)
+        self.assertIn("msg_id", relayed)
+
+    async def test_client_relay_fields_are_ignored(self):
+        neighbour = await self.peer(0)
+        await neighbour.send_signed({"type": "server_hello", "sender": "127.0.0.1:1", "capabilities": ["relay_ids"]})
+        client = await self.peer(1)
+        await self.hello(client)
+
+        # Claiming the ID of another message must not get that message dropped
+        for message in ("one", "two"):
+            await client.send_signed({"type": "public_chat", "sender": "abc", "message": message}, msg_id="xyz", hops=7)
+        relayed = [await neighbour.receive_type("public_chat") for _ in range(2)]
+        self.assertEqual([message["data"]["message"] for message in relayed], ["one", "two"])
+        self.assertEqual([message["hops"] for message in relayed], [1, 1])
+        self.assertNotIn("xyz", [message["msg_id"] for message in relayed])
+
+    def chat_data(self):
+        return {
+            "type": "chat",
+            "destination_servers": [f"127.0.0.1:{self.port}"],
+            "iv": base64.b64encode(b"\x01" * 12).decode(),
+            "symm_keys": [base64.b64encode(b"\x02" * 256).decode()],
+            "chat": base64.b64encode(b"ciphertext and tag").decode(),
+        }
+
+    async def test_client_with_capabilities_gets_server_capabilities(self):
+        client = await self.peer()
+        client_list = await self.hello(client, capabilities=["binary_chat"])
+        self.assertIn("binary_chat", client_list["capabilities"])
+
+    async def test_binary_chat_reaches_binary_and_stock_clients(self):
+        sender = await self.peer(0)
+        binary = await self.peer(1)
+        stock = await self.peer(2)
+        await self.hello(sender, capabilities=["binary_chat"])
+        await self.hello(binary, capabilities=["binary_chat"])
+        await self.hello(stock)
+
+        envelope, message = await sender.send_envelope(self.chat_data())
+        self.assertEqual(await binary.receive_envelope(), envelope)
+        self.assertEqual(await stock.receive_type("chat"), message)
+
+    async def test_binary_chat_relayed_as_json_to_stock_server(self):
+        neighbour = await self.peer(0)
+        await neighbour.send_signed({"type": "server_hello", "sender": "127.0.0.1:1"})
+        client = await self.peer(1)
+        await self.hello(client, capabilities=["binary_chat"])
+
+        data = dict(self.chat_data(), destination_servers=["127.0.0.1:1"])
+        _, message = await client.send_envelope(data)
+        self.assertEqual(await neighbour.receive_type("chat"), message)
+
+    async def test_malformed_envelope_is_rejected(self):
+        client = await self.peer()
+        await self.hello(client, capabilities=["binary_chat"])
+        envelope, _ = await client.send_envelope(self.chat_data())
+        await client.websocket.send(envelope[:-1])
+        self.assertEqual(await client.receive_type(None), {"error": "Malformed binary envelope."})
+
+
+    async def test_group_chat_reaches_members_only(self):
+        sender = await self.peer(0)
+        member = await self.peer(1)
+        outsider = await self.peer(2)
+        await self.hello(sender, capabilities=["groups"])
+        await self.hello(member, capabilities=["groups"])
+        await self.hello(outsider)
+
+        await sender.websocket.send(json.dumps({"type": "group_join", "group": "team"}))
+        self.assertEqual(len((await sender.receive_type("group_members"))["members"]), 1)
+        await member.websocket.send(json.dumps({"type": "group_join", "group": "team"}))
+        group_members = await member.receive_type("group_members")
+        self.assertEqual(group_members["group"], "team")
+        self.assertEqual(len(group_members["members"]), 2)
+        self.assertEqual(await sender.receive_type("group_members"), group_members)
+
+        frame = await sender.send_signed(dict(self.chat_data(), destination_servers=[], group="team"))
+        self.assertEqual(await member.receive_type("chat"), json.loads(frame))
+        with self.assertRaises(asyncio.TimeoutError):
+            await outsider.receive_type("chat", timeout=0.3)
+
+    async def test_group_chat_from_non_member_is_rejected(self):
+        client = await self.peer()
+        await self.hello(client, capabilities=["groups"])
+        await client.send_signed(dict(self.chat_data(), destination_servers=[], group="team"))
+        self.assertEqual(await client.receive_type(None), {"error": "Not a member of this group."})
+
+
+    def overload(self):
+        """
+        Makes the server redirect new clients to a neighbour with no clients.
+        """
+        self.server.load_balancer.redirect = True
+        self.server.load_balancer.min_clients = 0
+        self.server.load_balancer.update_local("localhost:1", 2, 10, 0, 0)
+        self.server.load_balancer.apply({"server": "127.0.0.1:1", "address": "localhost:3", "http_port": 4,
+                                         "clients": 0, "send_queue": 0, "loop_lag_ms": 0})
+
+    async def test_overloaded_server_redirects_clients_that_follow_redirects(self):
+        self.overload()
+        await self.hello(await self.peer(0))
+        client = await self.peer(1)
+        await client.send_signed({"type": "hello", "public_key": client.public_pem.decode(), "capabilities": ["redirect"]})
+        self.assertEqual(await client.receive_type("redirect"), {"type": "redirect", "address": "localhost:3", "http_port": 4})
+        self.assertEqual(len(self.server.clients), 1)
+
+    async def test_stock_client_is_not_redirected(self):
+        self.overload()
+        await self.hello(await self.peer(0))
+        client = await self.peer(1)
+        client_list = await self.hello(client)
+        self.assertIn(client.public_pem.decode(), client_list["servers"][-1]["clients"])
+
+    async def test_neighbour_load_report_is_recorded(self):
+        neighbour = await self.peer(0)
+        await neighbour.send_signed({"type": "server_hello", "sender": "127.0.0.1:1", "capabilities": ["load_report"]})
+        self.assertIn("load_report", (await neighbour.receive_type("server_hello"))["data"]["capabilities"])
+        load_report = await neighbour.receive_type("load_report")
+        self.assertEqual(load_report["server"], f"127.0.0.1:{self.port}")
+
+        await neighbour.websocket.send(json.dumps({"type": "load_report", "server": "127.0.0.1:1", "address": "localhost:3",
+                                                   "http_port": 4, "clients": 0, "send_queue": 0, "loop_lag_ms": 0}))
+        client = await self.peer(1)
+        await self.hello(client)
+        self.server.local_load_report()
+        response = await self.server.handle_server_list(None)
+        self.assertEqual(json.loads(response.body)["recommended"]["address"], "localhost:3")
+
+    async def test_external_address_is_read_when_the_server_is_created(self):
+        self.assertEqual(self.server.client_address(), f"127.0.0.1:{self.port}")
+        # e.g. loaded from .env after the module was imported
+        with mock.patch.dict(os.environ, {"EXTERNAL_ADDRESS": "olaf.example"}):
+            server = WebSocketServer('127.0.0.1', '127.0.0.1', self.port, 81, [])
+        self.assertEqual(server.client_address(), f"olaf.example:{self.port}")
+
+
+def tearDownModule():
+    _directory.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
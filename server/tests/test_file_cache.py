@@ -0,0 +1,98 @@
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from file_io import FileIO
+from file_cache import FileCache
+
+
+class CountingFileIO(FileIO):
+
+    def __init__(self):
+        super().__init__(workers=2)
+        self.reads = 0
+
+    async def read_bytes(self, path: str) -> bytes:
+        self.reads += 1
+        return await super().read_bytes(path)
+
+
+class TestFileCache(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_io = CountingFileIO()
+        self.cache = FileCache(self.file_io, max_bytes=100, max_file_size=50)
+
+    async def asyncTearDown(self):
+        self.file_io.shutdown()
+        self.directory.cleanup()
+
+    def write(self, name: str, data: bytes) -> str:
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    async def test_small_file_served_from_memory(self):
+        path = self.write("notes.txt", b"hello")
+        entries = await asyncio.gather(*(self.cache.get(path) for _ in range(10)))
+
+        self.assertEqual({entry.body for entry in entries}, {b"hello"})
+        self.assertEqual(entries[0].headers["Content-Type"], "text/plain")
+        self.assertEqual(self.file_io.reads, 1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (9, 1))
+
+    async def test_large_file_keeps_headers_only(self):
+        path = self.write("big.bin", b"x" * 80)
+        entry = await self.cache.get(path)
+
+        self.assertIsNone(entry.body)
+        self.assertEqual(entry.size, 80)
+        self.assertEqual(self.cache.cached_bytes, 0)
+        self.assertEqual(self.file_io.reads, 0)
+
+    async def test_missing_file(self):
+        self.assertIsNone(await self.cache.get(os.path.join(self.directory.name, "missing")))
+        self.assertIsNone(await self.cache.get(self.directory.name))
+
+    async def test_lru_eviction(self):
+        paths = [self.write(f"{i}.bin", bytes([i]) * 40) for i in range(3)]
+        await self.cache.get(paths[0])
+        await self.cache.get(paths[1])
+        await self.cache.get(paths[0])
+        await self.cache.get(paths[2])
+
+        self.assertEqual(list(self.cache.entries), [paths[0], paths[2]])
+        self.assertEqual(self.cache.cached_bytes, 80)
+        self.assertEqual(self.cache.evictions, 1)
+
+    async def test_invalidate_after_upload(self):
+        path = self.write("notes.txt", b"old")
+        await self.cache.get(path)
+        self.write("notes.txt", b"newer")
+        self.cache.invalidate(path)
+
+        self.assertEqual((await self.cache.get(path)).body, b"newer")
+        self.assertEqual(self.cache.cached_bytes, 5)
+
+    async def test_compressed_variant(self):
+        text = b"the same line of text over and over\n" * 40
+        self.cache.max_file_size = self.cache.max_bytes = 4096
+        entry = await self.cache.get(self.write("notes.txt", text))
+
+        variant = await self.cache.variant(entry, "gzip")
+        self.assertLess(len(variant), len(text) // 4)
+        self.assertIs(await self.cache.variant(entry, "gzip"), variant)
+        self.assertEqual(self.cache.cached_bytes, len(text) + len(variant))
+
+        binary = await self.cache.get(self.write("image.png", text))
+        self.assertIsNone(await self.cache.variant(binary, "gzip"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from file_io import FileIO
+
+
+class TestFileIO(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_io = FileIO(workers=2, max_pending=4, write_batch_size=10)
+
+    async def asyncTearDown(self):
+        self.file_io.shutdown()
+        self.directory.cleanup()
+
+    async def test_runs_off_the_loop(self):
+        loop_thread = threading.get_ident()
+        thread = await self.file_io.run(threading.get_ident)
+        self.assertNotEqual(thread, loop_thread)
+        self.assertEqual(self.file_io.pending, 0)
+
+    async def test_read_write_list(self):
+        path = os.path.join(self.directory.name, "key.pem")
+        await self.file_io.write_bytes(path, b"key")
+
+        self.assertTrue(await self.file_io.exists(path))
+        self.assertEqual(await self.file_io.read_bytes(path), b"key")
+        self.assertEqual(await self.file_io.listdir(self.directory.name), ["key.pem"])
+        self.assertEqual((await self.file_io.stat(path)).st_size, 3)
+
+    async def test_batched_writer(self):
+        path = os.path.join(self.directory.name, "upload.bin")
+        writer = await self.file_io.open_writer(path)
+        chunks = [bytes([i]) * 7 for i in range(5)]
+        for chunk in chunks:
+            await writer.write(chunk)
+        await writer.close()
+
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b"".join(chunks))
+        self.assertEqual(writer.size, 35)
+
+    async def test_batched_writer_abort_removes_file(self):
+        path = os.path.join(self.directory.name, "upload.bin")
+        writer = await self.file_io.open_writer(path)
+        await writer.write(b"x" * 25)
+        await writer.abort()
+        await writer.abort()
+
+        self.assertFalse(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
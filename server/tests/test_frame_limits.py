@@ -0,0 +1,84 @@
+import json
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from frame_limits import FrameLimits, prescan_type, parse_type_limits
+from protocol.envelope import encode_chat_envelope
+
+
+class TestPrescanType(unittest.TestCase):
+
+    def test_signed_data(self):
+        frame = json.dumps({"type": "signed_data", "data": {"type": "public_chat", "sender": "a", "message": "b"}})
+        self.assertEqual(prescan_type(frame), ("signed_data", "public_chat"))
+        self.assertEqual(prescan_type(frame.encode()), ("signed_data", "public_chat"))
+
+    def test_binary_envelope(self):
+        frame = encode_chat_envelope({"type": "chat", "destination_servers": [], "iv": "", "symm_keys": [], "chat": ""}, 1, b"")
+        self.assertEqual(prescan_type(frame), ("signed_data", "chat"))
+
+    def test_unsigned(self):
+        self.assertEqual(prescan_type('{"type": "client_list_request"}'), ("client_list_request", None))
+
+    def test_type_not_first(self):
+        frame = json.dumps({"data": {"type": "hello"}, "type": "signed_data"})
+        self.assertEqual(prescan_type(frame), (None, None))
+
+    def test_not_json(self):
+        self.assertEqual(prescan_type("hello"), (None, None))
+
+
+class TestFrameLimits(unittest.TestCase):
+
+    def setUp(self):
+        self.limits = FrameLimits(max_client_frame_size=1000, max_neighbour_frame_size=5000,
+                                  type_limits={"public_chat": 200})
+
+    def public_chat(self, size):
+        return json.dumps({"type": "signed_data", "data": {"type": "public_chat", "sender": "a", "message": "x" * size}})
+
+    def test_accepts_small_frames(self):
+        self.assertEqual(self.limits.check_frame(self.public_chat(10), False), ("public_chat", None))
+        self.assertEqual(self.limits.rejected_frames, {})
+
+    def test_connection_limit(self):
+        frame = '{"type": "client_update", "clients": ["' + "x" * 2000 + '"]}'
+        message_type, error = self.limits.check_frame(frame, False)
+        self.assertIsNotNone(error)
+        self.assertEqual(self.limits.rejected_bytes["connection_limit"], len(frame))
+
+        self.assertEqual(self.limits.check_frame(frame, True), ("client_update", None))
+
+    def test_type_limit(self):
+        frame = self.public_chat(500)
+        message_type, error = self.limits.check_frame(frame, False)
+        self.assertEqual(message_type, "public_chat")
+        self.assertIsNotNone(error)
+        self.assertEqual(self.limits.rejected_frames["type_limit"], 1)
+
+    def test_unknown_type(self):
+        message_type, error = self.limits.check_frame('{"type": "bogus"}', False)
+        self.assertIsNotNone(error)
+        self.assertEqual(self.limits.rejected_frames["unknown_type"], 1)
+
+    def test_repeated_type_key(self):
+        # Pre-scanned as client_update_request, decoded as a public_chat over its limit
+        frame = '{"type": "client_update_request", ' + self.public_chat(500)[1:]
+        self.assertEqual(self.limits.check_frame(frame, False), ("client_update_request", None))
+        error = self.limits.check_decoded_type("client_update_request", json.loads(frame), len(frame))
+        self.assertIsNotNone(error)
+        self.assertEqual(self.limits.rejected_frames["type_mismatch"], 1)
+
+        frame = self.public_chat(10)
+        self.assertIsNone(self.limits.check_decoded_type("public_chat", json.loads(frame), len(frame)))
+
+    def test_parse_type_limits(self):
+        self.assertEqual(parse_type_limits("public_chat=10, chat=20"), {"public_chat": 10, "chat": 20})
+        self.assertEqual(parse_type_limits(None), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
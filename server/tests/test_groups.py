@@ -0,0 +1,98 @@
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from groups import GroupDirectory
+
+
+def update(server, version, groups):
+    return {"type": "group_update", "server": server, "version": version,
+            "groups": [{"group": group, "members": members} for group, members in groups.items()]}
+
+
+class TestGroupDirectory(unittest.TestCase):
+
+    def setUp(self):
+        self.groups = GroupDirectory("127.0.0.1:9000", max_groups=2, max_members=2)
+
+    def test_join_and_leave(self):
+        self.assertTrue(self.groups.join("team", "a"))
+        self.assertFalse(self.groups.join("team", "a"))
+        self.assertEqual(self.groups.members("team"), {"a"})
+        self.assertEqual(self.groups.groups_of("a"), ["team"])
+        self.assertTrue(self.groups.leave("team", "a"))
+        self.assertFalse(self.groups.leave("team", "a"))
+        self.assertEqual(self.groups.groups(), {})
+
+    def test_limits(self):
+        self.groups.join("team", "a")
+        self.groups.join("team", "b")
+        with self.assertRaisesRegex(ValueError, "full"):
+            self.groups.join("team", "c")
+        self.groups.join("other", "a")
+        with self.assertRaisesRegex(ValueError, "Too many"):
+            self.groups.join("third", "a")
+        with self.assertRaisesRegex(ValueError, "Invalid"):
+            self.groups.join("", "a")
+
+    def test_members_across_servers(self):
+        self.groups.join("team", "a")
+        changed = self.groups.apply(update("127.0.0.1:9001", 1, {"team": ["b"]}))
+        self.assertEqual(changed, {"team"})
+        self.assertEqual(self.groups.members("team"), {"a", "b"})
+
+        self.assertEqual(self.groups.apply(update("127.0.0.1:9001", 2, {})), {"team"})
+        self.assertEqual(self.groups.members("team"), {"a"})
+
+    def test_stale_updates_are_ignored(self):
+        self.groups.apply(update("127.0.0.1:9001", 2, {"team": ["b"]}))
+        self.assertIsNone(self.groups.apply(update("127.0.0.1:9001", 1, {})))
+        self.assertIsNone(self.groups.apply(update("127.0.0.1:9000", 5, {"team": ["c"]})))
+        self.assertEqual(self.groups.members("team"), {"b"})
+
+    def test_unchanged_update_reports_nothing(self):
+        self.groups.apply(update("127.0.0.1:9001", 1, {"team": ["b"]}))
+        self.assertEqual(self.groups.apply(update("127.0.0.1:9001", 2, {"team": ["b"]})), set())
+
+    def test_malformed_entries_are_skipped(self):
+        message = update("127.0.0.1:9001", 1, {"team": ["b"]})
+        message["groups"] += ["team", {"group": "x" * 100, "members": ["c"]}, {"group": "other", "members": "c"}]
+        self.assertEqual(self.groups.apply(message), {"team"})
+        self.assertEqual(set(self.groups.groups()), {"team"})
+
+    def test_memberships_move_with_the_client(self):
+        other = GroupDirectory("127.0.0.1:9001")
+        other.join("team", "a")
+        self.groups.apply(other.originate())
+
+        # The client connects here: this server claims it, the old one releases it
+        self.assertEqual(self.groups.claim("a"), ["team"])
+        self.assertEqual(self.groups.claim("a"), [])
+        other.apply(self.groups.originate())
+        self.assertTrue(other.release("127.0.0.1:9000", connected=set()))
+        self.assertEqual(other.local, {})
+        self.assertEqual(other.members("team"), {"a"})
+
+    def test_connected_clients_are_not_released(self):
+        self.groups.join("team", "a")
+        self.groups.apply(update("127.0.0.1:9001", 1, {"team": ["a"]}))
+        self.assertFalse(self.groups.release("127.0.0.1:9001", connected={"a"}))
+        self.assertEqual(self.groups.local, {"team": {"a"}})
+
+    def test_versions_increase(self):
+        first = self.groups.originate()["version"]
+        self.assertGreater(self.groups.originate()["version"], first)
+
+    def test_snapshot_round_trip(self):
+        self.groups.join("team", "a")
+        self.groups.join("team", "b")
+        restored = GroupDirectory("127.0.0.1:9000")
+        restored.restore(self.groups.snapshot())
+        self.assertEqual(restored.members("team"), {"a", "b"})
+        with self.assertRaises(ValueError):
+            restored.restore(b"[]")
+
+
+if __name__ == '__main__':
+    unittest.main()
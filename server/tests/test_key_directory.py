@@ -0,0 +1,150 @@
+import asyncio
+import base64
+import json
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from security.security_module import Encryption
+from key_directory import KeyDirectory, KeyFetcher
+
+
+class TestKeyDirectory(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.encryption = Encryption()
+        cls.pems = [cls.encryption.generate_rsa_key_pair()[0].decode() for _ in range(3)]
+
+    def setUp(self):
+        self.directory = KeyDirectory(self.encryption)
+
+    def test_record_is_parsed_once(self):
+        record = self.directory.record(self.pems[0])
+        self.assertIs(self.directory.record(self.pems[0]), record)
+        self.assertEqual(record.fingerprint, self.encryption.generate_fingerprint(self.pems[0].encode()))
+
+        der = base64.b64decode(record.der)
+        public_key = self.encryption.load_der_public_key(der)
+        self.assertEqual(self.encryption.export_public_key(public_key).decode(), self.pems[0])
+
+    def test_invalid_key(self):
+        self.assertIsNone(self.directory.record("not a key"))
+
+    def test_non_canonical_pem_is_sent_as_is(self):
+        pem = self.pems[0].replace("\n", "\r\n")
+        record = self.directory.record(pem)
+        self.assertIsNone(record.der)
+        self.assertEqual(json.loads(record.full), {"fingerprint": record.fingerprint, "pem": pem})
+
+    def test_compact_list_sends_keys_once(self):
+        servers = [("server1:9000", self.pems[:2]), ("server2:8000", self.pems[2:] + ["bad"])]
+        sent = set()
+
+        first = json.loads(self.directory.compact_client_list(servers, sent))
+        self.assertEqual(first["key_format"], "der")
+        self.assertEqual([server["address"] for server in first["servers"]], ["server1:9000", "server2:8000"])
+        self.assertTrue(all(isinstance(entry, dict) for server in first["servers"] for entry in server["clients"]))
+        self.assertEqual(len(sent), 3)
+
+        second = json.loads(self.directory.compact_client_list(servers, sent))
+        fingerprints = [entry for server in second["servers"] for entry in server["clients"]]
+        self.assertEqual(fingerprints, [self.directory.record(pem).fingerprint for pem in self.pems])
+
+    def test_fingerprint_only_list(self):
+        servers = [("server1:9000", self.pems)]
+        sent = set()
+        message = json.loads(self.directory.compact_client_list(servers, sent, include_keys=False))
+        self.assertEqual(message["key_format"], "fingerprint")
+        self.assertEqual(message["servers"][0]["clients"], [self.directory.record(pem).fingerprint for pem in self.pems])
+        self.assertEqual(sent, set())
+
+    def test_update_and_lookup(self):
+        self.directory.update([("server1:9000", self.pems)])
+        fingerprint = self.directory.record(self.pems[2]).fingerprint
+        self.assertEqual(self.directory.lookup(fingerprint).pem, self.pems[2])
+
+        self.directory.update([("server1:9000", self.pems[:1])])
+        self.assertEqual(list(self.directory.by_pem), self.pems[:1])
+        self.assertIsNone(self.directory.lookup(fingerprint))
+
+    def test_record_from_entry(self):
+        record = self.directory.record(self.pems[0])
+        self.assertEqual(self.directory.record_from_entry(json.loads(record.full)), record)
+
+        other = self.directory.record(self.pems[1])
+        self.assertIsNone(self.directory.record_from_entry({"fingerprint": other.fingerprint, "key": record.der}))
+        self.assertIsNone(self.directory.record_from_entry({"fingerprint": record.fingerprint, "key": "not base64!"}))
+        self.assertIsNone(self.directory.record_from_entry({"fingerprint": record.fingerprint}))
+
+    def test_fetched_keys_are_bounded(self):
+        directory = KeyDirectory(self.encryption, max_fetched=2)
+        records = [directory.record(pem) for pem in self.pems]
+        for record in records:
+            directory.add_fetched(record)
+        self.assertEqual(list(directory.fetched), [record.fingerprint for record in records[1:]])
+        self.assertEqual(directory.lookup(records[2].fingerprint), records[2])
+
+
+class Neighbour():
+    def __init__(self, server_addr):
+        self.server_addr = server_addr
+
+
+class TestKeyFetcher(unittest.IsolatedAsyncioTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.encryption = Encryption()
+        cls.pems = [cls.encryption.generate_rsa_key_pair()[0].decode() for _ in range(2)]
+
+    def setUp(self):
+        self.directory = KeyDirectory(self.encryption)
+        self.fetcher = KeyFetcher(self.directory, timeout=1)
+        self.neighbours = [Neighbour("server1:9000"), Neighbour("server2:8000")]
+        self.requests = []
+
+    async def send(self, neighbour, fingerprints):
+        self.requests.append((neighbour, list(fingerprints)))
+
+    async def test_concurrent_lookups_share_one_request(self):
+        record = self.directory.record(self.pems[0])
+        lookups = [asyncio.ensure_future(self.fetcher.fetch([record.fingerprint], self.neighbours, self.send))
+                   for _ in range(10)]
+        await asyncio.sleep(0)
+
+        self.assertEqual(len(self.requests), len(self.neighbours))
+        self.assertEqual(self.fetcher.coalesced, 9)
+
+        self.fetcher.resolve(self.neighbours[1], [record], [])
+        results = await asyncio.gather(*lookups)
+        self.assertTrue(all(result == {record.fingerprint: record} for result in results))
+        self.assertEqual(self.directory.lookup(record.fingerprint), record)
+        self.assertEqual(self.fetcher.pending, {})
+
+    async def test_missing_once_every_neighbour_answers(self):
+        lookup = asyncio.ensure_future(self.fetcher.fetch(["abc"], self.neighbours, self.send))
+        await asyncio.sleep(0)
+
+        self.fetcher.resolve(self.neighbours[0], [], ["abc"])
+        await asyncio.sleep(0)
+        self.assertFalse(lookup.done())
+
+        self.fetcher.resolve(self.neighbours[1], [], ["abc"])
+        self.assertEqual(await lookup, {"abc": None})
+        self.assertEqual(self.fetcher.not_found, 1)
+
+    async def test_timeout(self):
+        self.fetcher.timeout = 0.01
+        self.assertEqual(await self.fetcher.fetch(["abc"], self.neighbours, self.send), {"abc": None})
+        self.assertEqual(self.fetcher.pending, {})
+
+    async def test_no_neighbours(self):
+        self.assertEqual(await self.fetcher.fetch(["abc"], [], self.send), {"abc": None})
+        self.assertEqual(self.requests, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
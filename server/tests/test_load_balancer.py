@@ -0,0 +1,89 @@
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from load_balancer import LoadBalancer, LoadReport
+
+
+class Clock():
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def report(server, clients, send_queue=0, loop_lag_ms=0):
+    return {"type": "load_report", "server": server, "address": f"external:{server[-4:]}", "http_port": 1,
+            "clients": clients, "send_queue": send_queue, "loop_lag_ms": loop_lag_ms}
+
+
+class TestLoadBalancer(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.balancer = LoadBalancer("server1:9000", interval=2, redirect=True, margin=0.5, min_clients=10,
+                                     clock=self.clock)
+
+    def test_load_counts_queues_and_lag(self):
+        self.assertEqual(LoadReport("a", "a", 1, 10, 0, 0, 0).load(), 10)
+        self.assertEqual(LoadReport("a", "a", 1, 10, 64 * 1024, 0, 0).load(), 11)
+        self.assertEqual(LoadReport("a", "a", 1, 10, 0, 50, 0).load(), 20)
+
+    def test_recommends_least_loaded(self):
+        self.balancer.update_local("external:9000", 9001, 20, 0, 0)
+        self.assertTrue(self.balancer.apply(report("server2:8000", 5)))
+        self.assertTrue(self.balancer.apply(report("server3:7000", 10)))
+        self.assertEqual(self.balancer.recommend().server, "server2:8000")
+
+    def test_recommendations_are_spread(self):
+        self.balancer.update_local("external:9000", 9001, 3, 0, 0)
+        self.balancer.apply(report("server2:8000", 0))
+        servers = [self.balancer.recommend().server for _ in range(6)]
+        self.assertEqual(servers.count("server2:8000"), 4)
+        self.assertEqual(servers.count("server1:9000"), 2)
+
+        # A new report replaces the estimate
+        self.balancer.apply(report("server2:8000", 0))
+        self.assertEqual(self.balancer.assigned.get("server2:8000"), None)
+
+    def test_reports_expire(self):
+        self.balancer.update_local("external:9000", 9001, 20, 0, 0)
+        self.balancer.apply(report("server2:8000", 0))
+        self.clock.now = 7
+        self.assertEqual(self.balancer.recommend().server, "server1:9000")
+        self.assertEqual(self.balancer.reports, {})
+
+    def test_malformed_reports_are_ignored(self):
+        self.assertFalse(self.balancer.apply(report("server1:9000", 0)))
+        self.assertFalse(self.balancer.apply(dict(report("server2:8000", 0), clients=-1)))
+        self.assertFalse(self.balancer.apply(dict(report("server2:8000", 0), loop_lag_ms=True)))
+        self.assertFalse(self.balancer.apply(dict(report("server2:8000", 0), address="")))
+        self.assertEqual(self.balancer.reports, {})
+
+    def test_redirects_only_when_overloaded(self):
+        self.balancer.update_local("external:9000", 9001, 0, 0, 0)
+        self.balancer.apply(report("server2:8000", 10))
+        self.assertIsNone(self.balancer.redirect_target(9))
+        self.assertIsNone(self.balancer.redirect_target(15))
+        self.assertEqual(self.balancer.redirect_target(16).server, "server2:8000")
+        self.assertEqual(self.balancer.redirects, 1)
+
+        # The redirected client counts towards the neighbour's load
+        self.assertIsNone(self.balancer.redirect_target(16))
+
+    def test_redirect_is_off_by_default(self):
+        balancer = LoadBalancer("server1:9000", min_clients=0)
+        balancer.update_local("external:9000", 9001, 100, 0, 0)
+        balancer.apply(report("server2:8000", 0))
+        self.assertIsNone(balancer.redirect_target(100))
+
+    def test_forget(self):
+        self.balancer.apply(report("server2:8000", 0))
+        self.balancer.forget("server2:8000")
+        self.assertIsNone(self.balancer.recommend())
+
+
+if __name__ == '__main__':
+    unittest.main()
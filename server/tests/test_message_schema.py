@@ -0,0 +1,95 @@
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from message_schema import OlafMessage, validate_message, MAX_PUBLIC_KEY_LENGTH
+
+
+class TestValidateMessage(unittest.TestCase):
+
+    def signed(self, data, counter=1):
+        return {
+            "type": "signed_data",
+            "data": data,
+            "counter": counter,
+            "signature": "c2lnbmF0dXJl"
+        }
+
+    def test_valid_hello(self):
+        message = self.signed({"type": "hello", "public_key": "-----BEGIN PUBLIC KEY-----"})
+        validated, error = validate_message(message)
+
+        self.assertIsNone(error)
+        self.assertIsInstance(validated, OlafMessage)
+        self.assertEqual(validated.type, "signed_data")
+        self.assertEqual(validated.data_type, "hello")
+        self.assertEqual(validated.counter, 1)
+        self.assertIs(validated.raw, message)
+
+    def test_valid_chat(self):
+        message = self.signed({
+            "type": "chat",
+            "destination_servers": ["localhost:9000"],
+            "iv": "aXY=",
+            "symm_keys": ["a2V5"],
+            "chat": "Y2hhdA=="
+        })
+        validated, error = validate_message(message)
+
+        self.assertIsNone(error)
+        self.assertEqual(validated.data["destination_servers"], ["localhost:9000"])
+
+    def test_valid_unsigned_types(self):
+        for message in (
+            {"type": "client_list_request"},
+            {"type": "client_update_request"},
+            {"type": "client_update", "clients": ["key"]},
+            {"type": "client_list", "servers": [{"address": "a", "clients": []}]},
+            {"type": "group_join", "group": "team"},
+            {"type": "load_report", "server": "a", "address": "b", "http_port": 1, "clients": 0, "send_queue": 0,
+             "loop_lag_ms": 0},
+            {"type": "group_update", "server": "a", "version": 1, "groups": [{"group": "team", "members": []}]},
+        ):
+            validated, error = validate_message(message)
+            self.assertIsNone(error, message)
+            self.assertIsNone(validated.data)
+
+    def test_extra_fields_are_allowed(self):
+        message = {"type": "client_list_request", "extension": True}
+        validated, error = validate_message(message)
+        self.assertIsNone(error)
+
+    def test_rejects_non_object(self):
+        for message in ([], "hello", 1, None):
+            validated, error = validate_message(message)
+            self.assertIsNone(validated)
+            self.assertIsNotNone(error)
+
+    def test_rejects_unknown_types(self):
+        self.assertIsNotNone(validate_message({"type": "unknown"})[1])
+        self.assertIsNotNone(validate_message(self.signed({"type": "unknown"}))[1])
+        self.assertIsNotNone(validate_message({"data": {"type": "hello"}})[1])
+
+    def test_rejects_missing_fields(self):
+        self.assertIsNotNone(validate_message({"type": "client_update"})[1])
+        self.assertIsNotNone(validate_message(self.signed({"type": "public_chat", "sender": "me"}))[1])
+
+        message = self.signed({"type": "hello", "public_key": "key"})
+        del message["signature"]
+        self.assertIsNotNone(validate_message(message)[1])
+
+    def test_rejects_wrong_types(self):
+        self.assertIsNotNone(validate_message(self.signed({"type": "hello", "public_key": ["key"]}))[1])
+        self.assertIsNotNone(validate_message(self.signed({"type": "hello", "public_key": "key"}, counter="1"))[1])
+        self.assertIsNotNone(validate_message(self.signed({"type": "hello", "public_key": "key"}, counter=True))[1])
+        self.assertIsNotNone(validate_message({"type": "client_update", "clients": [1, 2]})[1])
+
+    def test_rejects_oversized_fields(self):
+        oversized_key = "k" * (MAX_PUBLIC_KEY_LENGTH + 1)
+        self.assertIsNotNone(validate_message(self.signed({"type": "hello", "public_key": oversized_key}))[1])
+        self.assertIsNotNone(validate_message({"type": "client_update", "clients": [oversized_key]})[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
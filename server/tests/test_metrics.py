@@ -0,0 +1,71 @@
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from metrics import Metric, MetricsRegistry, ServerMetrics
+
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_counter(self):
+        counter = self.registry.counter("olaf_test_total", "A test counter.", ("type",))
+        child = counter.labels("chat")
+        child.inc()
+        child.inc(2)
+
+        text = self.registry.render()
+        self.assertIn("# TYPE olaf_test_total counter", text)
+        self.assertIn('olaf_test_total{type="chat"} 3', text)
+
+    def test_histogram(self):
+        histogram = self.registry.histogram("olaf_test_seconds", "A test histogram.", (), (0.1, 1.0))
+        child = histogram.labels()
+        child.observe(0.05)
+        child.observe(0.5)
+        child.observe(5)
+
+        text = self.registry.render()
+        self.assertIn('olaf_test_seconds_bucket{le="0.1"} 1', text)
+        self.assertIn('olaf_test_seconds_bucket{le="1"} 2', text)
+        self.assertIn('olaf_test_seconds_bucket{le="+Inf"} 3', text)
+        self.assertIn('olaf_test_seconds_count 3', text)
+
+    def test_callback(self):
+        self.registry.callback("olaf_test_clients", "Clients.", "gauge", lambda: 4)
+        self.registry.callback("olaf_test_rejected_total", "Rejections.", "counter",
+                               lambda: {"type_limit": 2}, ("reason",))
+        self.registry.callback("olaf_test_throttled_total", "Throttled.", "counter",
+                               lambda: {("client", "chat"): 1}, ("kind", "type"))
+
+        text = self.registry.render()
+        self.assertIn("olaf_test_clients 4", text)
+        self.assertIn('olaf_test_rejected_total{reason="type_limit"} 2', text)
+        self.assertIn('olaf_test_throttled_total{kind="client",type="chat"} 1', text)
+
+    def test_untyped(self):
+        metric = self.registry.register(Metric("olaf_test_untyped", "Untyped."))
+        metric.labels().set(1.5)
+
+        text = self.registry.render()
+        self.assertIn("# TYPE olaf_test_untyped untyped", text)
+        self.assertIn("olaf_test_untyped 1.5", text)
+
+    def test_label_escaping(self):
+        self.registry.counter("olaf_test_total", "Escaping.", ("type",)).labels('a"b\\c').inc()
+        self.assertIn('olaf_test_total{type="a\\"b\\\\c"} 1', self.registry.render())
+
+
+class TestServerMetrics(unittest.TestCase):
+
+    def test_children_are_pre_bound(self):
+        metrics = ServerMetrics()
+        self.assertIs(metrics.received("public_chat"), metrics.messages_received["public_chat"])
+        self.assertIs(metrics.sent("not_a_type"), metrics.messages_sent["other"])
+
+
+if __name__ == '__main__':
+    unittest.main()
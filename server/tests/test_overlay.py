@@ -0,0 +1,78 @@
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from overlay import LinkStateDatabase
+
+
+def link_state(origin, seq, neighbours, clients=None):
+    return {"type": "link_state", "origin": origin, "seq": seq, "neighbours": neighbours, "clients": clients or []}
+
+
+class TestLinkStateDatabase(unittest.TestCase):
+
+    def setUp(self):
+        # a - b - c - d, with a shortcut a - c
+        self.topology = {"a": ["b", "c"], "b": ["a", "c"], "c": ["a", "b", "d"], "d": ["c"]}
+        self.databases = {}
+        for server, neighbours in self.topology.items():
+            database = LinkStateDatabase(server)
+            database.originate(neighbours, [f"key-{server}"])
+            self.databases[server] = database
+        for database in self.databases.values():
+            for other in self.databases.values():
+                if other is not database:
+                    database.apply(other.messages()[0])
+
+    def test_apply_keeps_newest(self):
+        database = self.databases["a"]
+        seq = database.states["d"].seq
+        self.assertFalse(database.apply(link_state("d", seq, [])))
+        self.assertEqual(database.links("c"), ["a", "b", "d"])
+
+        self.assertTrue(database.apply(link_state("d", seq + 1, [])))
+        self.assertEqual(database.links("c"), ["a", "b"])
+        self.assertEqual(database.reachable(), {"a", "b", "c"})
+
+    def test_own_state_is_not_overwritten(self):
+        database = self.databases["a"]
+        self.assertFalse(database.apply(link_state("a", database.seq + 10, [])))
+
+    def test_one_sided_links_are_ignored(self):
+        database = LinkStateDatabase("a")
+        database.originate(["b"], [])
+        database.apply(link_state("b", 1, []))
+        self.assertEqual(database.reachable(), {"a"})
+
+    def test_public_chat_reaches_every_server_once(self):
+        for root in self.topology:
+            received = {root: 1}
+            pending = [root]
+            while pending:
+                server = pending.pop()
+                for child in self.databases[server].children(root):
+                    received[child] = received.get(child, 0) + 1
+                    pending.append(child)
+            self.assertEqual(received, {server: 1 for server in self.topology})
+
+    def test_chat_follows_shortest_path(self):
+        self.assertEqual(self.databases["a"].route("a", "d"), "c")
+        self.assertEqual(self.databases["c"].route("a", "d"), "d")
+        self.assertEqual(self.databases["b"].route("b", "d"), "c")
+        self.assertIsNone(self.databases["a"].route("a", "unknown"))
+
+    def test_route_falls_back_to_own_path(self):
+        # b is not on a's path to d, but still forwards towards d
+        self.assertIsNone(self.databases["b"].next_hop("a", "d"))
+        self.assertEqual(self.databases["b"].route("a", "d"), "c")
+
+    def test_server_limit(self):
+        database = LinkStateDatabase("a", max_servers=2)
+        database.originate([], [])
+        self.assertTrue(database.apply(link_state("b", 1, [])))
+        self.assertFalse(database.apply(link_state("c", 1, [])))
+
+
+if __name__ == '__main__':
+    unittest.main()
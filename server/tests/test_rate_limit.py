@@ -0,0 +1,130 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from rate_limit import TokenBucket, RateLimiter, parse_budgets
+from scheduler import FairScheduler
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_burst_then_refill(self):
+        now = 1.0
+        bucket = TokenBucket(rate=10, capacity=2, now=now)
+
+        self.assertTrue(bucket.consume(now))
+        self.assertTrue(bucket.consume(now))
+        self.assertFalse(bucket.consume(now))
+
+        # 0.1 seconds at 10 tokens per second refills one token
+        self.assertTrue(bucket.consume(now + 0.1))
+        self.assertFalse(bucket.consume(now + 0.1))
+
+    def test_capacity_is_capped(self):
+        bucket = TokenBucket(rate=10, capacity=2)
+        now = bucket.updated + 100
+        self.assertTrue(bucket.consume(now))
+        self.assertTrue(bucket.consume(now))
+        self.assertFalse(bucket.consume(now))
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_per_type_budget(self):
+        limiter = RateLimiter(client_budgets={"public_chat": (0.001, 2)})
+
+        self.assertTrue(limiter.allow("conn", "public_chat", False))
+        self.assertTrue(limiter.allow("conn", "public_chat", False))
+        self.assertFalse(limiter.allow("conn", "public_chat", False))
+
+        # Other types and other connections have their own budgets
+        self.assertTrue(limiter.allow("conn", "chat", False))
+        self.assertTrue(limiter.allow("other", "public_chat", False))
+        self.assertEqual(limiter.throttled, {("client", "public_chat"): 1})
+
+    def test_neighbour_budget_is_separate(self):
+        limiter = RateLimiter(client_budgets={"public_chat": (0.001, 1)},
+                              neighbour_budgets={"public_chat": (0.001, 3)})
+
+        self.assertTrue(limiter.allow("client", "public_chat", False))
+        self.assertFalse(limiter.allow("client", "public_chat", False))
+        for _ in range(3):
+            self.assertTrue(limiter.allow("neighbour", "public_chat", True))
+        self.assertFalse(limiter.allow("neighbour", "public_chat", True))
+
+    def test_connection_budget(self):
+        limiter = RateLimiter(client_budgets={"*": (0.001, 2)})
+        self.assertTrue(limiter.allow("conn", "chat", False))
+        self.assertTrue(limiter.allow("conn", "public_chat", False))
+        self.assertFalse(limiter.allow("conn", "client_list_request", False))
+
+    def test_made_up_types_are_counted_as_unknown(self):
+        limiter = RateLimiter(client_budgets={"*": (0.001, 1)})
+        limiter.allow("conn", "chat", False)
+        for i in range(100):
+            self.assertFalse(limiter.allow("conn", f"junk{i}", False))
+        self.assertFalse(limiter.allow("conn", None, False))
+        self.assertFalse(limiter.allow("conn", "chat", False))
+        self.assertEqual(limiter.throttled, {("client", "unknown"): 101, ("client", "chat"): 1})
+
+    def test_forget(self):
+        limiter = RateLimiter()
+        limiter.allow("conn", "chat", False)
+        limiter.forget("conn")
+        self.assertEqual(limiter.buckets, {})
+
+    def test_parse_budgets(self):
+        self.assertEqual(parse_budgets("public_chat=5:20,chat=3"), {"public_chat": (5.0, 20.0), "chat": (3.0, 3.0)})
+
+
+class TestFairScheduler(unittest.IsolatedAsyncioTestCase):
+
+    async def test_round_robin_across_connections(self):
+        scheduler = FairScheduler(workers=1, max_pending=10)
+        scheduler.start()
+        handled = []
+
+        async def handle(key, index):
+            handled.append((key, index))
+
+        for index in range(3):
+            await scheduler.submit("noisy", handle, "noisy", index)
+        await scheduler.submit("quiet", handle, "quiet", 0)
+
+        await asyncio.sleep(0.05)
+        await scheduler.stop()
+
+        # The quiet connection does not wait for the whole backlog of the noisy one
+        self.assertLess(handled.index(("quiet", 0)), 3)
+        self.assertEqual([entry for entry in handled if entry[0] == "noisy"],
+                         [("noisy", 0), ("noisy", 1), ("noisy", 2)])
+
+    async def test_runs_inline_when_not_started(self):
+        scheduler = FairScheduler()
+        handled = []
+
+        async def handle():
+            handled.append(True)
+
+        await scheduler.submit("conn", handle)
+        self.assertEqual(handled, [True])
+
+    async def test_last_item_drops_queue(self):
+        scheduler = FairScheduler(workers=2)
+        scheduler.start()
+
+        async def handle():
+            pass
+
+        await scheduler.submit("conn", handle)
+        await scheduler.submit("conn", handle, last=True)
+        await asyncio.sleep(0.05)
+        await scheduler.stop()
+
+        self.assertNotIn("conn", scheduler.queues)
+
+
+if __name__ == '__main__':
+    unittest.main()
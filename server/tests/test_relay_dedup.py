@@ -0,0 +1,73 @@
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from relay_dedup import RelayDedup, message_id, message_hops
+
+
+class Clock():
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestRelayDedup(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.dedup = RelayDedup(ttl=10, max_entries=4, max_hops=2, clock=self.clock)
+
+    def test_duplicates_are_dropped(self):
+        self.assertTrue(self.dedup.first_seen("a", "chat"))
+        self.assertFalse(self.dedup.first_seen("a", "chat"))
+        self.assertFalse(self.dedup.first_seen("a", "public_chat"))
+        self.assertEqual(self.dedup.duplicates, {"chat": 1, "public_chat": 1})
+
+    def test_ids_expire(self):
+        self.dedup.first_seen("a", "chat")
+        self.clock.now = 15
+        self.assertFalse(self.dedup.first_seen("a", "chat"))
+        self.clock.now = 40
+        self.assertTrue(self.dedup.first_seen("a", "chat"))
+
+    def test_memory_is_bounded(self):
+        for i in range(100):
+            self.assertTrue(self.dedup.first_seen(str(i), "chat"))
+        self.assertLessEqual(len(self.dedup), 4)
+        self.assertFalse(self.dedup.first_seen("99", "chat"))
+
+    def test_hop_limit(self):
+        self.assertTrue(self.dedup.may_forward(1))
+        self.assertFalse(self.dedup.may_forward(2))
+        self.assertEqual(self.dedup.hop_limited, 1)
+
+
+class TestMessageFields(unittest.TestCase):
+
+    def test_message_id(self):
+        message = {"signature": "abc"}
+        self.assertEqual(message_id(message), message_id({"signature": "abc", "hops": 1}))
+        self.assertNotEqual(message_id(message), message_id({"signature": "abd"}))
+        self.assertEqual(message_id({"signature": "abc", "msg_id": "xyz"}, from_neighbour=True), "xyz")
+        self.assertEqual(message_id({"signature": "abc", "msg_id": "x" * 100}, from_neighbour=True), message_id(message))
+
+    def test_client_cannot_pick_message_id(self):
+        self.assertEqual(message_id({"signature": "abc", "msg_id": "xyz"}), message_id({"signature": "abc"}))
+
+    def test_message_hops(self):
+        self.assertEqual(message_hops({}, from_neighbour=True), 0)
+        self.assertEqual(message_hops({"hops": 3}, from_neighbour=True), 3)
+        self.assertIsNone(message_hops({"hops": -1}, from_neighbour=True))
+        self.assertIsNone(message_hops({"hops": "3"}, from_neighbour=True))
+        self.assertIsNone(message_hops({"hops": True}, from_neighbour=True))
+
+    def test_client_messages_start_at_no_hops(self):
+        self.assertEqual(message_hops({"hops": 3}), 0)
+        self.assertEqual(message_hops({"hops": -1}), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import asyncio
+import logging
+import os
+import sys
+import time
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from tracing import SlowOperationTracer
+
+
+class TestSlowOperationTracer(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger("test_tracing")
+        self.logger.disabled = True
+
+    async def test_fast_operation_not_recorded(self):
+        tracer = SlowOperationTracer(threshold=0.05, stall_threshold=0, logger=self.logger)
+        tracer.start()
+        operation = tracer.begin("message", "public_chat")
+        duration = tracer.end(operation)
+
+        self.assertLess(duration, 0.05)
+        self.assertEqual(tracer.slowest(), [])
+        self.assertEqual(tracer.running, {})
+
+    async def test_slow_operation_keeps_stack(self):
+        tracer = SlowOperationTracer(threshold=0.02, stall_threshold=0, logger=self.logger)
+        tracer.start()
+
+        async def slow_handler():
+            operation = tracer.begin("message", "chat")
+            try:
+                await asyncio.sleep(0.05)
+            finally:
+                tracer.end(operation)
+
+        await slow_handler()
+        [record] = tracer.slowest()
+        self.assertEqual((record["kind"], record["name"]), ("message", "chat"))
+        self.assertGreaterEqual(record["duration"], 0.02)
+        self.assertIn("slow_handler", record["stack"])
+
+    async def test_loop_stall_snapshot(self):
+        tracer = SlowOperationTracer(threshold=0, stall_threshold=0.05, logger=self.logger)
+        tracer.start()
+        try:
+            await asyncio.sleep(0.05)
+            operation = tracer.begin("message", "client_update")
+            time.sleep(0.3)
+            tracer.end(operation)
+            await asyncio.sleep(0.2)
+        finally:
+            tracer.stop()
+
+        stalls = [record for record in tracer.slowest() if record["kind"] == "loop_stall"]
+        self.assertEqual(len(stalls), 1)
+        self.assertEqual(stalls[0]["name"], "message:client_update")
+        self.assertIn("test_loop_stall_snapshot", stalls[0]["stack"])
+
+    def test_slowest_is_sorted_and_bounded(self):
+        tracer = SlowOperationTracer(max_records=3, logger=self.logger)
+        for duration in (0.3, 0.1, 0.5, 0.2):
+            tracer.record("http", "GET /files", duration, None)
+
+        self.assertEqual([record["duration"] for record in tracer.slowest()], [0.5, 0.2, 0.1])
+        self.assertEqual(len(tracer.slowest(limit=1)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
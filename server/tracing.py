@@ -0,0 +1,216 @@
+import asyncio
+import io
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+from aiohttp import web
+
+DEFAULT_SLOW_THRESHOLD = 0.25
+DEFAULT_STALL_THRESHOLD = 0.1
+DEFAULT_MAX_RECORDS = 200
+STACK_LIMIT = 20
+
+
+class Operation():
+    """
+    A handler invocation being timed.
+    """
+    __slots__ = ('kind', 'name', 'started', 'task', 'timer', 'stack')
+
+    def __init__(self, kind: str, name: str, started: float, task):
+        self.kind = kind
+        self.name = name
+        self.started = started
+        self.task = task
+        self.timer = None
+        self.stack = None
+
+
+def format_task_stack(task) -> str | None:
+    """
+    Returns the stack a task is currently suspended in.
+    """
+    if task is None:
+        return None
+    buffer = io.StringIO()
+    task.print_stack(limit=STACK_LIMIT, file=buffer)
+    return buffer.getvalue()
+
+
+class SlowOperationTracer():
+    """
+    Times websocket message handlers and HTTP routes and keeps the slowest recent ones.
+
+    Two things are caught:
+    - Operations that take longer than threshold overall. The stack the operation
+      is suspended in when it crosses the threshold is kept with the record.
+    - Anything that blocks the event loop for longer than stall_threshold. A
+      watchdog thread notices the loop has stopped beating and takes a snapshot of
+      the loop thread's stack while it is still blocked.
+    """
+    def __init__(self, threshold: float = DEFAULT_SLOW_THRESHOLD, stall_threshold: float = DEFAULT_STALL_THRESHOLD,
+                 max_records: int = DEFAULT_MAX_RECORDS, logger: logging.Logger | None = None):
+        self.threshold = threshold
+        self.stall_threshold = stall_threshold
+        self.logger = logger or logging.getLogger(__name__)
+        self.records = deque(maxlen=max_records)
+
+        # { task : Operation } of operations in progress
+        self.running = {}
+
+        self.loop = None
+        self.loop_thread_id = None
+        self.heartbeat = time.monotonic()
+        self.heartbeat_handle = None
+        self.watchdog = None
+        self.stopped = threading.Event()
+
+    @classmethod
+    def from_env(cls, logger: logging.Logger | None = None) -> "SlowOperationTracer":
+        """
+        Builds a tracer from SLOW_OPERATION_THRESHOLD and LOOP_STALL_THRESHOLD (seconds, 0 disables).
+        """
+        return cls(
+            threshold=float(os.getenv('SLOW_OPERATION_THRESHOLD', DEFAULT_SLOW_THRESHOLD)),
+            stall_threshold=float(os.getenv('LOOP_STALL_THRESHOLD', DEFAULT_STALL_THRESHOLD)),
+            logger=logger,
+        )
+
+    def start(self) -> None:
+        """
+        Starts the loop heartbeat and the watchdog thread. Must be called from the event loop.
+        """
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        if self.stall_threshold <= 0:
+            return
+
+        self.beat()
+        self.stopped.clear()
+        self.watchdog = threading.Thread(target=self.watch, name="loop-watchdog", daemon=True)
+        self.watchdog.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.heartbeat_handle is not None:
+            self.heartbeat_handle.cancel()
+            self.heartbeat_handle = None
+
+    def beat(self) -> None:
+        """
+        Runs on the loop, several times per stall_threshold.
+        """
+        self.heartbeat = time.monotonic()
+        self.heartbeat_handle = self.loop.call_later(self.stall_threshold / 4, self.beat)
+
+    def watch(self) -> None:
+        """
+        Watchdog thread. Snapshots the loop thread while the loop is blocked.
+        """
+        stall = None
+        while not self.stopped.wait(self.stall_threshold / 2):
+            beat = self.heartbeat
+            blocked_for = time.monotonic() - beat
+
+            if blocked_for >= self.stall_threshold:
+                if stall is None or stall[0] != beat:
+                    stall = (beat, self.loop_thread_stack(), self.describe_running())
+            elif stall is not None:
+                # Loop is beating again. It was blocked until the first beat after the stall.
+                started, stack, operation = stall
+                duration = beat - started - self.stall_threshold / 4
+                self.record("loop_stall", operation, max(duration, self.stall_threshold), stack)
+                stall = None
+
+    def loop_thread_stack(self) -> str | None:
+        frame = sys._current_frames().get(self.loop_thread_id)
+        if frame is None:
+            return None
+        return "".join(traceback.format_stack(frame, limit=STACK_LIMIT))
+
+    def describe_running(self) -> str:
+        """
+        Names the operation running on the loop, if any. Called from the watchdog thread.
+        """
+        try:
+            task = asyncio.current_task(self.loop)
+        except RuntimeError:
+            task = None
+        if task is None:
+            return "callback"
+        operation = self.running.get(task)
+        if operation is None:
+            return f"task:{task.get_coro().__qualname__}"
+        return f"{operation.kind}:{operation.name}"
+
+    def begin(self, kind: str, name: str) -> Operation:
+        """
+        Starts timing an operation running in the current task.
+        """
+        task = asyncio.current_task()
+        operation = Operation(kind, name, time.perf_counter(), task)
+        if task is not None:
+            self.running[task] = operation
+            if self.threshold > 0 and self.loop is not None:
+                operation.timer = self.loop.call_later(self.threshold, self.snapshot, operation)
+        return operation
+
+    def snapshot(self, operation: Operation) -> None:
+        """
+        Keeps the stack of an operation that has just crossed the threshold.
+        """
+        operation.stack = format_task_stack(operation.task)
+
+    def end(self, operation: Operation) -> float:
+        """
+        Stops timing an operation.
+
+        Returns:
+            The duration of the operation in seconds.
+        """
+        duration = time.perf_counter() - operation.started
+        if operation.timer is not None:
+            operation.timer.cancel()
+        if operation.task is not None:
+            self.running.pop(operation.task, None)
+
+        if self.threshold > 0 and duration >= self.threshold:
+            self.record(operation.kind, operation.name, duration, operation.stack)
+        return duration
+
+    def record(self, kind: str, name: str, duration: float, stack: str | None) -> None:
+        """
+        Logs and keeps a slow operation.
+        """
+        self.records.append({
+            "kind": kind,
+            "name": name,
+            "duration": round(duration, 6),
+            "at": time.time(),
+            "stack": stack,
+        })
+        self.logger.warning(f"Slow {kind} {name} took {duration:.3f}s" + (f"\n{stack}" if stack else ""))
+
+    def slowest(self, limit: int = 20) -> list:
+        """
+        Returns the slowest recently recorded operations, slowest first.
+        """
+        return sorted(self.records, key=lambda record: record["duration"], reverse=True)[:limit]
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        """
+        aiohttp middleware timing every HTTP route.
+        """
+        route = request.match_info.route.resource
+        name = f"{request.method} {route.canonical if route is not None else request.path}"
+        operation = self.begin("http", name)
+        try:
+            return await handler(request)
+        finally:
+            self.end(operation)